@@ -1,30 +1,110 @@
 import json
 import os
+import threading
+import time
 import psycopg2
-from typing import Dict, Any
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+from contextlib import contextmanager
 from cryptography.fernet import Fernet
 import base64
 import hashlib
 
+try:
+    # В python-gateway функция лежит в пакете functions рядом с общим пулом соединений
+    from .db_pool import connection as pooled_connection
+except ImportError:
+    pooled_connection = None
+
+@contextmanager
+def db_connection(dsn: str):
+    """Соединение из общего пула шлюза, а в облачной функции — новое на каждый вызов."""
+    if pooled_connection is not None:
+        with pooled_connection(dsn) as conn:
+            yield conn
+        return
+    conn = psycopg2.connect(dsn)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
 def get_encryption_key() -> bytes:
     """Generate encryption key from environment variable"""
     secret = os.environ.get('ENCRYPTION_SECRET', 'default-secret-key-change-me')
     key = hashlib.sha256(secret.encode()).digest()
     return base64.urlsafe_b64encode(key)
 
+@lru_cache(maxsize=4)
+def _cipher_for(encryption_key: bytes) -> Fernet:
+    return Fernet(encryption_key)
+
+def get_cipher() -> Fernet:
+    """Fernet is built once per encryption key instead of on every call"""
+    return _cipher_for(get_encryption_key())
+
 def encrypt_value(value: str) -> str:
     """Encrypt API key or secret"""
-    f = Fernet(get_encryption_key())
-    return f.encrypt(value.encode()).decode()
+    return get_cipher().encrypt(value.encode()).decode()
 
 def decrypt_value(encrypted_value: str) -> str:
     """Decrypt API key or secret, return as-is if not encrypted"""
     try:
-        f = Fernet(get_encryption_key())
-        return f.decrypt(encrypted_value.encode()).decode()
+        return get_cipher().decrypt(encrypted_value.encode()).decode()
     except Exception:
         return encrypted_value
 
+API_KEYS_CACHE_TTL = float(os.environ.get('API_KEYS_CACHE_TTL', '300'))
+API_KEYS_CACHE_SIZE = int(os.environ.get('API_KEYS_CACHE_SIZE', '1000'))
+
+class CredentialCache:
+    """
+    Decrypted credentials keyed by (user_id, exchange), bounded by TTL and size.
+    Every entry remembers the ciphertext it was decrypted from and is used only while
+    the row still holds the same ciphertext. The row is read on every request, so keys
+    deleted or replaced through another process are never served; the cache saves decryption.
+    """
+    
+    def __init__(self, ttl: float = API_KEYS_CACHE_TTL, max_size: int = API_KEYS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # (user_id, exchange) -> (expires_at, (encrypted_key, encrypted_secret), (api_key, api_secret))
+        self._entries: 'OrderedDict[Tuple[int, str], Tuple[float, Tuple[str, str], Tuple[str, str]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+    
+    def decrypt(self, user_id: int, exchange: str, encrypted_key: str, encrypted_secret: str) -> Tuple[str, str]:
+        key = (user_id, exchange)
+        encrypted = (encrypted_key, encrypted_secret)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == encrypted and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[2]
+            self.counters['misses'] += 1
+        decrypted = (decrypt_value(encrypted_key), decrypt_value(encrypted_secret))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, encrypted, decrypted)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+        return decrypted
+    
+    def invalidate(self, user_id: int, exchange: Optional[str] = None) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id and (exchange is None or k[1] == exchange)]:
+                del self._entries[key]
+                self.counters['invalidations'] += 1
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+credential_cache = CredentialCache()
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Управление API ключами пользователей с шифрованием
@@ -69,110 +149,110 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    
-    try:
-        if method == 'GET':
-            params = event.get('queryStringParameters', {})
-            exchange = params.get('exchange', 'bybit')
-            
-            cur.execute(
-                "SELECT api_key, api_secret FROM t_p69937905_crypto_trading_bot.user_api_keys WHERE user_id = %s AND exchange = %s",
-                (user_id, exchange)
-            )
-            row = cur.fetchone()
+    with db_connection(dsn) as conn:
+        cur = conn.cursor()
+        
+        try:
+            if method == 'GET':
+                params = event.get('queryStringParameters', {})
+                exchange = params.get('exchange', 'bybit')
+                
+                cur.execute(
+                    "SELECT api_key, api_secret FROM t_p69937905_crypto_trading_bot.user_api_keys WHERE user_id = %s AND exchange = %s",
+                    (user_id, exchange)
+                )
+                row = cur.fetchone()
+                
+                if row:
+                    decrypted_key, decrypted_secret = credential_cache.decrypt(user_id, exchange, row[0], row[1])
+                    
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({
+                            'success': True,
+                            'api_key': decrypted_key,
+                            'api_secret': decrypted_secret
+                        }),
+                        'isBase64Encoded': False
+                    }
+                else:
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'success': False, 'error': 'Keys not found'}),
+                        'isBase64Encoded': False
+                    }
             
-            if row:
-                decrypted_key = decrypt_value(row[0])
-                decrypted_secret = decrypt_value(row[1])
+            elif method == 'POST':
+                body_data = json.loads(event.get('body', '{}'))
+                api_key = body_data.get('api_key')
+                api_secret = body_data.get('api_secret')
+                exchange = body_data.get('exchange', 'bybit')
+                
+                if not api_key or not api_secret:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'success': False, 'error': 'API key and secret required'}),
+                        'isBase64Encoded': False
+                    }
+                
+                encrypted_key = encrypt_value(api_key)
+                encrypted_secret = encrypt_value(api_secret)
+                
+                cur.execute(
+                    "SELECT id FROM t_p69937905_crypto_trading_bot.user_api_keys WHERE user_id = %s AND exchange = %s",
+                    (user_id, exchange)
+                )
+                existing = cur.fetchone()
+                
+                if existing:
+                    cur.execute(
+                        "UPDATE t_p69937905_crypto_trading_bot.user_api_keys SET api_key = %s, api_secret = %s, updated_at = NOW() WHERE user_id = %s AND exchange = %s",
+                        (encrypted_key, encrypted_secret, user_id, exchange)
+                    )
+                else:
+                    cur.execute(
+                        "INSERT INTO t_p69937905_crypto_trading_bot.user_api_keys (user_id, exchange, api_key, api_secret, created_at, updated_at) VALUES (%s, %s, %s, %s, NOW(), NOW())",
+                        (user_id, exchange, encrypted_key, encrypted_secret)
+                    )
+                
+                conn.commit()
+                credential_cache.invalidate(user_id, exchange)
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'api_key': decrypted_key,
-                        'api_secret': decrypted_secret
-                    }),
+                    'body': json.dumps({'success': True}),
                     'isBase64Encoded': False
                 }
-            else:
+            
+            elif method == 'DELETE':
+                params = event.get('queryStringParameters', {})
+                exchange = params.get('exchange', 'bybit')
+                
+                cur.execute(
+                    "DELETE FROM t_p69937905_crypto_trading_bot.user_api_keys WHERE user_id = %s AND exchange = %s",
+                    (user_id, exchange)
+                )
+                conn.commit()
+                credential_cache.invalidate(user_id, exchange)
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': False, 'error': 'Keys not found'}),
+                    'body': json.dumps({'success': True}),
                     'isBase64Encoded': False
                 }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            api_key = body_data.get('api_key')
-            api_secret = body_data.get('api_secret')
-            exchange = body_data.get('exchange', 'bybit')
             
-            if not api_key or not api_secret:
+            else:
                 return {
-                    'statusCode': 400,
+                    'statusCode': 405,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': False, 'error': 'API key and secret required'}),
+                    'body': json.dumps({'success': False, 'error': 'Method not allowed'}),
                     'isBase64Encoded': False
                 }
-            
-            encrypted_key = encrypt_value(api_key)
-            encrypted_secret = encrypt_value(api_secret)
-            
-            cur.execute(
-                "SELECT id FROM t_p69937905_crypto_trading_bot.user_api_keys WHERE user_id = %s AND exchange = %s",
-                (user_id, exchange)
-            )
-            existing = cur.fetchone()
-            
-            if existing:
-                cur.execute(
-                    "UPDATE t_p69937905_crypto_trading_bot.user_api_keys SET api_key = %s, api_secret = %s, updated_at = NOW() WHERE user_id = %s AND exchange = %s",
-                    (encrypted_key, encrypted_secret, user_id, exchange)
-                )
-            else:
-                cur.execute(
-                    "INSERT INTO t_p69937905_crypto_trading_bot.user_api_keys (user_id, exchange, api_key, api_secret, created_at, updated_at) VALUES (%s, %s, %s, %s, NOW(), NOW())",
-                    (user_id, exchange, encrypted_key, encrypted_secret)
-                )
-            
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'DELETE':
-            params = event.get('queryStringParameters', {})
-            exchange = params.get('exchange', 'bybit')
-            
-            cur.execute(
-                "DELETE FROM t_p69937905_crypto_trading_bot.user_api_keys WHERE user_id = %s AND exchange = %s",
-                (user_id, exchange)
-            )
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
         
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': False, 'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
-    
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        finally:
+            cur.close()
\ No newline at end of file
@@ -1,9 +1,61 @@
 import json
 import os
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+
+try:
+    # В python-gateway функция лежит в пакете functions рядом с общей библиотекой индикаторов
+    from .indicators import ema as np_ema, rsi as np_rsi, to_optional_list
+except ImportError:
+    np_ema = np_rsi = None
+
+try:
+    # Потоковые EMA/RSI с состоянием — для инкрементального расчёта по новым свечам
+    from .indicator_state import EMAState, RSIState
+except ImportError:
+    EMAState = RSIState = None
+
+try:
+    # В python-gateway функция лежит в пакете functions рядом с общим пулом соединений
+    from .db_pool import connection as pooled_connection
+except ImportError:
+    pooled_connection = None
+
+@contextmanager
+def db_connection(dsn: str):
+    """Соединение из общего пула шлюза, а в облачной функции — новое на каждый вызов."""
+    if pooled_connection is not None:
+        with pooled_connection(dsn) as conn:
+            yield conn
+        return
+    conn = psycopg2.connect(dsn)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+# Длительность свечи по интервалу Bybit (мс) — для восстановления времени свечей без timestamps
+INTERVAL_MS = {
+    '1': 60_000, '3': 180_000, '5': 300_000, '15': 900_000, '30': 1_800_000,
+    '60': 3_600_000, '120': 7_200_000, '240': 14_400_000, '360': 21_600_000,
+    '720': 43_200_000, 'D': 86_400_000, 'W': 604_800_000,
+}
+
+def candle_times(count: int, interval: str) -> List[int]:
+    """
+    Времена открытия свечей, если клиент не прислал timestamps:
+    последняя цена считается текущей свечой, время округляется вниз до интервала
+    """
+    step = INTERVAL_MS.get(interval, INTERVAL_MS['15'])
+    last = int(time.time() * 1000) // step * step
+    return [last - (count - 1 - i) * step for i in range(count)]
 
 def calculate_ema(prices: List[float], period: int) -> List[Optional[float]]:
     """
@@ -12,6 +64,9 @@ def calculate_ema(prices: List[float], period: int) -> List[Optional[float]]:
     if len(prices) < period:
         return [None] * len(prices)
     
+    if np_ema is not None:
+        return to_optional_list(np_ema(prices, period))
+    
     multiplier = 2 / (period + 1)
     ema_values = [None] * (period - 1)
     
@@ -33,6 +88,9 @@ def calculate_rsi(prices: List[float], period: int = 14) -> List[Optional[float]
     if len(prices) < period + 1:
         return [None] * len(prices)
     
+    if np_rsi is not None:
+        return to_optional_list(np_rsi(prices, period))
+    
     rsi_values = [None] * period
     
     # Расчет изменений цены
@@ -64,14 +122,51 @@ def calculate_rsi(prices: List[float], period: int = 14) -> List[Optional[float]
     
     return rsi_values
 
+def crossover_type(
+    prev_ema9: float,
+    prev_ema21: float,
+    ema9: float,
+    ema21: float,
+    rsi: float
+) -> Optional[str]:
+    # Сигнал на покупку: EMA9 пересекает EMA21 вверх + RSI > 50
+    if prev_ema9 <= prev_ema21 and ema9 > ema21 and rsi > 50:
+        return 'BUY'
+    # Сигнал на продажу: EMA9 пересекает EMA21 вниз или RSI < 50
+    if prev_ema9 >= prev_ema21 and ema9 < ema21:
+        return 'SELL'
+    return None
+
+def make_signal(
+    index: int,
+    signal_type: str,
+    price: float,
+    ema9: float,
+    ema21: float,
+    rsi: float,
+    candle_time: int
+) -> Dict[str, Any]:
+    return {
+        'index': index,
+        'type': signal_type,
+        'price': price,
+        'ema9': ema9,
+        'ema21': ema21,
+        'rsi': rsi,
+        'candle_time': candle_time,
+        'timestamp': datetime.fromtimestamp(candle_time / 1000, tz=timezone.utc).isoformat()
+    }
+
 def detect_signals(
     prices: List[float],
     ema9: List[Optional[float]],
     ema21: List[Optional[float]],
-    rsi: List[Optional[float]]
+    rsi: List[Optional[float]],
+    timestamps: List[int]
 ) -> List[Dict[str, Any]]:
     """
     Определяет сигналы входа/выхода на основе стратегии MA Crossover + RSI
+    timestamps — время открытия свечи (мс) для каждой цены
     """
     signals = []
     
@@ -82,32 +177,95 @@ def detect_signals(
         if ema9[i-1] is None or ema21[i-1] is None or rsi[i-1] is None:
             continue
         
-        # Сигнал на покупку: EMA9 пересекает EMA21 вверх + RSI > 50
-        if ema9[i-1] <= ema21[i-1] and ema9[i] > ema21[i] and rsi[i] > 50:
-            signals.append({
-                'index': i,
-                'type': 'BUY',
-                'price': prices[i],
-                'ema9': ema9[i],
-                'ema21': ema21[i],
-                'rsi': rsi[i],
-                'timestamp': datetime.now().isoformat()
-            })
-        
-        # Сигнал на продажу: EMA9 пересекает EMA21 вниз или RSI < 50
-        elif ema9[i-1] >= ema21[i-1] and ema9[i] < ema21[i]:
-            signals.append({
-                'index': i,
-                'type': 'SELL',
-                'price': prices[i],
-                'ema9': ema9[i],
-                'ema21': ema21[i],
-                'rsi': rsi[i],
-                'timestamp': datetime.now().isoformat()
-            })
+        signal_type = crossover_type(ema9[i-1], ema21[i-1], ema9[i], ema21[i], rsi[i])
+        if signal_type:
+            signals.append(make_signal(i, signal_type, prices[i], ema9[i], ema21[i], rsi[i], timestamps[i]))
     
     return signals
 
+# Стратегия в strategy_signals: сигналы этой функции не пересекаются с сигналами ботов (V0014)
+SIGNAL_STRATEGY = 'ma-crossover-strategy'
+
+# Водяные знаки по (user, symbol, interval): последняя закрытая свеча, уже учтённая
+# в состоянии индикаторов, и само состояние. Следующий вызов считает только новые свечи.
+WATERMARK_CACHE_SIZE = int(os.environ.get('SIGNAL_WATERMARK_CACHE_SIZE', '1000'))
+_watermarks: 'OrderedDict[Tuple[str, str, str], Dict[str, Any]]' = OrderedDict()
+_watermarks_lock = threading.Lock()
+
+def new_watermark() -> Dict[str, Any]:
+    return {
+        'time': None,
+        'ema9': EMAState(9),
+        'ema21': EMAState(21),
+        'rsi': RSIState(14),
+        'prev': (None, None, None),
+        # Последние закрытые свечи: (время, цена, (ema9, ema21, rsi)) — для проверки
+        # согласованности истории и поля indicators в ответе
+        'history': deque(maxlen=10)
+    }
+
+def evaluate_incremental(
+    key: Tuple[str, str, str],
+    prices: List[float],
+    timestamps: List[int]
+) -> Tuple[List[Dict[str, Any]], Dict[str, List[Optional[float]]], bool]:
+    """
+    Считает сигналы только по свечам новее водяного знака.
+    Последняя свеча считается формирующейся: она оценивается, но в состояние не записывается.
+    Если свеча водяного знака не найдена в истории или цены последних учтённых свечей
+    изменились, состояние пересчитывается по всей присланной истории.
+    Возвращает (сигналы, последние значения индикаторов, был ли расчёт инкрементальным)
+    """
+    with _watermarks_lock:
+        wm = _watermarks.get(key)
+        start = 0
+        incremental = False
+        if wm is not None and wm['time'] is not None:
+            i = bisect_left(timestamps, wm['time'])
+            if i < len(timestamps) - 1 and timestamps[i] == wm['time']:
+                offset = i - len(wm['history']) + 1
+                incremental = all(
+                    offset + k < 0 or (timestamps[offset + k] == t and prices[offset + k] == close)
+                    for k, (t, close, _) in enumerate(wm['history'])
+                )
+                start = i + 1 if incremental else 0
+        if not incremental:
+            wm = new_watermark()
+        
+        signals = []
+        last = len(prices) - 1
+        for i in range(start, last + 1):
+            price = prices[i]
+            if i < last:
+                values = (wm['ema9'].update(price), wm['ema21'].update(price), wm['rsi'].update(price))
+            else:
+                values = (wm['ema9'].peek(price), wm['ema21'].peek(price), wm['rsi'].peek(price))
+            
+            prev = wm['prev']
+            if None not in values and None not in prev:
+                signal_type = crossover_type(prev[0], prev[1], values[0], values[1], values[2])
+                if signal_type:
+                    signals.append(make_signal(i, signal_type, price, *values, timestamps[i]))
+            
+            if i < last:
+                wm['prev'] = values
+                wm['time'] = timestamps[i]
+                wm['history'].append((timestamps[i], price, values))
+        
+        history = [item[2] for item in wm['history']] + [values]
+        _watermarks[key] = wm
+        _watermarks.move_to_end(key)
+        while len(_watermarks) > WATERMARK_CACHE_SIZE:
+            _watermarks.popitem(last=False)
+    
+    history = history[-10:]
+    indicators = {
+        'ema9': [v[0] for v in history],
+        'ema21': [v[1] for v in history],
+        'rsi': [v[2] for v in history]
+    }
+    return signals, indicators, incremental
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Обработчик стратегии MA Crossover + RSI
@@ -134,8 +292,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             body_data = json.loads(event.get('body', '{}'))
             
             prices = body_data.get('prices', [])
+            timestamps = body_data.get('timestamps')
             symbol = body_data.get('symbol', 'BTCUSDT')
-            user_id = event.get('headers', {}).get('X-User-Id', '1')
+            interval = str(body_data.get('interval', '15'))
+            headers = event.get('headers') or {}
+            # В шлюзе заголовки приходят в нижнем регистре
+            user_id = headers.get('X-User-Id') or headers.get('x-user-id') or '1'
             
             if not prices or len(prices) < 30:
                 return {
@@ -147,40 +309,72 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     })
                 }
             
-            # Рассчитываем индикаторы
-            ema9 = calculate_ema(prices, 9)
-            ema21 = calculate_ema(prices, 21)
-            rsi = calculate_rsi(prices, 14)
+            if timestamps is not None and len(timestamps) != len(prices):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'success': False,
+                        'error': 'timestamps должны соответствовать prices по длине'
+                    })
+                }
+            timestamps = [int(t) for t in timestamps] if timestamps is not None else candle_times(len(prices), interval)
             
-            # Определяем сигналы
-            signals = detect_signals(prices, ema9, ema21, rsi)
+            if EMAState is not None and not body_data.get('full'):
+                # Только свечи новее последней обработанной для этого пользователя и символа
+                signals, indicators, incremental = evaluate_incremental(
+                    (str(user_id), symbol, interval), prices, timestamps
+                )
+            else:
+                # Рассчитываем индикаторы
+                ema9 = calculate_ema(prices, 9)
+                ema21 = calculate_ema(prices, 21)
+                rsi = calculate_rsi(prices, 14)
+                
+                # Определяем сигналы
+                signals = detect_signals(prices, ema9, ema21, rsi, timestamps)
+                indicators = {
+                    'ema9': ema9[-10:],  # Последние 10 значений
+                    'ema21': ema21[-10:],
+                    'rsi': rsi[-10:]
+                }
+                incremental = False
             
-            # Сохраняем сигналы в БД (опционально)
+            # Сохраняем сигналы в БД (опционально) одним запросом; сигналы свечей,
+            # уже сохранённые прошлыми вызовами, пропускаются по уникальному индексу
+            saved = 0
             if signals:
                 try:
                     dsn = os.environ.get('DATABASE_URL')
-                    conn = psycopg2.connect(dsn)
-                    cursor = conn.cursor()
-                    
-                    for signal in signals:
-                        cursor.execute("""
+                    with db_connection(dsn) as conn:
+                        cursor = conn.cursor()
+                        inserted = execute_values(cursor, """
                             INSERT INTO strategy_signals 
-                            (user_id, symbol, signal_type, price, ema9, ema21, rsi, signal_data, created_at)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                        """, (
-                            user_id,
-                            symbol,
-                            signal['type'],
-                            signal['price'],
-                            signal['ema9'],
-                            signal['ema21'],
-                            signal['rsi'],
-                            json.dumps(signal)
-                        ))
-                    
-                    conn.commit()
-                    cursor.close()
-                    conn.close()
+                            (user_id, symbol, signal_type, price, ema9, ema21, rsi, signal_data, candle_time,
+                             strategy, candle_interval)
+                            VALUES %s
+                            ON CONFLICT (user_id, symbol, candle_time, signal_type, strategy, candle_interval, bot_id) DO NOTHING
+                            RETURNING id
+                        """, [
+                            (
+                                user_id,
+                                symbol,
+                                signal['type'],
+                                signal['price'],
+                                signal['ema9'],
+                                signal['ema21'],
+                                signal['rsi'],
+                                json.dumps(signal),
+                                signal['candle_time'],
+                                SIGNAL_STRATEGY,
+                                interval
+                            )
+                            for signal in signals
+                        ], page_size=1000, fetch=True)
+                        saved = len(inserted)
+                        
+                        conn.commit()
+                        cursor.close()
                 except Exception as db_error:
                     print(f"DB Error: {db_error}")
             
@@ -190,11 +384,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({
                     'success': True,
                     'signals': signals,
-                    'indicators': {
-                        'ema9': ema9[-10:],  # Последние 10 значений
-                        'ema21': ema21[-10:],
-                        'rsi': rsi[-10:]
-                    }
+                    'savedSignals': saved,
+                    'incremental': incremental,
+                    'indicators': indicators
                 })
             }
         
@@ -205,19 +397,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             limit = int(event.get('queryStringParameters', {}).get('limit', '10'))
             
             dsn = os.environ.get('DATABASE_URL')
-            conn = psycopg2.connect(dsn)
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
-            cursor.execute("""
-                SELECT * FROM strategy_signals 
-                WHERE user_id = %s AND symbol = %s
-                ORDER BY created_at DESC 
-                LIMIT %s
-            """, (user_id, symbol, limit))
-            
-            signals = cursor.fetchall()
-            cursor.close()
-            conn.close()
+            with db_connection(dsn) as conn:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                
+                cursor.execute("""
+                    SELECT * FROM strategy_signals 
+                    WHERE user_id = %s AND symbol = %s
+                    ORDER BY created_at DESC 
+                    LIMIT %s
+                """, (user_id, symbol, limit))
+                
+                signals = cursor.fetchall()
+                cursor.close()
             
             # Преобразуем datetime в строки
             for signal in signals:
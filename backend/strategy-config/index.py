@@ -1,9 +1,197 @@
+import hashlib
 import json
+import logging
 import os
-from typing import Dict, Any
+import select
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from contextlib import contextmanager
 import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from psycopg2.extras import RealDictCursor
 
+try:
+    # В python-gateway функция лежит в пакете functions рядом с общим пулом соединений
+    from .db_pool import connection as pooled_connection
+except ImportError:
+    pooled_connection = None
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def db_connection(dsn: str):
+    '''Соединение из общего пула шлюза, а в облачной функции — новое на каждый вызов.'''
+    if pooled_connection is not None:
+        with pooled_connection(dsn) as conn:
+            yield conn
+        return
+    conn = psycopg2.connect(dsn)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+# Кэш настроек по пользователю. Используется, только пока жив LISTEN-поток:
+# триггер из V0013 шлёт NOTIFY strategy_config_changed с user_id при любом изменении,
+# и запись пользователя сбрасывается. Без LISTEN каждый GET идёт в базу, как раньше.
+# Только в шлюзе: замороженный между вызовами экземпляр облачной функции не читает
+# уведомления и после пробуждения отдал бы устаревшие настройки.
+STRATEGY_CONFIG_LISTEN = (os.environ.get('STRATEGY_CONFIG_LISTEN', '1') == '1'
+                          and pooled_connection is not None)
+STRATEGY_CONFIG_CACHE_SIZE = int(os.environ.get('STRATEGY_CONFIG_CACHE_SIZE', '10000'))
+# Как часто (сек) писать в лог ошибки LISTEN-соединения; остальные только считаются
+STRATEGY_CONFIG_ERROR_LOG_INTERVAL = float(os.environ.get('STRATEGY_CONFIG_ERROR_LOG_INTERVAL', '60'))
+NOTIFY_CHANNEL = 'strategy_config_changed'
+
+ConfigRows = List[Tuple[str, Any]]
+
+class ConfigCache:
+    def __init__(self, max_size: int = STRATEGY_CONFIG_CACHE_SIZE):
+        self.max_size = max_size
+        self.listening = False
+        self._entries: Dict[int, ConfigRows] = {}
+        # Поколение пользователя растёт при каждом сбросе — чтение из базы,
+        # начатое до изменения, не положит в кэш устаревшие данные
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'listenReconnects': 0,
+            'listenErrors': 0,
+        }
+    
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+    
+    def get(self, user_id: int) -> Tuple[Optional[ConfigRows], int]:
+        with self._lock:
+            generation = self._generations.get(user_id, 0)
+            rows = self._entries.get(user_id) if self.listening else None
+            self.counters['hits' if rows is not None else 'misses'] += 1
+            return rows, generation
+    
+    def set(self, user_id: int, rows: ConfigRows, generation: int) -> None:
+        with self._lock:
+            if not self.listening or self._generations.get(user_id, 0) != generation:
+                return
+            if len(self._entries) >= self.max_size and user_id not in self._entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[user_id] = rows
+    
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.counters['invalidations'] += 1
+    
+    def reset(self, listening: bool) -> None:
+        with self._lock:
+            self._entries.clear()
+            for user_id in self._generations:
+                self._generations[user_id] += 1
+            self.listening = listening
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'listening': self.listening, 'users': len(self._entries), **self.counters}
+
+config_cache = ConfigCache()
+_listener_pid: Optional[int] = None
+_listener_lock = threading.Lock()
+
+def listen_for_changes(dsn: str) -> None:
+    '''Держит отдельное соединение с LISTEN и сбрасывает кэш по уведомлениям; переподключается при обрыве.'''
+    backoff = 1.0
+    error_logged_at = None
+    connected_before = False
+    while True:
+        conn = None
+        if connected_before:
+            config_cache.count('listenReconnects')
+        connected_before = True
+        try:
+            conn = psycopg2.connect(dsn)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+            # Пока соединения не было, уведомления могли потеряться — начинаем с пустого кэша
+            config_cache.reset(listening=True)
+            backoff = 1.0
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        config_cache.invalidate(int(notify.payload))
+                    except ValueError:
+                        config_cache.reset(listening=True)
+        except Exception:
+            config_cache.count('listenErrors')
+            now = time.monotonic()
+            if error_logged_at is None or now - error_logged_at >= STRATEGY_CONFIG_ERROR_LOG_INTERVAL:
+                error_logged_at = now
+                logger.exception('strategy-config LISTEN connection failed, reconnecting in %.0fs', backoff)
+        finally:
+            config_cache.reset(listening=False)
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    # Соединение уже оборвано — закрыть его можно не всегда
+                    logger.debug('strategy-config LISTEN close failed', exc_info=True)
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+def ensure_listener(dsn: str) -> None:
+    global _listener_pid
+    # После fork у воркера своего LISTEN-потока нет — запускаем заново
+    if not STRATEGY_CONFIG_LISTEN or _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            config_cache.reset(listening=False)
+            threading.Thread(target=listen_for_changes, args=(dsn,), daemon=True,
+                             name='strategy-config-listen').start()
+            _listener_pid = os.getpid()
+
+def load_configs(dsn: str, user_id: int) -> ConfigRows:
+    rows, generation = config_cache.get(user_id)
+    if rows is not None:
+        return rows
+    with db_connection(dsn) as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        # Порядок фиксирован, чтобы ETag не зависел от порядка строк в таблице
+        cursor.execute(
+            'SELECT strategy_name, config_data FROM strategy_configs WHERE user_id = %s ORDER BY strategy_name',
+            (user_id,)
+        )
+        rows = [(row['strategy_name'], row['config_data']) for row in cursor.fetchall()]
+        cursor.close()
+    config_cache.set(user_id, rows, generation)
+    return rows
+
+def json_response(status: int, payload: Dict[str, Any], request_headers: Dict[str, str]) -> Dict[str, Any]:
+    '''Ответ с ETag; если клиент прислал тот же If-None-Match — 304 без тела.'''
+    body = json.dumps(payload)
+    etag = '"' + hashlib.sha1(body.encode('utf-8')).hexdigest()[:20] + '"'
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'ETag': etag,
+        'Cache-Control': 'no-cache'
+    }
+    if_none_match = request_headers.get('If-None-Match') or request_headers.get('if-none-match')
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    return {'statusCode': status, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Управляет настройками торговых стратегий пользователя
@@ -18,15 +206,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    query_params = event.get('queryStringParameters') or {}
+    if method == 'GET' and query_params.get('action') == 'stats':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'success': True, 'data': {'configCache': config_cache.stats()}}),
+            'isBase64Encoded': False
+        }
+    
     headers = event.get('headers', {})
-    user_id = headers.get('X-User-Id')
+    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
     
     if not user_id:
         return {
@@ -45,34 +242,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = None
     try:
-        conn = psycopg2.connect(dsn)
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        ensure_listener(dsn)
         
         if method == 'GET':
-            query_params = event.get('queryStringParameters', {})
-            strategy_name = query_params.get('strategy') if query_params else None
+            strategy_name = query_params.get('strategy')
+            rows = load_configs(dsn, int(user_id))
             
             if strategy_name:
-                cursor.execute(
-                    'SELECT strategy_name, config_data FROM strategy_configs WHERE user_id = %s AND strategy_name = %s',
-                    (int(user_id), strategy_name)
-                )
-                row = cursor.fetchone()
+                row = next((row for row in rows if row[0] == strategy_name), None)
                 if row:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'success': True,
-                            'config': {
-                                'strategy_name': row['strategy_name'],
-                                'config': row['config_data']
-                            }
-                        }),
-                        'isBase64Encoded': False
-                    }
+                    return json_response(200, {
+                        'success': True,
+                        'config': {
+                            'strategy_name': row[0],
+                            'config': row[1]
+                        }
+                    }, headers)
                 else:
                     return {
                         'statusCode': 404,
@@ -81,18 +267,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
             else:
-                cursor.execute(
-                    'SELECT strategy_name, config_data FROM strategy_configs WHERE user_id = %s',
-                    (int(user_id),)
-                )
-                rows = cursor.fetchall()
-                configs = [{'strategy_name': row['strategy_name'], 'config': row['config_data']} for row in rows]
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'configs': configs}),
-                    'isBase64Encoded': False
-                }
+                configs = [{'strategy_name': row[0], 'config': row[1]} for row in rows]
+                return json_response(200, {'success': True, 'configs': configs}, headers)
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
@@ -107,24 +283,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            # Check if config exists
-            cursor.execute(
-                'SELECT id FROM strategy_configs WHERE user_id = %s AND strategy_name = %s',
-                (int(user_id), strategy_name)
-            )
-            existing = cursor.fetchone()
-            
-            if existing:
+            with db_connection(dsn) as conn:
+                cursor = conn.cursor()
+                # Один запрос вместо SELECT + UPDATE/INSERT (уникальный индекс из V0013)
                 cursor.execute(
-                    'UPDATE strategy_configs SET config_data = %s, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s AND strategy_name = %s',
-                    (json.dumps(config_data), int(user_id), strategy_name)
-                )
-            else:
-                cursor.execute(
-                    'INSERT INTO strategy_configs (user_id, strategy_name, config_data, updated_at) VALUES (%s, %s, %s, CURRENT_TIMESTAMP)',
+                    """
+                    INSERT INTO strategy_configs (user_id, strategy_name, config_data, updated_at)
+                    VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id, strategy_name)
+                    DO UPDATE SET config_data = EXCLUDED.config_data, updated_at = CURRENT_TIMESTAMP
+                    """,
                     (int(user_id), strategy_name, json.dumps(config_data))
                 )
-            conn.commit()
+                conn.commit()
+                cursor.close()
+            config_cache.invalidate(int(user_id))
             
             return {
                 'statusCode': 200,
@@ -147,7 +320,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'success': False, 'error': str(e)}),
             'isBase64Encoded': False
-        }
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        }
\ No newline at end of file
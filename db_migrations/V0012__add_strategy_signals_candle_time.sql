@@ -0,0 +1,7 @@
+-- Время свечи сигнала (мс, UTC) и уникальность сигнала в пределах свечи,
+-- чтобы повторный расчёт по той же истории не дублировал сигналы
+ALTER TABLE strategy_signals ADD COLUMN IF NOT EXISTS candle_time BIGINT;
+
+-- Старые строки остаются с candle_time = NULL и в уникальность не попадают
+CREATE UNIQUE INDEX IF NOT EXISTS uq_strategy_signals_candle
+    ON strategy_signals(user_id, symbol, candle_time, signal_type);
@@ -0,0 +1,24 @@
+-- Одна запись на (пользователь, стратегия): убираем дубли, оставляя самую свежую,
+-- и добавляем уникальный индекс для INSERT ... ON CONFLICT
+DELETE FROM strategy_configs a
+USING strategy_configs b
+WHERE a.user_id = b.user_id
+  AND a.strategy_name = b.strategy_name
+  AND (COALESCE(a.updated_at, a.created_at), a.id) < (COALESCE(b.updated_at, b.created_at), b.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_strategy_configs_user_strategy
+    ON strategy_configs(user_id, strategy_name);
+
+-- Уведомление об изменении настроек пользователя (payload — user_id),
+-- по нему функция strategy-config сбрасывает свой кэш
+CREATE OR REPLACE FUNCTION notify_strategy_config_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('strategy_config_changed', COALESCE(NEW.user_id, OLD.user_id)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_strategy_config_changed ON strategy_configs;
+CREATE TRIGGER trg_strategy_config_changed
+    AFTER INSERT OR UPDATE OR DELETE ON strategy_configs
+    FOR EACH ROW EXECUTE FUNCTION notify_strategy_config_change();
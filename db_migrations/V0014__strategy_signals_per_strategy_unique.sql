@@ -0,0 +1,12 @@
+-- Уникальность сигнала в пределах свечи с учётом стратегии, интервала и бота:
+-- боты одного пользователя на одной паре с разными стратегиями или интервалами
+-- (и сигналы ma-crossover-strategy) больше не отсекают сигналы друг друга
+ALTER TABLE strategy_signals ADD COLUMN IF NOT EXISTS strategy VARCHAR(100) NOT NULL DEFAULT '';
+ALTER TABLE strategy_signals ADD COLUMN IF NOT EXISTS candle_interval VARCHAR(10) NOT NULL DEFAULT '';
+ALTER TABLE strategy_signals ADD COLUMN IF NOT EXISTS bot_id VARCHAR(50) NOT NULL DEFAULT '';
+
+-- Пустые значения по умолчанию (не NULL), чтобы строки без бота тоже участвовали в уникальности
+CREATE UNIQUE INDEX IF NOT EXISTS uq_strategy_signals_candle_strategy
+    ON strategy_signals(user_id, symbol, candle_time, signal_type, strategy, candle_interval, bot_id);
+
+DROP INDEX IF EXISTS uq_strategy_signals_candle;
@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 
-const FUNCTION_URL = 'https://functions.poehali.dev/9df677d4-5f06-4a52-b9bd-85ad44e095a3';
+const FUNCTION_URL = 'https://function.centerai.tech/api/ma-crossover-strategy';
 
 export interface MACrossoverSignal {
   index: number;
@@ -1,7 +1,8 @@
 import json
 import os
 from typing import Dict, Any
-from urllib.request import Request, urlopen
+
+from .bot_scheduler import BOT_SCHEDULER_ENABLED, call_bot_executor, get_scheduler
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -26,37 +27,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        # URL bot-executor остаётся на poehali.dev (он использует БД)
-        bot_executor_url = 'https://functions.poehali.dev/e2dd154c-dde5-456b-a4c6-1200070fcc75'
+        if BOT_SCHEDULER_ENABLED:
+            # Сигналы считаются в процессе шлюза, затем цикл сам вызывает bot-executor
+            result = get_scheduler().run_cycle()
+            success = not result.get('skipped') and result['executor']['success']
+        else:
+            result = call_bot_executor()
+            success = True
         
-        request_data = {
-            'auto_mode': True,
-            'check_all_users': True
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': success,
+                'message': 'Auto-trading cycle completed' if success else 'Auto-trading cycle failed',
+                'result': result
+            }),
+            'isBase64Encoded': False
         }
-        
-        req = Request(
-            bot_executor_url,
-            data=json.dumps(request_data).encode('utf-8'),
-            headers={'Content-Type': 'application/json'},
-            method='POST'
-        )
-        
-        with urlopen(req, timeout=30) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'success': True,
-                    'message': 'Auto-trading cycle completed',
-                    'result': result
-                }),
-                'isBase64Encoded': False
-            }
     
     except Exception as e:
         return {
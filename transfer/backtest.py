@@ -0,0 +1,486 @@
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import fast_json
+from .candle_store import get_candles
+from .indicators import sma, ema, rsi, bollinger, macd
+
+# Серверный бэктест с той же логикой, что src/lib/backtest.ts: те же стратегии,
+# EMA стартует с первой цены, RSI — простое среднее за 14 изменений с 50 на разгоне,
+# комиссия берётся с входа и выхода, stop-loss/take-profit — в процентах с учётом плеча.
+# Сигналы считаются векторно по всей истории, позиция проходит только по точкам
+# входа и выхода, поэтому 100k+ свечей обрабатываются за доли секунды.
+
+DEFAULT_CONFIG = {
+    'strategy': 'ma-crossover',
+    'initialCapital': 100.0,
+    'positionSize': 20.0,
+    'commission': 0.055,
+    'leverage': 1.0,
+    'stopLoss': None,
+    'takeProfit': None,
+}
+
+MAX_GET_CANDLES = 5000
+
+BUY, HOLD, SELL = 1, 0, -1
+
+
+def klines_to_arrays(klines: Sequence[Dict[str, Any]]) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    '''Свечи формата action=kline → (время строками, high, low, close).'''
+    times = [str(k['time']) for k in klines]
+    high = np.fromiter((k['high'] for k in klines), dtype=np.float64, count=len(klines))
+    low = np.fromiter((k['low'] for k in klines), dtype=np.float64, count=len(klines))
+    close = np.fromiter((k['close'] for k in klines), dtype=np.float64, count=len(klines))
+    return times, high, low, close
+
+
+# Параметры стратегий по умолчанию. Для первых четырёх — как в src/lib/backtest.ts,
+# ema-rsi — правила ma-crossover-strategy (EMA 9/21 + RSI Уайлдера выше 50),
+# sma-rsi — правила strategy-signals (пересечение MA20/MA50 и выход RSI из зон 30/70).
+DEFAULT_PARAMS: Dict[str, Dict[str, float]] = {
+    'ma-crossover': {'fast': 9, 'slow': 21, 'trend': 55},
+    'rsi': {'period': 14, 'lower': 35, 'upper': 65, 'trend': 50},
+    'bollinger': {'period': 20, 'numStd': 2.0, 'trend': 50},
+    'macd': {'fast': 12, 'slow': 26, 'signal': 9, 'trend': 200},
+    'ema-rsi': {'fast': 9, 'slow': 21, 'rsiPeriod': 14, 'rsiThreshold': 50},
+    'sma-rsi': {'fast': 20, 'slow': 50, 'rsiPeriod': 14, 'lower': 30, 'upper': 70},
+}
+
+STRATEGIES = tuple(DEFAULT_PARAMS)
+
+IndicatorCache = Dict[tuple, Any]
+
+
+def strategy_params(strategy: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, float]:
+    '''Параметры по умолчанию, дополненные переданными; неизвестные ключи — ошибка.'''
+    if strategy not in DEFAULT_PARAMS:
+        raise ValueError(f"strategy must be one of: {', '.join(STRATEGIES)}")
+    result = dict(DEFAULT_PARAMS[strategy])
+    for key, value in (params or {}).items():
+        if key not in result:
+            raise ValueError(f'Unknown parameter for {strategy}: {key}')
+        result[key] = type(result[key])(value)
+    return result
+
+
+def valid_params(strategy: str, params: Dict[str, float]) -> bool:
+    '''Отсекает бессмысленные сочетания (быстрая средняя не короче медленной и т.п.).'''
+    if 'fast' in params and params['fast'] >= params['slow']:
+        return False
+    if 'lower' in params and params['lower'] >= params['upper']:
+        return False
+    return all(value > 0 for key, value in params.items() if key not in ('lower', 'rsiThreshold'))
+
+
+def _cached(cache: Optional[IndicatorCache], key: tuple, compute):
+    if cache is None:
+        return compute()
+    value = cache.get(key)
+    if value is None:
+        value = cache[key] = compute()
+    return value
+
+
+def _crossed_up(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    out = np.zeros(a.shape, dtype=bool)
+    out[1:] = (a[:-1] <= b[:-1]) & (a[1:] > b[1:])
+    return out
+
+
+def _crossed_down(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    out = np.zeros(a.shape, dtype=bool)
+    out[1:] = (a[:-1] >= b[:-1]) & (a[1:] < b[1:])
+    return out
+
+
+def generate_signals(strategy: str, close: np.ndarray, high: np.ndarray, low: np.ndarray,
+                     params: Optional[Dict[str, Any]] = None,
+                     cache: Optional[IndicatorCache] = None) -> np.ndarray:
+    '''
+    Сигнал на каждой свече: 1 — BUY, -1 — SELL, 0 — HOLD.
+    cache — словарь для переиспользования индикаторов между прогонами на одной истории
+    (перебор параметров считает, например, EMA 9 один раз на все сочетания).
+    '''
+    p = strategy_params(strategy, params)
+    n = close.shape[0]
+    signals = np.zeros(n, dtype=np.int8)
+
+    def ema_first(period):
+        return _cached(cache, ('ema', 'first', period), lambda: ema(close, period, 'first'))
+
+    if strategy == 'ma-crossover':
+        fast, slow, trend = ema_first(int(p['fast'])), ema_first(int(p['slow'])), ema_first(int(p['trend']))
+        start = int(p['trend'])
+        buy = (slow > trend) & _crossed_up(fast, slow)
+        sell = (slow < trend) & _crossed_down(fast, slow)
+
+    elif strategy == 'rsi':
+        # Как calculateRSI в backtest.ts: до первого полного окна RSI равен 50
+        period = int(p['period'])
+        rsi_line = _cached(cache, ('rsi', 'simple', 'padded', period),
+                           lambda: np.nan_to_num(rsi(close, period, method='simple'), nan=50.0))
+        trend = ema_first(int(p['trend']))
+        start = int(p['trend'])
+        buy = (close > trend) & _crossed_up(rsi_line, np.full(n, p['lower']))
+        sell = (close < trend) & _crossed_down(rsi_line, np.full(n, p['upper']))
+
+    elif strategy == 'bollinger':
+        period, num_std = int(p['period']), p['numStd']
+        upper, _, lower = _cached(cache, ('bollinger', period, num_std), lambda: bollinger(close, period, num_std))
+        trend = ema_first(int(p['trend']))
+        start = max(int(p['trend']), period - 1)
+        buy = (close > trend) & (low <= lower) & (close > lower)
+        sell = (close < trend) & (high >= upper) & (close < upper)
+
+    elif strategy == 'macd':
+        fast, slow, signal = int(p['fast']), int(p['slow']), int(p['signal'])
+        macd_line, _, histogram = _cached(cache, ('macd', fast, slow, signal),
+                                          lambda: macd(close, fast, slow, signal, seed='first'))
+        trend = ema_first(int(p['trend']))
+        start = int(p['trend'])
+        zero = np.zeros(n)
+        buy = (close > trend) & _crossed_up(histogram, zero) & (macd_line < 0)
+        sell = (close < trend) & _crossed_down(histogram, zero) & (macd_line > 0)
+
+    elif strategy == 'ema-rsi':
+        fast_period, slow_period, rsi_period = int(p['fast']), int(p['slow']), int(p['rsiPeriod'])
+        fast = _cached(cache, ('ema', 'sma', fast_period), lambda: ema(close, fast_period))
+        slow = _cached(cache, ('ema', 'sma', slow_period), lambda: ema(close, slow_period))
+        rsi_line = _cached(cache, ('rsi', 'wilder', rsi_period), lambda: rsi(close, rsi_period))
+        start = max(slow_period, rsi_period + 1)
+        buy = _crossed_up(fast, slow) & (rsi_line > p['rsiThreshold'])
+        sell = _crossed_down(fast, slow)
+
+    elif strategy == 'sma-rsi':
+        fast_period, slow_period, rsi_period = int(p['fast']), int(p['slow']), int(p['rsiPeriod'])
+        fast = _cached(cache, ('sma', fast_period), lambda: sma(close, fast_period))
+        slow = _cached(cache, ('sma', slow_period), lambda: sma(close, slow_period))
+        rsi_line = _cached(cache, ('rsi', 'simple', rsi_period), lambda: rsi(close, rsi_period, method='simple'))
+        start = max(slow_period, rsi_period + 1)
+        buy = _crossed_up(fast, slow) | _crossed_up(rsi_line, np.full(n, p['lower']))
+        sell = _crossed_down(fast, slow) | _crossed_down(rsi_line, np.full(n, p['upper']))
+
+    if n > start:
+        signals[start:][buy[start:]] = BUY
+        signals[start:][sell[start:] & ~buy[start:]] = SELL
+    return signals
+
+
+def _next_index(mask: np.ndarray) -> np.ndarray:
+    '''Для каждого i — ближайший индекс j >= i, где mask истинна (len(mask), если такого нет).'''
+    n = mask.shape[0]
+    idx = np.where(mask, np.arange(n), n)
+    out = np.empty(n + 1, dtype=np.int64)
+    out[n] = n
+    out[:n] = np.minimum.accumulate(idx[::-1])[::-1]
+    return out
+
+
+def _exit_reason(pnl_percent: float, stop_loss: Optional[float], take_profit: Optional[float]) -> str:
+    if stop_loss and pnl_percent <= -stop_loss:
+        return 'Stop-Loss'
+    if take_profit and pnl_percent >= take_profit:
+        return 'Take-Profit'
+    return ''
+
+
+def _find_exit(close: np.ndarray, prices: List[float], start: int, end: int, entry_price: float, side: int,
+               leverage: float, stop_loss: Optional[float], take_profit: Optional[float]) -> Tuple[int, str]:
+    '''
+    Первая свеча в [start, end), на которой срабатывает stop-loss или take-profit.
+    Первые свечи проверяются простым циклом (большинство сделок короткие), дальше —
+    отрезками растущей длины на numpy, чтобы длинные сделки не считали весь хвост истории.
+    '''
+    if not stop_loss and not take_profit:
+        return end, ''
+    head = min(end, start + 16)
+    for i in range(start, head):
+        move = prices[i] - entry_price if side == BUY else entry_price - prices[i]
+        reason = _exit_reason(move / entry_price * 100 * leverage, stop_loss, take_profit)
+        if reason:
+            return i, reason
+    i, chunk = head, 64
+    while i < end:
+        stop = min(end, i + chunk)
+        segment = close[i:stop]
+        if side == BUY:
+            pnl_percent = (segment - entry_price) / entry_price * 100 * leverage
+        else:
+            pnl_percent = (entry_price - segment) / entry_price * 100 * leverage
+        hit = np.zeros(segment.shape[0], dtype=bool)
+        if stop_loss:
+            hit |= pnl_percent <= -stop_loss
+        if take_profit:
+            hit |= pnl_percent >= take_profit
+        if hit.any():
+            k = int(np.argmax(hit))
+            return i + k, _exit_reason(float(pnl_percent[k]), stop_loss, take_profit)
+        i, chunk = stop, chunk * 2
+    return end, ''
+
+
+def simulate(times: List[str], close: np.ndarray, signals: np.ndarray,
+             config: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], np.ndarray, float]:
+    '''
+    Прогон позиции по сигналам. Возвращает сделки, equity на закрытии каждой свечи
+    (сделка, закрытая принудительно в конце истории, в кривую не попадает — как в backtest.ts)
+    и итоговый капитал.
+    '''
+    n = close.shape[0]
+    leverage = float(config['leverage'])
+    commission = float(config['commission']) / 100
+    position_size = float(config['positionSize']) / 100
+    stop_loss, take_profit = config.get('stopLoss'), config.get('takeProfit')
+
+    prices = close.tolist()
+    next_signal = _next_index(signals != HOLD)
+    next_opposite = {BUY: _next_index(signals == SELL), SELL: _next_index(signals == BUY)}
+
+    equity = float(config['initialCapital'])
+    changes = np.zeros(n)
+    if n:
+        changes[0] = equity
+    trades: List[Dict[str, Any]] = []
+
+    i = int(next_signal[0]) if n else 0
+    while i < n:
+        side = int(signals[i])
+        entry_price = prices[i]
+        size = equity * position_size / entry_price
+
+        signal_exit = int(next_opposite[side][i + 1])
+        exit_index, reason = _find_exit(close, prices, i + 1, signal_exit, entry_price, side,
+                                        leverage, stop_loss, take_profit)
+        if exit_index >= n:
+            exit_index, reason = n - 1, 'End of backtest'
+        elif not reason:
+            reason = 'Signal'
+
+        exit_price = prices[exit_index]
+        if side == BUY:
+            pnl = (exit_price - entry_price) * size * leverage
+        else:
+            pnl = (entry_price - exit_price) * size * leverage
+        fee = entry_price * size * commission + exit_price * size * commission
+        net_pnl = pnl - fee
+
+        trades.append({
+            'entryTime': times[i],
+            'exitTime': times[exit_index],
+            'entryPrice': entry_price,
+            'exitPrice': exit_price,
+            'side': 'LONG' if side == BUY else 'SHORT',
+            'pnl': net_pnl,
+            'pnlPercent': net_pnl / equity * 100,
+            'reason': reason
+        })
+        equity += net_pnl
+
+        if reason == 'End of backtest':
+            break
+        changes[exit_index] += net_pnl
+        # На свече выхода сразу открывается новая позиция, если на ней есть сигнал
+        i = exit_index if signals[exit_index] != HOLD else int(next_signal[exit_index + 1])
+
+    return trades, np.cumsum(changes), equity
+
+
+def _month(time_ms: str) -> str:
+    return datetime.fromtimestamp(int(time_ms) / 1000, tz=timezone.utc).strftime('%Y-%m')
+
+
+def metrics(trades: List[Dict[str, Any]], equity_curve: np.ndarray,
+            initial_capital: float, final_equity: float) -> Dict[str, Any]:
+    '''Числовые метрики BacktestResults (без списков) — их же ранжирует оптимизатор.'''
+    pnls = np.array([t['pnl'] for t in trades], dtype=np.float64)
+    wins, losses = pnls[pnls > 0], pnls[pnls < 0]
+    total_wins = float(wins.sum())
+    total_losses = abs(float(losses.sum()))
+    if total_losses > 0:
+        profit_factor = total_wins / total_losses
+    else:
+        profit_factor = 999 if total_wins > 0 else 0
+
+    if equity_curve.shape[0]:
+        running_max = np.maximum.accumulate(equity_curve)
+        max_drawdown = float((running_max - equity_curve).max())
+        max_equity = float(running_max[-1])
+        returns = np.zeros(equity_curve.shape[0])
+        returns[1:] = np.diff(equity_curve) / equity_curve[:-1]
+        std_return = float(returns.std())
+        sharpe_ratio = float(returns.mean()) / std_return * np.sqrt(252) if std_return > 0 else 0
+    else:
+        max_drawdown, max_equity, sharpe_ratio = 0.0, initial_capital, 0
+
+    total_pnl = final_equity - initial_capital
+    return {
+        'totalPnL': total_pnl,
+        'totalPnLPercent': total_pnl / initial_capital * 100,
+        'winningTrades': int(wins.shape[0]),
+        'losingTrades': int(losses.shape[0]),
+        'winRate': wins.shape[0] / len(trades) * 100 if trades else 0,
+        'maxDrawdown': max_drawdown,
+        'maxDrawdownPercent': max_drawdown / max_equity * 100 if max_equity else 0,
+        'sharpeRatio': sharpe_ratio,
+        'profitFactor': profit_factor,
+        'avgWin': total_wins / wins.shape[0] if wins.shape[0] else 0,
+        'avgLoss': total_losses / losses.shape[0] if losses.shape[0] else 0,
+    }
+
+
+def summarize(times: List[str], trades: List[Dict[str, Any]], equity_curve: np.ndarray,
+              initial_capital: float, final_equity: float) -> Dict[str, Any]:
+    '''Результат в формате BacktestResults из src/lib/backtest.ts.'''
+    # Месяц сделки — по времени входа в UTC
+    monthly: Dict[str, List[float]] = {}
+    for trade in trades:
+        monthly.setdefault(_month(trade['entryTime']), []).append(trade['pnl'])
+    monthly_stats = []
+    for month in sorted(monthly):
+        month_pnls = monthly[month]
+        month_wins = [p for p in month_pnls if p > 0]
+        monthly_stats.append({
+            'month': month,
+            'profit': sum(month_wins),
+            'loss': abs(sum(p for p in month_pnls if p < 0)),
+            'winRate': len(month_wins) / len(month_pnls) * 100,
+            'trades': len(month_pnls)
+        })
+
+    curve = equity_curve.tolist()
+    return {
+        'trades': trades,
+        **metrics(trades, equity_curve, initial_capital, final_equity),
+        'equityCurve': [
+            {'time': t, 'equity': e, 'pnl': e - initial_capital}
+            for t, e in zip(times, curve)
+        ],
+        'monthlyStats': monthly_stats
+    }
+
+
+def normalize_config(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    '''BacktestConfig с умолчаниями; params — параметры стратегии (см. DEFAULT_PARAMS).'''
+    config = config or {}
+    result = dict(DEFAULT_CONFIG)
+    for key, value in config.items():
+        if key in DEFAULT_CONFIG and value not in (None, ''):
+            result[key] = value if key == 'strategy' else float(value)
+    result['params'] = strategy_params(result['strategy'], config.get('params'))
+    if result['initialCapital'] <= 0:
+        raise ValueError('initialCapital must be positive')
+    return result
+
+
+def evaluate(times: Sequence, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+             config: Dict[str, Any], cache: Optional[IndicatorCache] = None) -> Tuple[List[Dict[str, Any]], np.ndarray, float]:
+    '''Сигналы + прогон позиции для нормализованного config: (сделки, equity по свечам, итоговый капитал).'''
+    signals = generate_signals(config['strategy'], close, high, low, config['params'], cache)
+    return simulate(times, close, signals, config)
+
+
+def run_backtest_arrays(times: List[str], high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                        config: Dict[str, Any]) -> Dict[str, Any]:
+    config = normalize_config(config)
+    trades, equity_curve, final_equity = evaluate(times, high, low, close, config)
+    return summarize(times, trades, equity_curve, config['initialCapital'], final_equity)
+
+
+def run_backtest(klines: Sequence[Dict[str, Any]], config: Dict[str, Any]) -> Dict[str, Any]:
+    '''Аналог runBacktest(klines, config) из src/lib/backtest.ts.'''
+    return run_backtest_arrays(*klines_to_arrays(klines), config)
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Бэктест стратегий (ma-crossover, rsi, bollinger, macd) на сервере
+    Args: event - dict с httpMethod и
+          GET: queryStringParameters symbol, interval, limit, category + параметры BacktestConfig
+               (strategy, initialCapital, positionSize, commission, leverage, stopLoss, takeProfit)
+          POST: body {"klines": [...], "config": {...}} или {"symbol", "interval", "limit", "config"}
+          context - объект с request_id
+    Returns: HTTP response с результатом в формате BacktestResults
+    '''
+    method = event.get('httpMethod', 'GET')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method not in ('GET', 'POST'):
+        return {
+            'statusCode': 405,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        if method == 'POST':
+            request = fast_json.loads(event.get('body') or '{}')
+            config = request.get('config') or {}
+        else:
+            request = event.get('queryStringParameters') or {}
+            config = {key: request[key] for key in DEFAULT_CONFIG if key in request}
+
+        klines = request.get('klines')
+        if klines is None:
+            limit = min(int(request.get('limit', 1000)), MAX_GET_CANDLES)
+            klines = get_candles(request.get('symbol', 'BTCUSDT'), request.get('interval', '60'),
+                                 limit, request.get('category', 'linear'))
+
+        started = time.perf_counter()
+        results = run_backtest(klines, config)
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({
+                'success': True,
+                'candles': len(klines),
+                'elapsedMs': round((time.perf_counter() - started) * 1000, 2),
+                'results': results
+            }),
+            'isBase64Encoded': False
+        }
+
+    except (ValueError, KeyError, TypeError) as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
@@ -0,0 +1,92 @@
+import argparse
+import json
+import random
+import time
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    from functions import fast_json
+except ImportError:  # запуск прямо из папки transfer/
+    import fast_json
+
+# Сравнивает CPU на один ответ: старый путь шлюза (json.dumps в обработчике,
+# json.loads + JSONResponse в main.py) против нового (fast_json в обработчике,
+# готовые байты в Response).
+#   python -m functions.bench_response_path --pairs 500 --tickers 600
+
+
+def pair_analyzer_payload(n: int) -> dict:
+    rng = random.Random(1)
+    pairs = [
+        {
+            'symbol': f'C{i}USDT',
+            'price': rng.uniform(0.001, 70000),
+            'volume24h': rng.uniform(1e6, 1e9),
+            'priceChange24h': rng.uniform(-15, 15),
+            'volatility': rng.uniform(0, 100),
+            'liquidity': rng.uniform(0, 100),
+            'trend': rng.uniform(0, 100),
+            'reliability': rng.uniform(0, 100),
+            'totalScore': round(rng.uniform(0, 100), 2),
+            'recommendation': rng.choice(['Отлично для скальпинга', 'Хорошо для торговли', 'Средний потенциал'])
+        }
+        for i in range(n)
+    ]
+    return {'success': True, 'timestamp': int(time.time()), 'totalPairs': n, 'topPairs': pairs,
+            'partial': False, 'skippedSymbols': []}
+
+
+def tickers_payload(n: int) -> dict:
+    rng = random.Random(2)
+    return {'success': True, 'data': [
+        {
+            'symbol': f'C{i}USDT',
+            'price': rng.uniform(0.001, 70000),
+            'change': rng.uniform(-15, 15),
+            'volume': f'{rng.uniform(1e3, 1e9):.4f}',
+            'high24h': rng.uniform(0.001, 70000),
+            'low24h': rng.uniform(0.001, 70000)
+        }
+        for i in range(n)
+    ]}
+
+
+def old_path(payload: dict) -> bytes:
+    body = json.dumps(payload)
+    return JSONResponse(content=json.loads(body), status_code=200, headers={}).body
+
+
+def new_path(payload: dict) -> bytes:
+    body = fast_json.dumps(payload)
+    return Response(content=body.encode('utf-8'), status_code=200, headers={},
+                    media_type='application/json').body
+
+
+def measure(fn, payload: dict, repeat: int) -> float:
+    fn(payload)
+    start = time.process_time()
+    for _ in range(repeat):
+        fn(payload)
+    return (time.process_time() - start) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='CPU per response: old vs new gateway response path')
+    parser.add_argument('--pairs', type=int, default=500)
+    parser.add_argument('--tickers', type=int, default=600)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if fast_json.orjson else 'json'}")
+    for name, payload in (('pair-analyzer', pair_analyzer_payload(args.pairs)),
+                          ('tickers', tickers_payload(args.tickers))):
+        old_ms = measure(old_path, payload, args.repeat)
+        new_ms = measure(new_path, payload, args.repeat)
+        size = len(new_path(payload))
+        print(f'{name:14} {size / 1024:8.1f} KiB  old {old_ms:7.3f} ms  new {new_ms:7.3f} ms  '
+              f'saved {old_ms - new_ms:7.3f} ms/request ({old_ms / new_ms:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
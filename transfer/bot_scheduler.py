@@ -0,0 +1,443 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.request import Request, urlopen
+
+from . import fast_json
+from .backtest import BUY, SELL, STRATEGIES, generate_signals, klines_to_arrays
+from .candle_store import INTERVAL_MS, get_candles, normalize_interval
+from .market_stream import live_candles
+from .rate_limiter import BOT, upstream_priority
+
+try:
+    from psycopg2.extras import execute_values
+    from .db_pool import connection
+except ImportError:  # без psycopg2 шлюз работает, но циклы ботов выполнить нельзя
+    execute_values = connection = None
+
+logger = logging.getLogger(__name__)
+
+# Планировщик ботов внутри python-gateway вместо cron/bot-scheduler.sh.
+# Раз в BOT_SCHEDULER_PERIOD секунд (сразу после закрытия свечи) читает активных ботов,
+# группирует их по рынку (пара, категория, интервал): свечи и индикаторы рынка
+# считаются один раз, сигналы каждой стратегии — один раз на рынок, а результат
+# раздаётся всем ботам группы. Сигналы закрытой свечи пишутся в strategy_signals,
+# после чего bot-executor открывает и сопровождает сделки (ордера выставляет только он).
+
+BOT_SCHEDULER_ENABLED = os.environ.get('BOT_SCHEDULER_ENABLED', '0') == '1'
+BOT_SCHEDULER_PERIOD = int(os.environ.get('BOT_SCHEDULER_PERIOD', '300'))
+# Через сколько секунд после границы периода запускать цикл (биржа успевает закрыть свечу)
+BOT_SCHEDULER_DELAY = float(os.environ.get('BOT_SCHEDULER_DELAY', '2'))
+# Интервал свечей ботов: в таблице bots своего интервала нет
+BOT_SCHEDULER_INTERVAL = os.environ.get('BOT_SCHEDULER_INTERVAL', '15')
+BOT_SCHEDULER_CANDLES = int(os.environ.get('BOT_SCHEDULER_CANDLES', '300'))
+BOT_SCHEDULER_CONCURRENCY = int(os.environ.get('BOT_SCHEDULER_CONCURRENCY', '4'))
+BOTS_TABLE = os.environ.get('BOTS_TABLE', 't_p69937905_crypto_trading_bot.bots')
+# bot-executor остаётся на poehali.dev (он использует БД и торгует); пустое значение — не вызывать
+BOT_EXECUTOR_URL = os.environ.get('BOT_EXECUTOR_URL', 'https://functions.poehali.dev/e2dd154c-dde5-456b-a4c6-1200070fcc75')
+BOT_EXECUTOR_TIMEOUT = float(os.environ.get('BOT_EXECUTOR_TIMEOUT', '30'))
+# Как часто (сек) писать в лог ошибки одного вида (рынок, bot-executor); остальные только считаются
+BOT_SCHEDULER_ERROR_LOG_INTERVAL = float(os.environ.get('BOT_SCHEDULER_ERROR_LOG_INTERVAL', '60'))
+
+HISTORY_SIZE = 20
+
+# Названия стратегий в таблице bots (после V0006 и из интерфейса) → стратегии backtest.py
+STRATEGY_ALIASES = {
+    'EMA 9/21/55 (тренд + кросс)': 'ma-crossover',
+    'RSI 14 + EMA50 (отбой от зон)': 'rsi',
+    'RSI 14 + EMA 50': 'rsi',
+    'BB + EMA50 (отбой от границ)': 'bollinger',
+    'Bollinger Bands + EMA 50': 'bollinger',
+    'MACD + EMA200 (дивергенция)': 'macd',
+    'MACD + EMA 200': 'macd',
+    **{name: name for name in STRATEGIES},
+}
+
+SIGNAL_TYPES = {BUY: 'BUY', SELL: 'SELL'}
+
+# (символ, категория, интервал)
+MarketKey = Tuple[str, str, str]
+
+
+def normalize_bot(row: Dict[str, Any], interval: str = BOT_SCHEDULER_INTERVAL) -> Optional[Dict[str, Any]]:
+    '''Строка bots → бот с символом Bybit, категорией и стратегией backtest.py (None — не поддерживается).'''
+    strategy = STRATEGY_ALIASES.get((row.get('strategy') or '').strip())
+    symbol = (row.get('pair') or '').replace('/', '').replace('-', '').upper()
+    if strategy is None or not symbol:
+        return None
+    return {
+        'id': row['id'],
+        'userId': row['user_id'],
+        'botId': row['bot_id'],
+        'symbol': symbol,
+        'category': 'linear' if row.get('market') == 'futures' else 'spot',
+        'interval': normalize_interval(str(row.get('interval') or interval)),
+        'strategy': strategy,
+    }
+
+
+def group_bots(bots: List[Dict[str, Any]]) -> Dict[MarketKey, Dict[str, List[Dict[str, Any]]]]:
+    '''Рынок → стратегия → боты. Один рынок — одна загрузка свечей и один кэш индикаторов.'''
+    groups: Dict[MarketKey, Dict[str, List[Dict[str, Any]]]] = {}
+    for bot in bots:
+        market = (bot['symbol'], bot['category'], bot['interval'])
+        groups.setdefault(market, {}).setdefault(bot['strategy'], []).append(bot)
+    return groups
+
+
+def closed_candles(klines: List[Dict[str, Any]], interval: str, now_ms: int) -> List[Dict[str, Any]]:
+    '''Отбрасывает последнюю свечу, если она ещё формируется: сигнал берётся только по закрытой.'''
+    step = INTERVAL_MS.get(interval)
+    if klines and step and int(klines[-1]['time']) + step > now_ms:
+        return klines[:-1]
+    return klines
+
+
+def evaluate_market(market: MarketKey, strategies: List[str], limit: int = BOT_SCHEDULER_CANDLES,
+                    now_ms: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Свечи рынка и сигнал каждой стратегии на последней закрытой свече.
+    Индикаторы общие для всех стратегий рынка (например, EMA 50 у rsi и bollinger).
+    '''
+    symbol, category, interval = market
+    started = time.perf_counter()
+    with upstream_priority(BOT):
+        klines = live_candles(symbol, interval, limit + 1, category) or get_candles(symbol, interval, limit + 1, category)
+    klines = closed_candles(klines, interval, now_ms if now_ms is not None else int(time.time() * 1000))
+    if not klines:
+        raise RuntimeError(f'No candles for {symbol} {interval}')
+    loaded = time.perf_counter()
+
+    times, high, low, close = klines_to_arrays(klines)
+    cache: Dict[tuple, Any] = {}
+    signals = {
+        strategy: int(generate_signals(strategy, close, high, low, cache=cache)[-1])
+        for strategy in strategies
+    }
+    return {
+        'candleTime': int(times[-1]),
+        'price': float(close[-1]),
+        'signals': signals,
+        'loadMs': (loaded - started) * 1000,
+        'computeMs': (time.perf_counter() - loaded) * 1000,
+    }
+
+
+def call_bot_executor(url: str = BOT_EXECUTOR_URL, timeout: float = BOT_EXECUTOR_TIMEOUT) -> Dict[str, Any]:
+    '''Цикл bot-executor по всем пользователям: открытие и сопровождение сделок.'''
+    request = Request(
+        url,
+        data=fast_json.dumps({'auto_mode': True, 'check_all_users': True}).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    with urlopen(request, timeout=timeout) as response:
+        return fast_json.loads(response.read())
+
+
+class BotScheduler:
+    '''Цикл ботов: загрузка из БД, расчёт по рынкам, раздача сигналов ботам, запись в БД.'''
+
+    def __init__(self, period: int = BOT_SCHEDULER_PERIOD, delay: float = BOT_SCHEDULER_DELAY,
+                 interval: str = BOT_SCHEDULER_INTERVAL, limit: int = BOT_SCHEDULER_CANDLES,
+                 concurrency: int = BOT_SCHEDULER_CONCURRENCY, dsn: Optional[str] = None,
+                 executor_url: str = BOT_EXECUTOR_URL):
+        self.period = period
+        self.delay = delay
+        self.interval = interval
+        self.limit = limit
+        self.dsn = dsn
+        self.executor_url = executor_url
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bot-scheduler')
+        # Ручной запуск и плановый не должны идти одновременно
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.history: deque = deque(maxlen=HISTORY_SIZE)
+        self.last_error: Optional[str] = None
+        self._error_logged_at: Dict[str, float] = {}
+        self.counters = {
+            'cycles': 0,
+            'skippedCycles': 0,
+            'failedCycles': 0,
+            'signalsSaved': 0,
+            'marketErrors': 0,
+            'executorFailures': 0,
+            'totalMs': 0.0,
+            'maxMs': 0.0,
+        }
+
+    def _report_error(self, counter: str, message: str) -> None:
+        '''Вызывается из except: считает ошибку и пишет её с трассировкой, если этот вид давно не логировался.'''
+        now = time.monotonic()
+        with self._lock:
+            self.counters[counter] += 1
+            total = self.counters[counter]
+            last = self._error_logged_at.get(counter)
+            if last is not None and now - last < BOT_SCHEDULER_ERROR_LOG_INTERVAL:
+                return
+            self._error_logged_at[counter] = now
+        logger.exception('Bot scheduler: %s (%s=%d)', message, counter, total)
+
+    def load_bots(self) -> List[Dict[str, Any]]:
+        if connection is None:
+            raise RuntimeError('psycopg2 is not installed')
+        with connection(self.dsn) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f'SELECT id, user_id, bot_id, pair, market, strategy FROM {BOTS_TABLE} WHERE active = true'
+                )
+                columns = [c[0] for c in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            conn.commit()
+        return rows
+
+    def save_signals(self, signals: List[Dict[str, Any]]) -> int:
+        '''Сигналы одним запросом; повтор того же бота по той же свече отсекается уникальным индексом (V0014).'''
+        if not signals:
+            return 0
+        with connection(self.dsn) as conn:
+            with conn.cursor() as cursor:
+                inserted = execute_values(cursor, '''
+                    INSERT INTO strategy_signals
+                    (user_id, symbol, signal_type, price, signal_data, candle_time, strategy, candle_interval, bot_id)
+                    VALUES %s
+                    ON CONFLICT (user_id, symbol, candle_time, signal_type, strategy, candle_interval, bot_id) DO NOTHING
+                    RETURNING id
+                ''', [
+                    (str(s['userId']), s['symbol'], s['type'], s['price'], fast_json.dumps(s), s['candleTime'],
+                     s['strategy'], s['interval'], str(s['botId']))
+                    for s in signals
+                ], page_size=1000, fetch=True)
+            conn.commit()
+        return len(inserted)
+
+    def run_cycle(self) -> Dict[str, Any]:
+        '''Один цикл по всем активным ботам (блокирующий; из event loop — через run_in_executor).'''
+        if not self._running.acquire(blocking=False):
+            with self._lock:
+                self.counters['skippedCycles'] += 1
+            return {'skipped': True, 'reason': 'Previous cycle is still running'}
+        try:
+            return self._run_cycle()
+        except Exception as e:
+            with self._lock:
+                self.counters['failedCycles'] += 1
+                self.last_error = str(e)
+            # Без новых сигналов bot-executor всё равно сопровождает открытые сделки
+            self.run_executor()
+            raise
+        finally:
+            self._running.release()
+
+    def _run_cycle(self) -> Dict[str, Any]:
+        started_at = int(time.time() * 1000)
+        started = time.perf_counter()
+        rows = self.load_bots()
+        bots = [bot for bot in (normalize_bot(row, self.interval) for row in rows) if bot is not None]
+        groups = group_bots(bots)
+        loaded = time.perf_counter()
+
+        futures = {
+            market: self._executor.submit(evaluate_market, market, list(strategies), self.limit, started_at)
+            for market, strategies in groups.items()
+        }
+        signals: List[Dict[str, Any]] = []
+        errors: Dict[str, str] = {}
+        load_ms = compute_ms = 0.0
+        for market, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                errors[':'.join(market)] = str(e)
+                self._report_error('marketErrors', f'market {":".join(market)} failed')
+                continue
+            load_ms += result['loadMs']
+            compute_ms += result['computeMs']
+            for strategy, bots_for_strategy in groups[market].items():
+                signal_type = SIGNAL_TYPES.get(result['signals'][strategy])
+                if signal_type is None:
+                    continue
+                signals.extend({
+                    'botId': bot['botId'],
+                    'userId': bot['userId'],
+                    'symbol': bot['symbol'],
+                    'category': bot['category'],
+                    'interval': bot['interval'],
+                    'strategy': strategy,
+                    'type': signal_type,
+                    'price': result['price'],
+                    'candleTime': result['candleTime'],
+                    'source': 'bot-scheduler',
+                } for bot in bots_for_strategy)
+        evaluated = time.perf_counter()
+
+        saved = self.save_signals(signals)
+        stored = time.perf_counter()
+
+        executor = self.run_executor()
+        finished = time.perf_counter()
+
+        total_ms = (finished - started) * 1000
+        report = {
+            'startedAt': started_at,
+            'bots': len(bots),
+            'unsupportedBots': len(rows) - len(bots),
+            'markets': len(groups),
+            'strategyGroups': sum(len(strategies) for strategies in groups.values()),
+            'signals': len(signals),
+            'signalsSaved': saved,
+            'errors': errors,
+            'executor': executor,
+            'timing': {
+                'loadBotsMs': round((loaded - started) * 1000, 2),
+                'marketsMs': round((evaluated - loaded) * 1000, 2),
+                # Суммы по рынкам: рынки считаются параллельно, поэтому могут превышать marketsMs
+                'candlesMs': round(load_ms, 2),
+                'indicatorsMs': round(compute_ms, 2),
+                'saveMs': round((stored - evaluated) * 1000, 2),
+                'executorMs': round((finished - stored) * 1000, 2),
+                'totalMs': round(total_ms, 2),
+            },
+        }
+        with self._lock:
+            self.counters['cycles'] += 1
+            self.counters['signalsSaved'] += saved
+            self.counters['totalMs'] += total_ms
+            self.counters['maxMs'] = max(self.counters['maxMs'], total_ms)
+            self.history.append(report)
+        return report
+
+    def run_executor(self) -> Dict[str, Any]:
+        '''После записи сигналов — цикл bot-executor; его ошибка не отменяет уже записанные сигналы.'''
+        if not self.executor_url:
+            return {'success': True, 'skipped': True}
+        try:
+            return {'success': True, 'result': call_bot_executor(self.executor_url)}
+        except Exception as e:
+            self._report_error('executorFailures', 'bot-executor call failed')
+            return {'success': False, 'error': str(e)}
+
+    def next_run(self, now: float) -> float:
+        '''Ближайшая граница периода (по UTC) плюс задержка.'''
+        return (now // self.period + 1) * self.period + self.delay
+
+    async def run_forever(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(max(0.0, self.next_run(time.time()) - time.time()))
+            try:
+                await loop.run_in_executor(None, self.run_cycle)
+            except Exception:
+                logger.exception('Bot scheduler cycle failed')
+
+    def start(self) -> None:
+        '''Запускает цикл в текущем event loop (вызывается из startup шлюза).'''
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            last = self.history[-1] if self.history else None
+            last_error = self.last_error
+            recent = [cycle['timing']['totalMs'] for cycle in self.history]
+        cycles = counters.pop('cycles')
+        total_ms = counters.pop('totalMs')
+        return {
+            'enabled': self._task is not None,
+            'period': self.period,
+            'interval': self.interval,
+            'cycles': cycles,
+            **counters,
+            'avgMs': round(total_ms / cycles, 2) if cycles else 0.0,
+            'maxMs': round(counters.pop('maxMs'), 2),
+            'recentMs': recent,
+            'lastCycle': last,
+            'lastError': last_error,
+        }
+
+
+_scheduler: Optional[BotScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> BotScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = BotScheduler()
+    return _scheduler
+
+
+def scheduler_stats() -> Dict[str, Any]:
+    return get_scheduler().stats()
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Состояние встроенного планировщика ботов и ручной запуск цикла
+    Args: event - dict с httpMethod (GET — статистика циклов, POST — выполнить цикл сейчас)
+          context - объект с request_id
+    Returns: HTTP response со статистикой или отчётом цикла (время по этапам, сигналы)
+    '''
+    method = event.get('httpMethod', 'GET')
+    headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    try:
+        if method == 'GET':
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': fast_json.dumps({'success': True, 'scheduler': scheduler_stats()}),
+                'isBase64Encoded': False
+            }
+
+        if method == 'POST':
+            report = get_scheduler().run_cycle()
+            return {
+                'statusCode': 409 if report.get('skipped') else 200,
+                'headers': headers,
+                'body': fast_json.dumps({'success': not report.get('skipped'), 'cycle': report}),
+                'isBase64Encoded': False
+            }
+
+        return {
+            'statusCode': 405,
+            'headers': headers,
+            'body': fast_json.dumps({'success': False, 'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
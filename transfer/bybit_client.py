@@ -0,0 +1,386 @@
+import asyncio
+import gzip
+import http.client
+import json
+import os
+import ssl
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from .rate_limiter import RATE_LIMIT_RET_CODE, RateLimitTimeout, get_limiter
+from .resilience import get_resilience
+
+BYBIT_BASE_URL = os.environ.get('BYBIT_BASE_URL', 'https://api.bybit.com')
+
+DEFAULT_TIMEOUT = float(os.environ.get('BYBIT_HTTP_TIMEOUT', '10'))
+POOL_SIZE = int(os.environ.get('BYBIT_HTTP_POOL_SIZE', '16'))
+IDLE_TIMEOUT = float(os.environ.get('BYBIT_HTTP_IDLE_TIMEOUT', '30'))
+
+# Таймауты по эндпоинтам (сек). Переопределяются через
+# BYBIT_HTTP_TIMEOUTS="/v5/market/kline=3,/v5/market/tickers=8"
+ENDPOINT_TIMEOUTS: Dict[str, float] = {
+    '/v5/market/tickers': 10,
+    '/v5/market/kline': 5,
+    '/v5/market/orderbook': 5,
+    '/v5/account/wallet-balance': 10,
+}
+
+for _item in filter(None, os.environ.get('BYBIT_HTTP_TIMEOUTS', '').split(',')):
+    _path, _, _value = _item.partition('=')
+    if _value:
+        ENDPOINT_TIMEOUTS[_path.strip()] = float(_value)
+
+DEFAULT_HEADERS = {
+    'Accept': 'application/json',
+    'Accept-Encoding': 'gzip',
+    'Connection': 'keep-alive',
+    'User-Agent': 'crypto-trading-bot/1.0',
+}
+
+# Ошибки, после которых соединение из пула считается «протухшим»
+# (сервер закрыл keep-alive) и запрос можно безопасно повторить на новом
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+# Автоматически повторяются только идемпотентные запросы: тело POST (например, ордер)
+# могло дойти до Bybit до разрыва, и повтор выставил бы его второй раз
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD'})
+
+
+class UpstreamError(Exception):
+    def __init__(self, status: int, body: bytes):
+        self.status = status
+        self.body = body
+        super().__init__(f'Bybit HTTP {status}: {body[:200].decode("utf-8", "replace")}')
+
+
+class PoolTimeout(TimeoutError):
+    '''Все соединения пула заняты дольше таймаута запроса (сам Bybit при этом не вызывался).'''
+
+
+def endpoint_timeout(path: str, timeout: Optional[float] = None) -> float:
+    if timeout is not None:
+        return timeout
+    return ENDPOINT_TIMEOUTS.get(path, DEFAULT_TIMEOUT)
+
+
+def build_target(path: str, params: Optional[Dict[str, Any]] = None) -> str:
+    if params:
+        return f'{path}?{urlencode(params)}'
+    return path
+
+
+def decode_body(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding and encoding.lower() == 'gzip':
+        return gzip.decompress(body)
+    return body
+
+
+def parse_json(status: int, body: bytes) -> Dict[str, Any]:
+    if status >= 400:
+        raise UpstreamError(status, body)
+    return json.loads(body.decode('utf-8'))
+
+
+def is_retryable(error: BaseException) -> bool:
+    '''Сбой Bybit или сети (таймаут, разрыв, 5xx), после которого GET можно повторить.'''
+    # Нехватка лимитов или соединений своего пула — не сбой эндпоинта и не повод открывать breaker
+    if isinstance(error, (RateLimitTimeout, PoolTimeout)):
+        return False
+    if isinstance(error, UpstreamError):
+        return error.status >= 500
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+def check_rate_limit(path: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    if data.get('retCode') == RATE_LIMIT_RET_CODE:
+        get_limiter().penalize(path)
+    return data
+
+
+class BybitHTTPClient:
+    '''
+    Синхронный клиент с пулом keep-alive соединений к Bybit.
+    Потокобезопасен: одновременно открыто не больше pool_size соединений.
+    '''
+
+    def __init__(self, base_url: str = BYBIT_BASE_URL, pool_size: int = POOL_SIZE,
+                 idle_timeout: float = IDLE_TIMEOUT):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._ssl_context = ssl.create_default_context() if self.scheme == 'https' else None
+        self._idle: deque = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._pid = os.getpid()
+        self.stats = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0}
+
+    def _new_connection(self, timeout: float) -> http.client.HTTPConnection:
+        self.stats['connections_opened'] += 1
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout,
+                                               context=self._ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _check_fork(self) -> None:
+        # После fork (несколько воркеров uvicorn) сокеты родителя использовать нельзя
+        if self._pid != os.getpid():
+            with self._lock:
+                self._idle.clear()
+                self._pid = os.getpid()
+
+    def _acquire(self, timeout: float) -> Tuple[http.client.HTTPConnection, bool]:
+        self._check_fork()
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout:
+                    self.stats['connections_reused'] += 1
+                    return conn, True
+                conn.close()
+        return self._new_connection(timeout), False
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                headers: Optional[Dict[str, str]] = None, body: Optional[bytes] = None,
+                timeout: Optional[float] = None, priority: Optional[int] = None) -> Tuple[int, Dict[str, str], bytes]:
+        timeout = endpoint_timeout(path, timeout)
+        # Ожидание лимитов, слота пула и сам запрос укладываются в один общий timeout
+        deadline = time.monotonic() + timeout
+        target = build_target(path, params)
+        request_headers = {**DEFAULT_HEADERS, **(headers or {})}
+
+        # Сначала бюджет лимитов Bybit (с учётом приоритета), потом соединение из пула
+        limiter = get_limiter()
+        limiter.acquire(path, priority, timeout)
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise PoolTimeout(f'Bybit connection pool exhausted ({self.pool_size})')
+        try:
+            self.stats['requests'] += 1
+            for attempt in range(2):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise PoolTimeout(f'Bybit request {path}: no time left after waiting for the pool')
+                conn, reused = self._acquire(left)
+                conn.timeout = left
+                if conn.sock is not None:
+                    conn.sock.settimeout(left)
+                try:
+                    conn.request(method, target, body=body, headers=request_headers)
+                    response = conn.getresponse()
+                    raw = response.read()
+                except _STALE_ERRORS:
+                    conn.close()
+                    if reused and attempt == 0 and method in IDEMPOTENT_METHODS \
+                            and deadline > time.monotonic():
+                        continue
+                    raise
+                except Exception:
+                    conn.close()
+                    raise
+
+                response_headers = {k.lower(): v for k, v in response.getheaders()}
+                limiter.observe(path, response.status, response_headers)
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._release(conn)
+                return response.status, response_headers, decode_body(raw, response_headers.get('content-encoding'))
+        finally:
+            self._slots.release()
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None,
+                 headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                 priority: Optional[int] = None) -> Dict[str, Any]:
+        '''GET с hedging, повторами и circuit breaker (см. resilience.py).'''
+        def attempt() -> Dict[str, Any]:
+            status, _, body = self.request('GET', path, params=params, headers=headers, timeout=timeout,
+                                           priority=priority)
+            return check_rate_limit(path, parse_json(status, body))
+
+        return get_resilience().call(path, params, attempt, endpoint_timeout(path, timeout), is_retryable)
+
+    def close(self) -> None:
+        with self._lock:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+
+class AsyncBybitClient:
+    '''
+    Асинхронный вариант клиента на asyncio-стримах (HTTP/1.1 keep-alive).
+    Экземпляр привязан к своему event loop.
+    '''
+
+    def __init__(self, base_url: str = BYBIT_BASE_URL, pool_size: int = POOL_SIZE,
+                 idle_timeout: float = IDLE_TIMEOUT):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._ssl_context = ssl.create_default_context() if self.scheme == 'https' else None
+        self._idle: deque = deque()
+        self._slots = asyncio.Semaphore(pool_size)
+        self.stats = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0}
+
+    async def _acquire(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if now - last_used < self.idle_timeout and not writer.is_closing():
+                self.stats['connections_reused'] += 1
+                return reader, writer, True
+            writer.close()
+        self.stats['connections_opened'] += 1
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self._ssl_context)
+        return reader, writer, False
+
+    async def _read_response(self, reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str], bytes, bool]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by Bybit')
+        status = int(status_line.split(b' ', 2)[1])
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        return status, headers, decode_body(body, headers.get('content-encoding')), keep_alive
+
+    async def request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                      headers: Optional[Dict[str, str]] = None, body: Optional[bytes] = None,
+                      timeout: Optional[float] = None, priority: Optional[int] = None) -> Tuple[int, Dict[str, str], bytes]:
+        timeout = endpoint_timeout(path, timeout)
+        request_headers = {**DEFAULT_HEADERS, 'Host': self.host, **(headers or {})}
+        if body is not None:
+            request_headers['Content-Length'] = str(len(body))
+        head = f'{method} {build_target(path, params)} HTTP/1.1\r\n'
+        head += ''.join(f'{k}: {v}\r\n' for k, v in request_headers.items()) + '\r\n'
+        payload = head.encode('latin-1') + (body or b'')
+
+        deadline = time.monotonic() + timeout
+        limiter = get_limiter()
+        await limiter.acquire_async(path, priority, timeout)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f'Bybit connection pool exhausted ({self.pool_size})') from None
+        try:
+            self.stats['requests'] += 1
+            for attempt in range(2):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise PoolTimeout(f'Bybit request {path}: no time left after waiting for the pool')
+                reader, writer, reused = await asyncio.wait_for(self._acquire(), left)
+                try:
+                    writer.write(payload)
+                    await writer.drain()
+                    status, response_headers, data, keep_alive = await asyncio.wait_for(
+                        self._read_response(reader), max(0.0, deadline - time.monotonic())
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused and attempt == 0 and method in IDEMPOTENT_METHODS \
+                            and deadline > time.monotonic():
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+
+                limiter.observe(path, status, response_headers)
+                if keep_alive:
+                    self._idle.append((reader, writer, time.monotonic()))
+                else:
+                    writer.close()
+                return status, response_headers, data
+        finally:
+            self._slots.release()
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None,
+                       headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                       priority: Optional[int] = None) -> Dict[str, Any]:
+        status, _, body = await self.request('GET', path, params=params, headers=headers, timeout=timeout,
+                                             priority=priority)
+        return check_rate_limit(path, parse_json(status, body))
+
+    async def close(self) -> None:
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+_client: Optional[BybitHTTPClient] = None
+_client_lock = threading.Lock()
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncBybitClient]' = weakref.WeakKeyDictionary()
+
+
+def get_client() -> BybitHTTPClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = BybitHTTPClient()
+    return _client
+
+
+def get_async_client() -> AsyncBybitClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncBybitClient()
+    return client
+
+
+def get_json(path: str, params: Optional[Dict[str, Any]] = None,
+             headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+             priority: Optional[int] = None) -> Dict[str, Any]:
+    return get_client().get_json(path, params=params, headers=headers, timeout=timeout, priority=priority)
+
+
+async def async_get_json(path: str, params: Optional[Dict[str, Any]] = None,
+                         headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None,
+                         priority: Optional[int] = None) -> Dict[str, Any]:
+    return await get_async_client().get_json(path, params=params, headers=headers, timeout=timeout,
+                                             priority=priority)
@@ -1,13 +1,20 @@
-import json
 import os
 import time
 import hmac
 import hashlib
 from urllib.parse import urlencode
-from urllib.request import Request, urlopen
 from typing import Dict, Any, List
 
-BYBIT_BASE_URL = "https://api.bybit.com"
+from . import fast_json
+from .bybit_client import get_json
+from .rate_limiter import TRADE, limiter_stats
+from .single_flight import get_flight, flight_stats
+from .resilience import CircuitOpenError, resilience_stats
+from .ticker_cache import get_tickers, cache_stats
+from .candle_store import get_candles, store_stats
+from .indicator_state import engine_stats
+from .market_stream import live_tickers, live_candles, live_orderbook, stream_stats
+from .orderbook import rest_orderbook, rest_stats
 
 def generate_signature(params: Dict[str, Any], secret: str) -> str:
     param_str = urlencode(sorted(params.items()))
@@ -28,14 +35,8 @@ def bybit_request(endpoint: str, params: Dict[str, Any] = None) -> Dict[str, Any
     params['timestamp'] = str(int(time.time() * 1000))
     params['sign'] = generate_signature(params, api_secret)
     
-    url = f"{BYBIT_BASE_URL}{endpoint}?{urlencode(params)}"
-    
-    request = Request(url, headers={
-        'Content-Type': 'application/json'
-    })
-    
-    with urlopen(request, timeout=10) as response:
-        return json.loads(response.read().decode('utf-8'))
+    # Подписанные запросы аккаунта идут в приоритете торговых: не ждут за опросом графиков
+    return get_json(endpoint, params, headers={'Content-Type': 'application/json'}, priority=TRADE)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -67,126 +68,115 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if action == 'tickers':
                 symbols = params.get('symbols', 'BTCUSDT,ETHUSDT,SOLUSDT,BNBUSDT,XRPUSDT').split(',')
                 
-                url = f"{BYBIT_BASE_URL}/v5/market/tickers?category=spot"
-                request = Request(url)
-                
-                with urlopen(request, timeout=10) as response:
-                    data = json.loads(response.read().decode('utf-8'))
-                
-                if data.get('retCode') == 0:
-                    tickers = data.get('result', {}).get('list', [])
-                    filtered = [
-                        {
-                            'symbol': t['symbol'],
-                            'price': float(t.get('lastPrice', 0)),
-                            'change': float(t.get('price24hPcnt', 0)) * 100,
-                            'volume': t.get('volume24h', '0'),
-                            'high24h': float(t.get('highPrice24h', 0)),
-                            'low24h': float(t.get('lowPrice24h', 0))
-                        }
-                        for t in tickers if t['symbol'] in symbols
-                    ]
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({'success': True, 'data': filtered}),
-                        'isBase64Encoded': False
+                # Свежие тикеры из WebSocket-потока, иначе — общий REST-кэш
+                tickers = live_tickers('spot', symbols) or get_tickers('spot')
+                filtered = [
+                    {
+                        'symbol': t['symbol'],
+                        'price': float(t.get('lastPrice', 0)),
+                        'change': float(t.get('price24hPcnt', 0)) * 100,
+                        'volume': t.get('volume24h', '0'),
+                        'high24h': float(t.get('highPrice24h', 0)),
+                        'low24h': float(t.get('lowPrice24h', 0))
                     }
+                    for t in tickers if t['symbol'] in symbols
+                ]
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': fast_json.dumps({'success': True, 'data': filtered}),
+                    'isBase64Encoded': False
+                }
             
             elif action == 'kline':
                 symbol = params.get('symbol', 'BTCUSDT')
-                interval_input = params.get('interval', '15')
-                limit = params.get('limit', '50')
-                
-                # Конвертация формата интервала (1h → 60, 4h → 240, 1d → D)
-                interval_map = {
-                    '15m': '15',
-                    '1h': '60',
-                    '4h': '240',
-                    '1d': 'D',
-                    '15': '15',
-                    '60': '60',
-                    '240': '240',
-                    'D': 'D'
-                }
-                interval = interval_map.get(interval_input, interval_input)
-                
-                url = f"{BYBIT_BASE_URL}/v5/market/kline?category=spot&symbol={symbol}&interval={interval}&limit={limit}"
-                request = Request(url)
+                interval = params.get('interval', '15')
+                limit = int(params.get('limit', '50'))
+                category = params.get('category', 'spot')
                 
-                with urlopen(request, timeout=10) as response:
-                    data = json.loads(response.read().decode('utf-8'))
+                # Свечи берутся из потока или локального хранилища, из Bybit догружаются только новые;
+                # одновременные одинаковые запросы (граница свечи) ждут одну загрузку
+                formatted = live_candles(symbol, interval, limit, category) or get_flight('kline').do(
+                    (category, symbol, interval, limit), get_candles, symbol, interval, limit, category
+                )
                 
-                if data.get('retCode') == 0:
-                    klines = data.get('result', {}).get('list', [])
-                    formatted = [
-                        {
-                            'time': k[0],
-                            'open': float(k[1]),
-                            'high': float(k[2]),
-                            'low': float(k[3]),
-                            'close': float(k[4]),
-                            'volume': float(k[5])
-                        }
-                        for k in reversed(klines)
-                    ]
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({'success': True, 'data': formatted}),
-                        'isBase64Encoded': False
-                    }
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': fast_json.dumps({'success': True, 'data': formatted}),
+                    'isBase64Encoded': False
+                }
             
             elif action == 'orderbook':
                 symbol = params.get('symbol', 'BTCUSDT')
-                limit = params.get('limit', '25')
+                limit = int(params.get('limit', '25'))
+                cumulative = params.get('cumulative') == 'true'
                 
-                url = f"{BYBIT_BASE_URL}/v5/market/orderbook?category=spot&symbol={symbol}&limit={limit}"
-                request = Request(url)
+                # Стакан из WebSocket-потока, иначе REST-снимок, переиспользуемый между опросами
+                book = live_orderbook(symbol, limit, 'spot', cumulative) or get_flight('orderbook').do(
+                    ('spot', symbol, limit, cumulative), rest_orderbook, symbol, limit, 'spot', cumulative
+                )
                 
-                with urlopen(request, timeout=10) as response:
-                    data = json.loads(response.read().decode('utf-8'))
+                merged = []
                 
-                if data.get('retCode') == 0:
-                    orderbook_data = data.get('result', {})
-                    bids = orderbook_data.get('b', [])
-                    asks = orderbook_data.get('a', [])
-                    
-                    merged = []
-                    
-                    # Добавляем все ask уровни (продажи)
-                    for ask in asks:
-                        merged.append({
-                            'price': float(ask[0]),
-                            'bidSize': 0,
-                            'askSize': float(ask[1])
-                        })
-                    
-                    # Добавляем все bid уровни (покупки)
-                    for bid in bids:
-                        merged.append({
-                            'price': float(bid[0]),
-                            'bidSize': float(bid[1]),
-                            'askSize': 0
-                        })
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({'success': True, 'data': merged}),
-                        'isBase64Encoded': False
-                    }
+                # Добавляем все ask уровни (продажи)
+                for i, (price, size) in enumerate(book['a']):
+                    level = {'price': price, 'bidSize': 0, 'askSize': size}
+                    if cumulative:
+                        level['askTotal'] = book['aDepth'][i]
+                    merged.append(level)
+                
+                # Добавляем все bid уровни (покупки)
+                for i, (price, size) in enumerate(book['b']):
+                    level = {'price': price, 'bidSize': size, 'askSize': 0}
+                    if cumulative:
+                        level['bidTotal'] = book['bDepth'][i]
+                    merged.append(level)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': fast_json.dumps({
+                        'success': True,
+                        'data': merged,
+                        'spread': book['spread'],
+                        'mid': book['mid']
+                    }),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'stats':
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': fast_json.dumps({
+                        'success': True,
+                        'data': {
+                            'tickerCache': cache_stats(),
+                            'candleStore': store_stats(),
+                            'indicatorEngine': engine_stats(),
+                            'marketStream': stream_stats(),
+                            'restOrderbooks': rest_stats(),
+                            'upstreamLimits': limiter_stats(),
+                            'singleFlight': flight_stats(),
+                            'upstreamResilience': resilience_stats()
+                        }
+                    }),
+                    'isBase64Encoded': False
+                }
             
             elif action == 'balance':
                 if not os.environ.get('BYBIT_API_KEY'):
@@ -196,7 +186,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             'Content-Type': 'application/json',
                             'Access-Control-Allow-Origin': '*'
                         },
-                        'body': json.dumps({
+                        'body': fast_json.dumps({
                             'success': False, 
                             'error': 'API keys not configured'
                         }),
@@ -211,7 +201,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'success': True, 'data': result}),
+                    'body': fast_json.dumps({'success': True, 'data': result}),
                     'isBase64Encoded': False
                 }
             
@@ -221,7 +211,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'success': False, 'error': 'Invalid action'}),
+                'body': fast_json.dumps({'success': False, 'error': 'Invalid action'}),
+                'isBase64Encoded': False
+            }
+            
+        except CircuitOpenError as e:
+            # Bybit недоступен, сохранённого ответа нет — сразу 503 вместо ожидания таймаута
+            return {
+                'statusCode': 503,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Retry-After': str(max(1, int(e.retry_after)))
+                },
+                'body': fast_json.dumps({'success': False, 'error': str(e)}),
                 'isBase64Encoded': False
             }
             
@@ -232,7 +235,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'success': False, 'error': str(e)}),
+                'body': fast_json.dumps({'success': False, 'error': str(e)}),
                 'isBase64Encoded': False
             }
     
@@ -242,6 +245,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps({'success': False, 'error': 'Method not allowed'}),
+        'body': fast_json.dumps({'success': False, 'error': 'Method not allowed'}),
         'isBase64Encoded': False
     }
@@ -0,0 +1,284 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from .bybit_client import get_json
+from .resilience import stale_since
+
+CANDLE_STORE_PATH = os.environ.get(
+    'CANDLE_STORE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'candles.db')
+)
+# Не ходить в Bybit за одной и той же серией чаще, чем раз в N секунд
+CANDLE_SYNC_MIN_INTERVAL = float(os.environ.get('CANDLE_SYNC_MIN_INTERVAL', '5'))
+# Максимум свечей, догружаемых за одну синхронизацию после долгого простоя
+CANDLE_SYNC_MAX_CANDLES = int(os.environ.get('CANDLE_SYNC_MAX_CANDLES', '5000'))
+
+BYBIT_PAGE_LIMIT = 1000
+
+INTERVAL_MS = {
+    '1': 60_000, '3': 180_000, '5': 300_000, '15': 900_000, '30': 1_800_000,
+    '60': 3_600_000, '120': 7_200_000, '240': 14_400_000, '360': 21_600_000,
+    '720': 43_200_000, 'D': 86_400_000, 'W': 604_800_000, 'M': 2_678_400_000,
+}
+
+# Конвертация формата интервала (1h → 60, 4h → 240, 1d → D)
+INTERVAL_ALIASES = {
+    '1m': '1', '5m': '5', '15m': '15', '30m': '30',
+    '1h': '60', '2h': '120', '4h': '240', '6h': '360', '12h': '720',
+    '1d': 'D', '1w': 'W', '1M': 'M',
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS candles (
+    category TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    open REAL NOT NULL,
+    high REAL NOT NULL,
+    low REAL NOT NULL,
+    close REAL NOT NULL,
+    volume REAL NOT NULL,
+    PRIMARY KEY (category, symbol, interval, time)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS candle_sync (
+    category TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (category, symbol, interval)
+) WITHOUT ROWID;
+'''
+
+SeriesKey = Tuple[str, str, str]
+
+
+def normalize_interval(interval: str) -> str:
+    return INTERVAL_ALIASES.get(interval, interval)
+
+
+class CandleStore:
+    '''
+    Локальное хранилище OHLCV-свечей в SQLite.
+    Для каждой серии (category, symbol, interval) хранит всю накопленную историю
+    и догружает из Bybit только свечи не старше последней сохранённой (watermark).
+    Последняя, ещё формирующаяся свеча перезаписывается при каждой синхронизации.
+    '''
+
+    def __init__(self, path: str = CANDLE_STORE_PATH, min_sync_interval: float = CANDLE_SYNC_MIN_INTERVAL):
+        self.path = path
+        self.min_sync_interval = min_sync_interval
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._series_locks: Dict[SeriesKey, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.counters = {'syncs': 0, 'skippedSyncs': 0, 'upstreamCandles': 0, 'servedCandles': 0, 'errors': 0,
+                         'staleUpstream': 0, 'windowReloads': 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3-соединение нельзя делить между потоками — держим своё на поток
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _series_lock(self, key: SeriesKey) -> threading.Lock:
+        with self._guard:
+            if key not in self._series_locks:
+                self._series_locks[key] = threading.Lock()
+            return self._series_locks[key]
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._guard:
+            self.counters[name] += value
+
+    def watermark(self, category: str, symbol: str, interval: str) -> Tuple[Optional[int], int]:
+        row = self._conn().execute(
+            'SELECT MAX(time), COUNT(*) FROM candles WHERE category = ? AND symbol = ? AND interval = ?',
+            (category, symbol, interval)
+        ).fetchone()
+        return row[0], row[1]
+
+    def coverage(self, category: str, symbol: str, interval: str, limit: int) -> Tuple[Optional[int], bool]:
+        '''
+        Время последней сохранённой свечи и есть ли limit последних свечей без пропусков.
+        Считается только окно, которое отдаст read(), а не вся серия: дыра после долгого
+        простоя внутри окна означает, что окно нужно загрузить заново.
+        '''
+        times = [row[0] for row in self._conn().execute(
+            'SELECT time FROM candles WHERE category = ? AND symbol = ? AND interval = ? ORDER BY time DESC LIMIT ?',
+            (category, symbol, interval, limit)
+        )]
+        if not times:
+            return None, False
+        # Для месячных свечей шаг — 31 день, пропуск месяца всё равно даёт разницу больше шага
+        step = INTERVAL_MS.get(interval)
+        contiguous = len(times) >= limit and (
+            step is None or all(newer - older <= step for newer, older in zip(times, times[1:]))
+        )
+        return times[0], contiguous
+
+    def _synced_at(self, category: str, symbol: str, interval: str) -> float:
+        row = self._conn().execute(
+            'SELECT synced_at FROM candle_sync WHERE category = ? AND symbol = ? AND interval = ?',
+            (category, symbol, interval)
+        ).fetchone()
+        return row[0] if row else 0.0
+
+    def _fetch_page(self, category: str, symbol: str, interval: str, limit: int,
+                    start: Optional[int] = None, end: Optional[int] = None) -> List[list]:
+        params: Dict[str, Any] = {
+            'category': category,
+            'symbol': symbol,
+            'interval': interval,
+            'limit': limit
+        }
+        if start is not None:
+            params['start'] = start
+        if end is not None:
+            params['end'] = end
+
+        data = get_json('/v5/market/kline', params)
+        if data.get('retCode') != 0:
+            raise RuntimeError(f"Bybit kline error: {data.get('retMsg', 'unknown')}")
+        if stale_since(data) is not None:
+            # Старый ответ из резерва resilience не записывается: формирующаяся свеча в нём устарела,
+            # а отметка синхронизации отложила бы догрузку. Отдаются свечи с диска.
+            self._count('staleUpstream')
+            raise RuntimeError('Bybit kline is unavailable, stale fallback response is not stored')
+        return data.get('result', {}).get('list', [])
+
+    def _fetch_range(self, category: str, symbol: str, interval: str,
+                     start: Optional[int], max_candles: int) -> List[list]:
+        # Bybit отдаёт последние limit свечей диапазона (от новых к старым),
+        # поэтому пагинируем назад от текущего момента до start
+        rows: List[list] = []
+        end = None
+        while len(rows) < max_candles:
+            page_limit = min(BYBIT_PAGE_LIMIT, max_candles - len(rows))
+            page = self._fetch_page(category, symbol, interval, page_limit, start=start, end=end)
+            if not page:
+                break
+            rows.extend(page)
+            oldest = int(page[-1][0])
+            if len(page) < page_limit or (start is not None and oldest <= start):
+                break
+            end = oldest - 1
+        return rows
+
+    def save(self, category: str, symbol: str, interval: str, rows: List[list]) -> None:
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO candles (category, symbol, interval, time, open, high, low, close, volume) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (category, symbol, interval, int(k[0]), float(k[1]), float(k[2]),
+                     float(k[3]), float(k[4]), float(k[5]))
+                    for k in rows
+                ]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO candle_sync (category, symbol, interval, synced_at) VALUES (?, ?, ?, ?)',
+                (category, symbol, interval, time.time())
+            )
+
+    def sync(self, category: str, symbol: str, interval: str, limit: int, force: bool = False) -> None:
+        '''Догружает из Bybit свечи, которых ещё нет в хранилище.'''
+        key = (category, symbol, interval)
+        with self._series_lock(key):
+            watermark, covered = self.coverage(*key, limit)
+            fresh = time.time() - self._synced_at(*key) < self.min_sync_interval
+            if not force and fresh and covered:
+                self._count('skippedSyncs')
+                return
+
+            # Догрузка от watermark ограничена CANDLE_SYNC_MAX_CANDLES: после более долгого
+            # простоя между старыми и новыми свечами осталась бы дыра
+            step = INTERVAL_MS.get(interval)
+            behind = watermark is not None and step is not None and \
+                (time.time() * 1000 - watermark) / step > CANDLE_SYNC_MAX_CANDLES
+            if watermark is None or not covered or behind:
+                # Окно из limit последних свечей целиком, от текущего момента назад
+                if watermark is not None:
+                    self._count('windowReloads')
+                rows = self._fetch_range(category, symbol, interval, None, limit)
+            else:
+                rows = self._fetch_range(category, symbol, interval, watermark, CANDLE_SYNC_MAX_CANDLES)
+
+            self.save(category, symbol, interval, rows)
+            self._count('syncs')
+            self._count('upstreamCandles', len(rows))
+
+    def read(self, category: str, symbol: str, interval: str, limit: int) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            'SELECT time, open, high, low, close, volume FROM candles '
+            'WHERE category = ? AND symbol = ? AND interval = ? ORDER BY time DESC LIMIT ?',
+            (category, symbol, interval, limit)
+        ).fetchall()
+        self._count('servedCandles', len(rows))
+        return [
+            {
+                'time': str(r[0]),
+                'open': r[1],
+                'high': r[2],
+                'low': r[3],
+                'close': r[4],
+                'volume': r[5]
+            }
+            for r in reversed(rows)
+        ]
+
+    def get_candles(self, symbol: str, interval: str = '15', limit: int = 200,
+                    category: str = 'linear') -> List[Dict[str, Any]]:
+        '''
+        Свечи в порядке от старых к новым (формат как у action=kline).
+        Если Bybit недоступен, отдаёт то, что уже есть на диске.
+        '''
+        interval = normalize_interval(interval)
+        try:
+            self.sync(category, symbol, interval, limit)
+        except Exception:
+            self._count('errors')
+            if self.watermark(category, symbol, interval)[0] is None:
+                raise
+        return self.read(category, symbol, interval, limit)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._guard:
+            return dict(self.counters)
+
+
+_store: Optional[CandleStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> CandleStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CandleStore()
+    return _store
+
+
+def get_candles(symbol: str, interval: str = '15', limit: int = 200,
+                category: str = 'linear') -> List[Dict[str, Any]]:
+    return get_store().get_candles(symbol, interval, limit, category)
+
+
+def store_stats() -> Dict[str, Any]:
+    return get_store().stats()
@@ -0,0 +1,186 @@
+import argparse
+import random
+import sys
+from typing import List, Optional
+
+import numpy as np
+
+try:
+    from functions import indicators
+except ImportError:  # запуск прямо из папки transfer/
+    import indicators
+
+# Сверяет indicators.py с прежними расчётами на чистом Python, которые библиотека заменила:
+# EMA и RSI Уайлдера из ma-crossover-strategy (весь ряд), RSI и SMA из strategy_signals
+# и ATR/SMA из pair_analyzer (последнее значение). Ряды — случайные блуждания плюс
+# крайние случаи (плоский, монотонный, короткий); каждый ряд проверяется и отдельно,
+# и строкой матрицы символы × время. При расхождении код выхода 1.
+#   python -m functions.check_indicator_parity --series 200 --length 300
+
+
+def legacy_ema(prices: List[float], period: int) -> List[Optional[float]]:
+    '''ma-crossover-strategy: calculate_ema.'''
+    if len(prices) < period:
+        return [None] * len(prices)
+    multiplier = 2 / (period + 1)
+    ema_values = [None] * (period - 1)
+    ema_values.append(sum(prices[:period]) / period)
+    for price in prices[period:]:
+        ema_values.append((price - ema_values[-1]) * multiplier + ema_values[-1])
+    return ema_values
+
+
+def legacy_rsi_wilder(prices: List[float], period: int = 14) -> List[Optional[float]]:
+    '''ma-crossover-strategy: calculate_rsi.'''
+    if len(prices) < period + 1:
+        return [None] * len(prices)
+    rsi_values = [None] * period
+    changes = [prices[i] - prices[i-1] for i in range(1, len(prices))]
+    gains = [change if change > 0 else 0 for change in changes]
+    losses = [-change if change < 0 else 0 for change in changes]
+    avg_gain = sum(gains[:period]) / period
+    avg_loss = sum(losses[:period]) / period
+    rsi_values.append(100 if avg_loss == 0 else 100 - (100 / (1 + avg_gain / avg_loss)))
+    for i in range(period, len(changes)):
+        avg_gain = (avg_gain * (period - 1) + gains[i]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[i]) / period
+        rsi_values.append(100 if avg_loss == 0 else 100 - (100 / (1 + avg_gain / avg_loss)))
+    return rsi_values
+
+
+def legacy_rsi_simple(prices: List[float], period: int = 14) -> float:
+    '''strategy_signals: calculate_rsi.'''
+    gains = []
+    losses = []
+    for i in range(1, len(prices)):
+        change = prices[i] - prices[i-1]
+        if change > 0:
+            gains.append(change)
+            losses.append(0)
+        else:
+            gains.append(0)
+            losses.append(abs(change))
+    avg_gain = sum(gains[-period:]) / period
+    avg_loss = sum(losses[-period:]) / period
+    if avg_loss == 0:
+        return 100.0
+    return 100 - (100 / (1 + avg_gain / avg_loss))
+
+
+def legacy_sma(prices: List[float], period: int) -> float:
+    '''strategy_signals: calculate_ma, pair_analyzer: calculate_trend_strength.'''
+    return sum(prices[-period:]) / period
+
+
+def legacy_atr(highs: List[float], lows: List[float], closes: List[float]) -> float:
+    '''pair_analyzer: calculate_volatility (среднее TR за 14 свечей).'''
+    atr_values = []
+    for i in range(1, len(closes)):
+        high_low = highs[i] - lows[i]
+        high_close = abs(highs[i] - closes[i-1])
+        low_close = abs(lows[i] - closes[i-1])
+        atr_values.append(max(high_low, high_close, low_close))
+    return sum(atr_values[-14:]) / 14
+
+
+def make_series(rng: random.Random, count: int, length: int) -> List[List[float]]:
+    series = []
+    for _ in range(count):
+        price = rng.uniform(0.01, 70000)
+        closes = []
+        for _ in range(length):
+            price = max(price * (1 + rng.gauss(0, 0.01)), 1e-6)
+            closes.append(price)
+        series.append(closes)
+    # Крайние случаи: без изменений цены (avg_loss == 0), только рост, только падение
+    series.append([100.0] * length)
+    series.append([100.0 + i for i in range(length)])
+    series.append([100.0 + length - i for i in range(length)])
+    return series
+
+
+def candles(rng: random.Random, closes: List[float]):
+    highs = [c * (1 + rng.uniform(0, 0.01)) for c in closes]
+    lows = [c * (1 - rng.uniform(0, 0.01)) for c in closes]
+    return highs, lows
+
+
+def same(expected: Optional[float], actual: float, tolerance: float) -> bool:
+    if expected is None:
+        return bool(np.isnan(actual))
+    return abs(expected - actual) <= tolerance * max(1.0, abs(expected))
+
+
+class Report:
+    def __init__(self, tolerance: float):
+        self.tolerance = tolerance
+        self.checked = 0
+        self.failures: List[str] = []
+
+    def series(self, name: str, expected: List[Optional[float]], actual: np.ndarray) -> None:
+        self.checked += 1
+        if len(expected) != len(actual):
+            self.failures.append(f'{name}: length {len(actual)} != {len(expected)}')
+            return
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            if not same(e, float(a), self.tolerance):
+                self.failures.append(f'{name}[{i}]: {a} != {e}')
+                return
+
+    def value(self, name: str, expected: float, actual: float) -> None:
+        self.series(name, [expected], np.array([actual]))
+
+
+def check(rows: List[List[float]], rng: random.Random, report: Report) -> None:
+    highs, lows = zip(*(candles(rng, closes) for closes in rows))
+    matrices = {
+        'ema9': indicators.ema(rows, 9),
+        'ema21': indicators.ema(rows, 21),
+        'rsi14': indicators.rsi(rows, 14),
+        'rsiSimple14': indicators.rsi(rows, 14, method='simple'),
+        'atr14': indicators.atr(highs, lows, rows, 14),
+        'sma10': indicators.sma(rows, 10),
+    }
+    for r, closes in enumerate(rows):
+        high, low = highs[r], lows[r]
+        single = {
+            'ema9': indicators.ema(closes, 9),
+            'ema21': indicators.ema(closes, 21),
+            'rsi14': indicators.rsi(closes, 14),
+            'rsiSimple14': indicators.rsi(closes, 14, method='simple'),
+            'atr14': indicators.atr(high, low, closes, 14),
+            'sma10': indicators.sma(closes, 10),
+        }
+        in_matrix = {name: values[r] for name, values in matrices.items()}
+        for layout, values in (('1d', single), ('2d', in_matrix)):
+            tag = f'{layout} row {r}'
+            report.series(f'ema9 {tag}', legacy_ema(closes, 9), values['ema9'])
+            report.series(f'ema21 {tag}', legacy_ema(closes, 21), values['ema21'])
+            report.series(f'rsi14 {tag}', legacy_rsi_wilder(closes, 14), values['rsi14'])
+            report.value(f'rsiSimple14 {tag}', legacy_rsi_simple(closes, 14), values['rsiSimple14'][-1])
+            report.value(f'atr14 {tag}', legacy_atr(high, low, closes), values['atr14'][-1])
+            report.value(f'sma10 {tag}', legacy_sma(closes, 10), values['sma10'][-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Parity of indicators.py with the previous pure-Python code')
+    parser.add_argument('--series', type=int, default=200, help='сколько случайных рядов')
+    parser.add_argument('--length', type=int, default=300, help='свечей в ряду')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tolerance', type=float, default=1e-9, help='допустимая относительная погрешность')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    report = Report(args.tolerance)
+    check(make_series(rng, args.series, args.length), rng, report)
+    # Короткая история: значений ещё нет, библиотека должна вернуть NaN там же, где раньше None
+    check(make_series(rng, 3, 20), rng, report)
+
+    print(f'checked {report.checked} series, mismatches: {len(report.failures)}')
+    for failure in report.failures[:20]:
+        print(f'  {failure}')
+    sys.exit(1 if report.failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+# Соединение старше N секунд закрывается при возврате в пул (перебалансировка, утечки памяти на сервере)
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))
+# Соединение, простоявшее дольше N секунд, перед выдачей проверяется запросом SELECT 1
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+# Сколько секунд ждать свободного соединения, когда все DB_POOL_MAX заняты
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+_IDLE = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+_UNKNOWN = psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    Пул соединений PostgreSQL для обработчиков, живущих в долгоживущем python-gateway.
+    Потокобезопасен: одновременно выдаётся не больше max_size соединений, остальные ждут.
+    '''
+
+    def __init__(self, dsn: str, min_size: int = DB_POOL_MIN, max_size: int = DB_POOL_MAX,
+                 max_lifetime: float = DB_POOL_MAX_LIFETIME, check_after: float = DB_POOL_CHECK_AFTER,
+                 timeout: float = DB_POOL_TIMEOUT):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.timeout = timeout
+        # (соединение, время создания, время последнего возврата)
+        self._idle: deque = deque()
+        # Соединения, унаследованные от родителя после fork, — только держим ссылки (см. _after_fork)
+        self._inherited: list = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.counters = {
+            'checkouts': 0,
+            'connectionsOpened': 0,
+            'connectionsReused': 0,
+            'connectionsClosed': 0,
+            'failedHealthChecks': 0,
+            'timeouts': 0,
+        }
+
+        for _ in range(min_size):
+            self._idle.append((*self._connect(), time.monotonic()))
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def _connect(self) -> Tuple[Any, float]:
+        conn = psycopg2.connect(self.dsn)
+        self._count('connectionsOpened')
+        return conn, time.monotonic()
+
+    def _close(self, conn) -> None:
+        self._count('connectionsClosed')
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _after_fork(self) -> None:
+        # После fork (несколько воркеров uvicorn) соединения родителя — его сокеты. Закрывать их
+        # в потомке нельзя: close() и даже сборка мусора отправят Terminate в общий с родителем
+        # сокет. Поэтому ссылки на них остаются до конца процесса, а пул начинается с пустого.
+        # Блокировка могла быть захвачена другим потоком родителя в момент fork — создаём новую.
+        self._inherited.extend(conn for conn, _, _ in self._idle)
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+
+    @staticmethod
+    def _is_alive(conn) -> bool:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _acquire(self) -> Tuple[Any, float]:
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, created_at, returned_at = self._idle.pop()
+            if conn.closed or now - created_at >= self.max_lifetime:
+                self._close(conn)
+                continue
+            if now - returned_at >= self.check_after and not self._is_alive(conn):
+                self._count('failedHealthChecks')
+                self._close(conn)
+                continue
+            self._count('connectionsReused')
+            return conn, created_at
+        return self._connect()
+
+    def _release(self, conn, created_at: float) -> None:
+        if conn.closed or time.monotonic() - created_at >= self.max_lifetime:
+            self._close(conn)
+            return
+        try:
+            status = conn.get_transaction_status()
+            if status == _UNKNOWN:
+                self._close(conn)
+                return
+            if status != _IDLE:
+                # Обработчик не сделал commit (или упал посреди транзакции) — откатываем
+                conn.rollback()
+        except Exception:
+            self._close(conn)
+            return
+        with self._lock:
+            self._idle.append((conn, created_at, time.monotonic()))
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        '''Выдаёт соединение на время блока with и возвращает его в пул.'''
+        slots = self._slots
+        if not slots.acquire(timeout=self.timeout):
+            self._count('timeouts')
+            raise PoolTimeout(f'No free database connection in {self.timeout}s (pool size {self.max_size})')
+        try:
+            self._count('checkouts')
+            conn, created_at = self._acquire()
+            try:
+                yield conn
+            finally:
+                self._release(conn, created_at)
+        finally:
+            slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'idle': len(self._idle), 'maxSize': self.max_size, **self.counters}
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn: Optional[str] = None) -> ConnectionPool:
+    '''Пул на каждую строку подключения; создаётся при первом обращении.'''
+    dsn = dsn or os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise RuntimeError('DATABASE_URL is not configured')
+    pool = _pools.get(dsn)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = _pools[dsn] = ConnectionPool(dsn)
+    return pool
+
+
+@contextmanager
+def connection(dsn: Optional[str] = None) -> Iterator[Any]:
+    with get_pool(dsn).connection() as conn:
+        yield conn
+
+
+def _after_fork_in_child() -> None:
+    global _pools_lock
+    _pools_lock = threading.Lock()
+    for pool in _pools.values():
+        pool._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def pool_stats() -> Dict[str, Any]:
+    return {str(i): pool.stats() for i, pool in enumerate(_pools.values())}
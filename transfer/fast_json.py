@@ -0,0 +1,56 @@
+import json
+import math
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # без orjson работаем на стандартном json
+    orjson = None
+
+# Быстрая сериализация тел ответов. orjson в разы быстрее json.dumps на больших
+# списках (тикеры, свечи, результаты pair-analyzer) и понимает типы NumPy.
+# Вывод компактный (без пробелов после ',' и ':'), NaN/Infinity превращаются в null.
+
+_ORJSON_OPTIONS = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def _finite(obj: Any) -> Any:
+    '''Копия obj для стандартного json, где NaN/Infinity заменены на null, как у orjson.'''
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def _default(obj: Any) -> Any:
+    # Массивы и скаляры NumPy, которые orjson сериализует сам
+    tolist = getattr(obj, 'tolist', None)
+    if tolist is None:
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+    return _finite(tolist())
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # Например, целые больше 64 бит или неизвестные типы — отдаём стандартному json
+            pass
+    return json.dumps(_finite(obj), default=_default, allow_nan=False,
+                      separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj: Any) -> str:
+    '''Сериализует obj в строку JSON для поля body ответа обработчика.'''
+    return dumps_bytes(obj).decode('utf-8')
+
+
+def loads(data: Any) -> Any:
+    '''Разбор тела запроса (str или bytes); большие массивы свечей orjson разбирает в разы быстрее.'''
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
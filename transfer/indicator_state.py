@@ -0,0 +1,359 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from .candle_store import INTERVAL_MS, normalize_interval
+
+logger = logging.getLogger(__name__)
+
+INDICATOR_STATE_PATH = os.environ.get(
+    'INDICATOR_STATE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indicator_state.json')
+)
+
+# Потоковые версии индикаторов: каждое закрытие свечи обновляет состояние за O(1),
+# без пересчёта всей истории. Формулы совпадают с indicators.py
+# (EMA с затравкой SMA, RSI Уайлдера, простая SMA).
+
+
+class EMAState:
+    kind = 'ema'
+
+    def __init__(self, period: int):
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self.value: Optional[float] = None
+        self._seed_sum = 0.0
+        self._seed_count = 0
+
+    def _next(self, price: float) -> Tuple[Optional[float], float, int]:
+        if self.value is not None:
+            return (price - self.value) * self.alpha + self.value, self._seed_sum, self._seed_count
+        seed_sum, seed_count = self._seed_sum + price, self._seed_count + 1
+        if seed_count == self.period:
+            return seed_sum / self.period, seed_sum, seed_count
+        return None, seed_sum, seed_count
+
+    def update(self, price: float) -> Optional[float]:
+        self.value, self._seed_sum, self._seed_count = self._next(price)
+        return self.value
+
+    def peek(self, price: float) -> Optional[float]:
+        return self._next(price)[0]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'value': self.value, 'seed_sum': self._seed_sum, 'seed_count': self._seed_count}
+
+    def load(self, data: Dict[str, Any]) -> None:
+        self.value = data['value']
+        self._seed_sum = data['seed_sum']
+        self._seed_count = data['seed_count']
+
+
+class SMAState:
+    kind = 'sma'
+
+    def __init__(self, period: int):
+        self.period = period
+        self.value: Optional[float] = None
+        self._window: deque = deque(maxlen=period)
+        self._sum = 0.0
+
+    def _next_sum(self, price: float) -> float:
+        dropped = self._window[0] if len(self._window) == self.period else 0.0
+        return self._sum + price - dropped
+
+    def update(self, price: float) -> Optional[float]:
+        self._sum = self._next_sum(price)
+        self._window.append(price)
+        self.value = self._sum / self.period if len(self._window) == self.period else None
+        return self.value
+
+    def peek(self, price: float) -> Optional[float]:
+        if len(self._window) + 1 < self.period:
+            return None
+        return self._next_sum(price) / self.period
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'window': list(self._window), 'sum': self._sum}
+
+    def load(self, data: Dict[str, Any]) -> None:
+        self._window = deque(data['window'], maxlen=self.period)
+        self._sum = data['sum']
+        self.value = self._sum / self.period if len(self._window) == self.period else None
+
+
+class RSIState:
+    kind = 'rsi'
+
+    def __init__(self, period: int = 14):
+        self.period = period
+        self.value: Optional[float] = None
+        self._prev_close: Optional[float] = None
+        self._avg_gain = 0.0
+        self._avg_loss = 0.0
+        self._count = 0
+
+    @staticmethod
+    def _rsi(avg_gain: float, avg_loss: float) -> float:
+        if avg_loss == 0:
+            return 100.0
+        return 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+    def _next(self, price: float) -> Tuple[Optional[float], float, float, int]:
+        if self._prev_close is None:
+            return None, 0.0, 0.0, 0
+        change = price - self._prev_close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        count = self._count + 1
+
+        if count < self.period:
+            return None, self._avg_gain + gain, self._avg_loss + loss, count
+        if count == self.period:
+            # Первое значение — простое среднее за period изменений
+            avg_gain = (self._avg_gain + gain) / self.period
+            avg_loss = (self._avg_loss + loss) / self.period
+        else:
+            avg_gain = (self._avg_gain * (self.period - 1) + gain) / self.period
+            avg_loss = (self._avg_loss * (self.period - 1) + loss) / self.period
+        return self._rsi(avg_gain, avg_loss), avg_gain, avg_loss, count
+
+    def update(self, price: float) -> Optional[float]:
+        self.value, self._avg_gain, self._avg_loss, self._count = self._next(price)
+        self._prev_close = price
+        return self.value
+
+    def peek(self, price: float) -> Optional[float]:
+        return self._next(price)[0]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'value': self.value,
+            'prev_close': self._prev_close,
+            'avg_gain': self._avg_gain,
+            'avg_loss': self._avg_loss,
+            'count': self._count
+        }
+
+    def load(self, data: Dict[str, Any]) -> None:
+        self.value = data['value']
+        self._prev_close = data['prev_close']
+        self._avg_gain = data['avg_gain']
+        self._avg_loss = data['avg_loss']
+        self._count = data['count']
+
+
+STATE_TYPES = {cls.kind: cls for cls in (EMAState, SMAState, RSIState)}
+
+
+def is_closed(candle_time: int, interval: str, now_ms: Optional[int] = None) -> bool:
+    '''Закрыта ли свеча с временем открытия candle_time (мс) на момент now_ms.'''
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    return candle_time + INTERVAL_MS[normalize_interval(interval)] <= now_ms
+
+
+Values = Dict[str, Optional[float]]
+
+
+class IndicatorEngine:
+    '''
+    Хранит состояния индикаторов по ключу (symbol, interval, indicator, period).
+    Закрытая свеча продвигает состояние ровно один раз; формирующаяся свеча
+    только «примеряется» через peek и состояние не портит.
+    Состояние серии согласовано с её водяным знаком (последней учтённой закрытой свечой):
+    если новые свечи идут не подряд за ним или в серию добавлен индикатор, серия
+    пересчитывается заново по присланной истории.
+    '''
+
+    def __init__(self):
+        self._series: Dict[Tuple[str, str], Dict[Tuple[str, int], Any]] = {}
+        self._last_closed: Dict[Tuple[str, str], int] = {}
+        # Значения до последней закрытой свечи — для сигналов на пересечение
+        self._previous: Dict[Tuple[str, str], Values] = {}
+        self._lock = threading.Lock()
+        self.counters = {'replays': 0}
+
+    def _reset(self, series: Tuple[str, str]) -> None:
+        states = self._series.get(series, {})
+        for key in states:
+            states[key] = STATE_TYPES[key[0]](key[1])
+        self._last_closed.pop(series, None)
+        self._previous.pop(series, None)
+
+    def register(self, symbol: str, interval: str, indicator: str, period: int):
+        '''
+        Добавляет индикатор в серию. Если серия уже продвинута, новый индикатор начинал бы
+        с пустой истории, поэтому водяной знак сбрасывается: следующий warm_up/evaluate
+        прогонит присланную историю заново для всех индикаторов серии.
+        '''
+        series = (symbol, normalize_interval(interval))
+        with self._lock:
+            states = self._series.setdefault(series, {})
+            if (indicator, period) not in states:
+                states[(indicator, period)] = STATE_TYPES[indicator](period)
+                if series in self._last_closed:
+                    self._reset(series)
+            return states[(indicator, period)]
+
+    @staticmethod
+    def _values(states: Dict[Tuple[str, int], Any], price: Optional[float] = None) -> Values:
+        if price is None:
+            return {f'{name}{period}': state.value for (name, period), state in states.items()}
+        return {f'{name}{period}': state.peek(price) for (name, period), state in states.items()}
+
+    def _on_candle(self, series: Tuple[str, str], candle_time: int, close: float, closed: bool) -> Values:
+        states = self._series.get(series, {})
+        last = self._last_closed.get(series)
+        is_new = last is None or candle_time > last
+
+        if closed and is_new:
+            step = INTERVAL_MS[series[1]]
+            if last is not None and candle_time - last > step:
+                # Пропущены закрытые свечи — продолжать состояние нельзя, серия начинается заново
+                self._reset(series)
+                self.counters['replays'] += 1
+            self._previous[series] = self._values(states)
+            for state in states.values():
+                state.update(close)
+            self._last_closed[series] = candle_time
+            return self._values(states)
+
+        if not closed and is_new:
+            return self._values(states, close)
+
+        return self._values(states)
+
+    def on_candle(self, symbol: str, interval: str, candle_time: int, close: float,
+                  closed: bool = True) -> Values:
+        '''
+        Обрабатывает свечу и возвращает значения индикаторов серии вида {'ema9': ..., 'rsi14': ...}.
+        Повторно пришедшая закрытая свеча (или более старая) игнорируется.
+        '''
+        with self._lock:
+            return self._on_candle((symbol, normalize_interval(interval)), candle_time, float(close), closed)
+
+    def evaluate(self, symbol: str, interval: str, candles: List[Dict[str, Any]],
+                 now_ms: Optional[int] = None) -> Tuple[Values, Values]:
+        '''
+        Прогоняет историю свечей (формат candle_store, от старых к новым) и возвращает значения
+        на последней свече и на предыдущей. Учитываются только свечи новее водяного знака;
+        если они не продолжают его подряд, серия пересчитывается по всей присланной истории.
+        Последняя незакрытая свеча считается через peek. Если присланная история старше
+        состояния серии, возвращаются пустые значения.
+        '''
+        series = (symbol, normalize_interval(interval))
+        times = [int(candle['time']) for candle in candles]
+        closed = [is_closed(t, series[1], now_ms) for t in times]
+        with self._lock:
+            last = self._last_closed.get(series)
+            start = 0 if last is None else bisect_right(times, last)
+            if last is not None and start < len(times) and times[start] - last > INTERVAL_MS[series[1]]:
+                self._reset(series)
+                self.counters['replays'] += 1
+                start = 0
+            values = self._values(self._series.get(series, {}))
+            for i in range(start, len(candles)):
+                values = self._on_candle(series, times[i], float(candles[i]['close']), closed[i])
+            if not times:
+                return values, {}
+            last = self._last_closed.get(series)
+            if last is None or times[-1] > last:
+                # Последняя свеча формируется: предыдущая — последняя закрытая, то есть само состояние
+                previous = self._values(self._series.get(series, {}))
+            elif times[-1] == last:
+                previous = dict(self._previous.get(series, {}))
+            else:
+                # История старше состояния (серию уже продвинул более свежий источник) — значений нет
+                return {}, {}
+        return values, previous
+
+    def warm_up(self, symbol: str, interval: str, candles: List[Dict[str, Any]],
+                now_ms: Optional[int] = None) -> Values:
+        '''Прогоняет историю свечей (формат candle_store), последняя незакрытая — через peek.'''
+        return self.evaluate(symbol, interval, candles, now_ms)[0]
+
+    def last_closed(self, symbol: str, interval: str) -> Optional[int]:
+        return self._last_closed.get((symbol, normalize_interval(interval)))
+
+    def values(self, symbol: str, interval: str) -> Values:
+        with self._lock:
+            return self._values(self._series.get((symbol, normalize_interval(interval)), {}))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'series': len(self._series), **self.counters}
+
+    def snapshot(self, path: str = INDICATOR_STATE_PATH) -> None:
+        with self._lock:
+            data = {
+                'states': [
+                    {'key': [symbol, interval, name, period], 'state': state.to_dict()}
+                    for (symbol, interval), states in self._series.items()
+                    for (name, period), state in states.items()
+                ],
+                'last_closed': [
+                    {'key': list(key), 'time': t, 'previous': self._previous.get(key, {})}
+                    for key, t in self._last_closed.items()
+                ],
+                'saved_at': time.time()
+            }
+        # У каждого воркера шлюза свой временный файл, на место встаёт последний записанный
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def restore(self, path: str = INDICATOR_STATE_PATH) -> bool:
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            data = json.load(f)
+        # Сначала разбираем весь снимок: частично загруженные серии без водяного знака дали бы неверные значения
+        series: Dict[Tuple[str, str], Dict[Tuple[str, int], Any]] = {}
+        last_closed: Dict[Tuple[str, str], int] = {}
+        previous: Dict[Tuple[str, str], Values] = {}
+        for item in data.get('states', []):
+            symbol, interval, indicator, period = item['key']
+            state = STATE_TYPES[indicator](period)
+            state.load(item['state'])
+            series.setdefault((symbol, interval), {})[(indicator, period)] = state
+        for item in data.get('last_closed', []):
+            key = tuple(item['key'])
+            last_closed[key] = item['time']
+            previous[key] = item.get('previous', {})
+        with self._lock:
+            self._series.update(series)
+            self._last_closed.update(last_closed)
+            self._previous.update(previous)
+        return True
+
+
+_engine: Optional[IndicatorEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> IndicatorEngine:
+    '''Общий движок процесса; при первом обращении поднимает состояние с диска.'''
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = IndicatorEngine()
+                try:
+                    engine.restore()
+                except (OSError, ValueError, KeyError, TypeError):
+                    # Повреждённый снимок не мешает работе: серии прогреются по истории свечей
+                    logger.exception('Indicator state restore from %s failed', INDICATOR_STATE_PATH)
+                atexit.register(engine.snapshot)
+                _engine = engine
+    return _engine
+
+
+def engine_stats() -> Dict[str, Any]:
+    return get_engine().stats()
@@ -0,0 +1,177 @@
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+ArrayLike = Union[Sequence[float], np.ndarray]
+
+# Все функции принимают одномерный ряд (время) или двумерную матрицу
+# символы × время и считают вдоль последней оси. Там, где значение ещё
+# не определено (мало истории), возвращается NaN.
+
+
+def as_series(values: ArrayLike) -> np.ndarray:
+    return np.asarray(values, dtype=np.float64)
+
+
+def to_optional_list(values: np.ndarray) -> List[Optional[float]]:
+    '''NaN → None, чтобы результат можно было отдать в JSON как раньше.'''
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def _rolling_sum(x: np.ndarray, period: int) -> np.ndarray:
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < period:
+        return out
+    csum = np.cumsum(x, axis=-1)
+    out[..., period - 1] = csum[..., period - 1]
+    out[..., period:] = csum[..., period:] - csum[..., :-period]
+    return out
+
+
+def sma(values: ArrayLike, period: int) -> np.ndarray:
+    '''Простая скользящая средняя.'''
+    return _rolling_sum(as_series(values), period) / period
+
+
+def ema(values: ArrayLike, period: int, seed: str = 'sma') -> np.ndarray:
+    '''
+    Экспоненциальная скользящая средняя.
+    seed='sma' — первое значение равно SMA первых period точек (как в ma-crossover-strategy),
+    seed='first' — ряд стартует с первой цены (как в src/lib/backtest.ts).
+    Рекурсия идёт по времени, но каждый шаг векторизован по всем символам сразу.
+    '''
+    x = as_series(values)
+    out = np.full(x.shape, np.nan)
+    n = x.shape[-1]
+    alpha = 2.0 / (period + 1)
+
+    if seed == 'first':
+        if n == 0:
+            return out
+        start, prev = 0, x[..., 0].copy()
+    else:
+        if n < period:
+            return out
+        start, prev = period - 1, x[..., :period].mean(axis=-1)
+
+    out[..., start] = prev
+    if x.ndim == 1:
+        # Для одного ряда цикл по обычным float заметно быстрее поэлементной индексации numpy
+        prev = float(prev)
+        result = []
+        for value in x[start + 1:].tolist():
+            prev = (value - prev) * alpha + prev
+            result.append(prev)
+        out[start + 1:] = result
+        return out
+    for i in range(start + 1, n):
+        prev = (x[..., i] - prev) * alpha + prev
+        out[..., i] = prev
+    return out
+
+
+def _gains_losses(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    changes = np.diff(x, axis=-1)
+    return np.where(changes > 0, changes, 0.0), np.where(changes < 0, -changes, 0.0)
+
+
+def _rsi_from_averages(avg_gain: np.ndarray, avg_loss: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    return np.where(avg_loss == 0, 100.0, rsi)
+
+
+def rsi(values: ArrayLike, period: int = 14, method: str = 'wilder') -> np.ndarray:
+    '''
+    Индекс относительной силы. Значение с индексом i использует изменения до цены i,
+    первое определённое значение — с индексом period.
+    method='wilder' — сглаживание Уайлдера, method='simple' — среднее за последние period изменений.
+    '''
+    x = as_series(values)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < period + 1:
+        return out
+
+    gains, losses = _gains_losses(x)
+
+    if method == 'simple':
+        avg_gain = _rolling_sum(gains, period) / period
+        avg_loss = _rolling_sum(losses, period) / period
+        out[..., 1:] = _rsi_from_averages(avg_gain, avg_loss)
+        out[..., :period] = np.nan
+        return out
+
+    avg_gain = gains[..., :period].mean(axis=-1)
+    avg_loss = losses[..., :period].mean(axis=-1)
+    out[..., period] = _rsi_from_averages(avg_gain, avg_loss)
+    for i in range(period, gains.shape[-1]):
+        avg_gain = (avg_gain * (period - 1) + gains[..., i]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[..., i]) / period
+        out[..., i + 1] = _rsi_from_averages(avg_gain, avg_loss)
+    return out
+
+
+def true_range(high: ArrayLike, low: ArrayLike, close: ArrayLike) -> np.ndarray:
+    '''True range; для первой свечи не определён (нет предыдущего close).'''
+    h, l, c = as_series(high), as_series(low), as_series(close)
+    out = np.full(h.shape, np.nan)
+    prev_close = c[..., :-1]
+    out[..., 1:] = np.maximum.reduce([
+        h[..., 1:] - l[..., 1:],
+        np.abs(h[..., 1:] - prev_close),
+        np.abs(l[..., 1:] - prev_close),
+    ])
+    return out
+
+
+def atr(high: ArrayLike, low: ArrayLike, close: ArrayLike, period: int = 14,
+        method: str = 'simple') -> np.ndarray:
+    '''
+    Average true range. method='simple' — среднее TR за period свечей (как в pair_analyzer),
+    method='wilder' — сглаживание Уайлдера.
+    '''
+    tr = true_range(high, low, close)
+    out = np.full(tr.shape, np.nan)
+    if tr.shape[-1] < period + 1:
+        return out
+
+    if method == 'simple':
+        out[..., 1:] = _rolling_sum(tr[..., 1:], period) / period
+        return out
+
+    prev = tr[..., 1:period + 1].mean(axis=-1)
+    out[..., period] = prev
+    for i in range(period + 1, tr.shape[-1]):
+        prev = (prev * (period - 1) + tr[..., i]) / period
+        out[..., i] = prev
+    return out
+
+
+def bollinger(values: ArrayLike, period: int = 20, num_std: float = 2.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Полосы Боллинджера (upper, middle, lower) со стандартным отклонением по генеральной совокупности.'''
+    x = as_series(values)
+    middle = sma(x, period)
+    # Дисперсию считаем по центрированному ряду, иначе при ценах ~1e5 теряется точность
+    shift = x.mean(axis=-1, keepdims=True) if x.shape[-1] else 0.0
+    centered = x - shift
+    mean_c = _rolling_sum(centered, period) / period
+    mean_sq = _rolling_sum(centered * centered, period) / period
+    std = np.sqrt(np.maximum(mean_sq - mean_c * mean_c, 0.0))
+    return middle + num_std * std, middle, middle - num_std * std
+
+
+def macd(values: ArrayLike, fast: int = 12, slow: int = 26, signal: int = 9,
+         seed: str = 'sma') -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''MACD: (линия MACD, сигнальная линия, гистограмма).'''
+    x = as_series(values)
+    macd_line = ema(x, fast, seed) - ema(x, slow, seed)
+
+    if seed == 'first':
+        signal_line = ema(macd_line, signal, seed)
+    else:
+        # Сигнальная EMA стартует с первой определённой точки линии MACD
+        signal_line = np.full(x.shape, np.nan)
+        start = slow - 1
+        if x.shape[-1] > start:
+            signal_line[..., start:] = ema(macd_line[..., start:], signal, seed)
+    return macd_line, signal_line, macd_line - signal_line
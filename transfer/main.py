@@ -1,9 +1,15 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+import asyncio
+import base64
+import importlib
+import inspect
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import json
 
 load_dotenv()
 
@@ -17,18 +23,71 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Импортируем существующие функции
-from functions.bitrix24_prices import handler as bitrix24_prices_handler
-from functions.rss_news import handler as rss_news_handler
-from functions.integration_request import handler as integration_request_handler
-from functions.telegram_notify import handler as telegram_notify_handler
-from functions.bitrix24_webhook import handler as bitrix24_webhook_handler
-
-# Импортируем НОВЫЕ функции для криптобота
-from functions.bybit_market import handler as bybit_market_handler
-from functions.strategy_signals import handler as strategy_signals_handler
-from functions.pair_analyzer import handler as pair_analyzer_handler
-from functions.auto_trader import handler as auto_trader_handler
+from functions.market_stream import MARKET_STREAM_ENABLED, start_streams, stop_streams
+from functions.bot_scheduler import BOT_SCHEDULER_ENABLED, get_scheduler
+from functions.pair_analyzer import PAIR_RANKINGS_ENABLED, get_rankings
+
+@app.on_event("startup")
+async def startup():
+    # WebSocket-поток рыночных данных Bybit (тикеры, свечи, стаканы)
+    if MARKET_STREAM_ENABLED:
+        start_streams()
+    # Встроенный планировщик ботов вместо cron/bot-scheduler.sh
+    if BOT_SCHEDULER_ENABLED:
+        get_scheduler().start()
+    # Фоновый рейтинг пар после закрытия каждой 15-минутной свечи
+    if PAIR_RANKINGS_ENABLED:
+        get_rankings().start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if BOT_SCHEDULER_ENABLED:
+        await get_scheduler().stop()
+    if PAIR_RANKINGS_ENABLED:
+        await get_rankings().stop()
+    await stop_streams()
+    for pool in POOLS.values():
+        pool.executor.shutdown(wait=False)
+
+# Синхронные обработчики выполняются в пуле потоков своего роута, чтобы медленный
+# вызов Bybit или bot-executor не блокировал event loop и остальные запросы.
+# Размер пула по умолчанию и по роутам: GATEWAY_POOL_SIZES="auto-trader=4,pair-analyzer=4,backtest=2,optimizer=1"
+GATEWAY_POOL_SIZE = int(os.environ.get("GATEWAY_POOL_SIZE", "8"))
+GATEWAY_POOL_SIZES = {
+    "auto-trader": 4,
+    "pair-analyzer": 4,
+    "backtest": 2,
+    "optimizer": 1,
+    "walk-forward": 1,
+    "bot-scheduler": 1,
+}
+for item in os.environ.get("GATEWAY_POOL_SIZES", "").split(","):
+    if "=" in item:
+        name, size = item.split("=", 1)
+        GATEWAY_POOL_SIZES[name.strip().strip("/")] = int(size)
+
+# (путь, методы, модуль в functions/)
+ROUTES = [
+    # Существующие роуты
+    ("/bitrix24-prices", ["GET", "OPTIONS"], "bitrix24_prices"),
+    ("/rss-news", ["GET", "OPTIONS"], "rss_news"),
+    ("/integration-request", ["POST", "OPTIONS"], "integration_request"),
+    ("/telegram-notify", ["POST", "OPTIONS"], "telegram_notify"),
+    ("/bitrix24-webhook", ["POST", "OPTIONS"], "bitrix24_webhook"),
+    # НОВЫЕ роуты для криптобота
+    ("/bybit-market", ["GET", "POST", "OPTIONS"], "bybit_market"),
+    ("/strategy-signals", ["GET", "OPTIONS"], "strategy_signals"),
+    ("/pair-analyzer", ["GET", "OPTIONS"], "pair_analyzer"),
+    ("/auto-trader", ["GET", "POST", "OPTIONS"], "auto_trader"),
+    ("/backtest", ["GET", "POST", "OPTIONS"], "backtest"),
+    ("/optimizer", ["GET", "POST", "OPTIONS"], "optimizer"),
+    ("/walk-forward", ["POST", "OPTIONS"], "walk_forward"),
+    ("/bot-scheduler", ["GET", "POST", "OPTIONS"], "bot_scheduler"),
+    # Функции из backend/ с БД: index.py копируется в functions/ под этим именем (см. README)
+    ("/ma-crossover-strategy", ["GET", "POST", "OPTIONS"], "ma_crossover_strategy"),
+    ("/strategy-config", ["GET", "POST", "OPTIONS"], "strategy_config"),
+    ("/api-keys", ["GET", "POST", "DELETE", "OPTIONS"], "api_keys"),
+]
 
 class MockContext:
     def __init__(self, request_id: str):
@@ -37,13 +96,68 @@ class MockContext:
         self.function_version = "1.0"
         self.memory_limit_in_mb = 256
 
+class HandlerPool:
+    """Ограниченный пул потоков одного роута с метриками очереди и ожидания."""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"gw-{name}")
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def _call(self, submitted_at: float, handler, event, context):
+        started_at = time.monotonic()
+        wait = started_at - submitted_at
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        try:
+            return handler(event, context)
+        except Exception:
+            with self.lock:
+                self.errors += 1
+            raise
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                self.total_run += time.monotonic() - started_at
+
+    async def run(self, handler, event, context):
+        with self.lock:
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._call, time.monotonic(), handler, event, context)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "poolSize": self.size,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "errors": self.errors,
+                "avgWaitMs": round(self.total_wait / self.completed * 1000, 2) if self.completed else 0.0,
+                "maxWaitMs": round(self.max_wait * 1000, 2),
+                "avgRunMs": round(self.total_run / self.completed * 1000, 2) if self.completed else 0.0,
+            }
+
+POOLS = {}
+
 async def fastapi_to_cloud_event(request: Request):
     body = None
     if request.method in ["POST", "PUT", "PATCH"]:
-        try:
-            body = json.dumps(await request.json())
-        except:
-            body = (await request.body()).decode()
+        # Тело передаётся обработчику как есть, без разбора и повторной сериализации
+        body = (await request.body()).decode()
 
     return {
         "httpMethod": request.method,
@@ -53,106 +167,52 @@ async def fastapi_to_cloud_event(request: Request):
         "isBase64Encoded": False
     }
 
-# Существующие роуты
-@app.api_route("/bitrix24-prices", methods=["GET", "OPTIONS"])
-async def bitrix24_prices(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = bitrix24_prices_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
-    )
-
-@app.api_route("/rss-news", methods=["GET", "OPTIONS"])
-async def rss_news(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = rss_news_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
-    )
-
-@app.api_route("/integration-request", methods=["POST", "OPTIONS"])
-async def integration_request(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = integration_request_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
-    )
-
-@app.api_route("/telegram-notify", methods=["POST", "OPTIONS"])
-async def telegram_notify(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = telegram_notify_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
+def to_response(result) -> Response:
+    # body обработчика уже сериализован в JSON — отдаём его байтами как есть,
+    # без json.loads + повторного json.dumps в JSONResponse
+    status = result['statusCode']
+    # 304 (ETag совпал) и 204 по протоколу идут без тела
+    body = b'' if status in (204, 304) else result.get('body') or '{}'
+    if result.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode('utf-8')
+    return Response(
+        content=body,
+        status_code=status,
+        headers=result.get('headers', {}),
+        media_type="application/json"
     )
 
-@app.api_route("/bitrix24-webhook", methods=["POST", "OPTIONS"])
-async def bitrix24_webhook(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = bitrix24_webhook_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
-    )
-
-# НОВЫЕ роуты для криптобота
-@app.api_route("/bybit-market", methods=["GET", "POST", "OPTIONS"])
-async def bybit_market(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = bybit_market_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
-    )
-
-@app.api_route("/strategy-signals", methods=["GET", "OPTIONS"])
-async def strategy_signals(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = strategy_signals_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
-    )
-
-@app.api_route("/pair-analyzer", methods=["GET", "OPTIONS"])
-async def pair_analyzer(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = pair_analyzer_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
-    )
-
-@app.api_route("/auto-trader", methods=["GET", "POST", "OPTIONS"])
-async def auto_trader(request: Request):
-    event = await fastapi_to_cloud_event(request)
-    context = MockContext(request_id=str(id(request)))
-    result = auto_trader_handler(event, context)
-    return JSONResponse(
-        content=json.loads(result['body']) if result.get('body') else {},
-        status_code=result['statusCode'],
-        headers=result.get('headers', {})
-    )
+def make_route(name: str, module):
+    # Модуль может предоставить нативный async_handler — он выполняется прямо в event loop
+    async_handler = getattr(module, "async_handler", None)
+    if async_handler is not None and not inspect.iscoroutinefunction(async_handler):
+        async_handler = None
+    handler = module.handler
+    pool = None
+    if async_handler is None:
+        pool = POOLS[name] = HandlerPool(name, GATEWAY_POOL_SIZES.get(name, GATEWAY_POOL_SIZE))
+
+    async def route(request: Request):
+        event = await fastapi_to_cloud_event(request)
+        context = MockContext(request_id=str(id(request)))
+        if async_handler is not None:
+            result = await async_handler(event, context)
+        else:
+            result = await pool.run(handler, event, context)
+        return to_response(result)
+
+    route.__name__ = module.__name__.rsplit(".", 1)[-1]
+    return route
+
+for path, methods, module_name in ROUTES:
+    module = importlib.import_module(f"functions.{module_name}")
+    app.add_api_route(path, make_route(path.strip("/"), module), methods=methods)
+
+@app.get("/gateway-stats")
+async def gateway_stats():
+    return {"pools": {name: pool.stats() for name, pool in POOLS.items()}}
 
 @app.get("/health")
 async def health():
@@ -0,0 +1,385 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from .candle_store import INTERVAL_MS, get_store, normalize_interval
+from .orderbook import OrderBookEngine
+
+try:
+    import websockets
+except ImportError:  # без пакета websockets работаем только через REST
+    websockets = None
+
+logger = logging.getLogger(__name__)
+
+BYBIT_WS_URLS = {
+    'spot': os.environ.get('BYBIT_WS_SPOT_URL', 'wss://stream.bybit.com/v5/public/spot'),
+    'linear': os.environ.get('BYBIT_WS_LINEAR_URL', 'wss://stream.bybit.com/v5/public/linear'),
+}
+
+MARKET_STREAM_ENABLED = os.environ.get('MARKET_STREAM_ENABLED', '0') == '1'
+MARKET_STREAM_CATEGORIES = os.environ.get('MARKET_STREAM_CATEGORIES', 'spot').split(',')
+MARKET_STREAM_SYMBOLS = os.environ.get('MARKET_STREAM_SYMBOLS', 'BTCUSDT,ETHUSDT,SOLUSDT,BNBUSDT,XRPUSDT').split(',')
+MARKET_STREAM_INTERVALS = os.environ.get('MARKET_STREAM_INTERVALS', '15').split(',')
+MARKET_STREAM_ORDERBOOK_DEPTH = int(os.environ.get('MARKET_STREAM_ORDERBOOK_DEPTH', '50'))
+# Если данных по каналу не было дольше N секунд, состояние считается неактуальным
+MARKET_STREAM_STALE_AFTER = float(os.environ.get('MARKET_STREAM_STALE_AFTER', '30'))
+# Путь для записи всех входящих сообщений (для ws_replay_server)
+MARKET_STREAM_RECORD_PATH = os.environ.get('MARKET_STREAM_RECORD_PATH', '')
+# Ошибки одного вида (обрыв, догрузка, запись свечи) пишутся в лог не чаще раза в N секунд,
+# все они считаются в stream_stats()
+MARKET_STREAM_ERROR_LOG_INTERVAL = float(os.environ.get('MARKET_STREAM_ERROR_LOG_INTERVAL', '60'))
+
+KLINE_HISTORY = 1000
+PING_INTERVAL = 20
+MAX_BACKOFF = 30
+
+
+class MarketState:
+    '''
+    Живое состояние рынка одной категории: тикеры, свечи и стаканы по символам.
+    Пишет его поток ingestor-а, читают синхронные обработчики из других потоков.
+    '''
+
+    def __init__(self, category: str):
+        self.category = category
+        self.tickers: Dict[str, Dict[str, Any]] = {}
+        self.klines: Dict[Tuple[str, str], deque] = {}
+        self.books = OrderBookEngine()
+        self.updated_at: Dict[str, float] = {}
+        self.connected = False
+        self.lock = threading.Lock()
+        self.counters = {
+            'messages': 0,
+            'reconnects': 0,
+            'klineGaps': 0,
+            'staleTickers': 0,
+            'connectionErrors': 0,
+            'backfillErrors': 0,
+            'persistErrors': 0,
+        }
+
+    def touch(self, topic: str) -> None:
+        self.updated_at[topic] = time.time()
+
+    def is_fresh(self, topic: str) -> bool:
+        return self.connected and time.time() - self.updated_at.get(topic, 0) < MARKET_STREAM_STALE_AFTER
+
+    # --- тикеры ---
+
+    def apply_ticker(self, message: Dict[str, Any]) -> None:
+        data = message.get('data', {})
+        symbol = data.get('symbol')
+        if not symbol:
+            return
+        with self.lock:
+            current = self.tickers.get(symbol)
+            cross_seq = message.get('cs')
+            if current is not None and cross_seq is not None and current.get('_cs') is not None \
+                    and cross_seq < current['_cs']:
+                self.counters['staleTickers'] += 1
+                return
+            if message.get('type') == 'delta' and current is not None:
+                # В delta приходят только изменившиеся поля
+                current.update(data)
+            else:
+                self.tickers[symbol] = current = dict(data)
+            current['_cs'] = cross_seq
+        self.touch(f'tickers.{symbol}')
+
+    # --- свечи ---
+
+    def seed_klines(self, symbol: str, interval: str, candles: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            series = self.klines.setdefault((symbol, interval), deque(maxlen=KLINE_HISTORY))
+            live = [c for c in series if int(c['time']) > int(candles[-1]['time'])] if candles else list(series)
+            series.clear()
+            series.extend(candles)
+            series.extend(live)
+
+    def apply_kline(self, symbol: str, interval: str, candle: Dict[str, Any]) -> bool:
+        '''Возвращает True, если обнаружен разрыв в последовательности свечей.'''
+        gap = False
+        with self.lock:
+            series = self.klines.setdefault((symbol, interval), deque(maxlen=KLINE_HISTORY))
+            if series:
+                last_time = int(series[-1]['time'])
+                start = int(candle['time'])
+                if start == last_time:
+                    series[-1] = candle
+                elif start > last_time:
+                    gap = start - last_time > INTERVAL_MS[interval]
+                    series.append(candle)
+                # более старые свечи (повтор после переподключения) пропускаем
+            else:
+                series.append(candle)
+            if gap:
+                self.counters['klineGaps'] += 1
+        self.touch(f'kline.{interval}.{symbol}')
+        return gap
+
+    def candles(self, symbol: str, interval: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        if not self.is_fresh(f'kline.{interval}.{symbol}'):
+            return None
+        with self.lock:
+            series = self.klines.get((symbol, interval))
+            if not series or len(series) < limit:
+                return None
+            return [{k: v for k, v in c.items() if k != 'confirm'} for c in list(series)[-limit:]]
+
+    # --- стакан ---
+
+    def apply_orderbook(self, message: Dict[str, Any]) -> bool:
+        '''Применяет snapshot/delta. Возвращает False при разрыве последовательности.'''
+        ok = self.books.apply(message)
+        self.touch(f"orderbook.{message.get('data', {}).get('s')}")
+        return ok
+
+    def orderbook(self, symbol: str, limit: int, cumulative: bool = False) -> Optional[Dict[str, Any]]:
+        if not self.is_fresh(f'orderbook.{symbol}'):
+            return None
+        return self.books.view(symbol, limit, cumulative)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'category': self.category,
+            'connected': self.connected,
+            'symbols': len(self.tickers),
+            'klineSeries': len(self.klines),
+            'orderbooks': self.books.stats(),
+            **self.counters
+        }
+
+
+class MarketStream:
+    '''
+    Подписка на публичные WebSocket-топики Bybit одной категории с переподключением,
+    повторной подпиской и контролем разрывов. Запускается задачей в event loop шлюза.
+    '''
+
+    def __init__(self, category: str, symbols: List[str], intervals: List[str],
+                 url: Optional[str] = None, orderbook_depth: int = MARKET_STREAM_ORDERBOOK_DEPTH,
+                 record_path: str = MARKET_STREAM_RECORD_PATH):
+        self.category = category
+        self.symbols = [s for s in symbols if s]
+        self.intervals = [normalize_interval(i) for i in intervals if i]
+        self.url = url or BYBIT_WS_URLS[category]
+        self.orderbook_depth = orderbook_depth
+        self.record_path = record_path
+        self.state = MarketState(category)
+        self._ws = None
+        self._stopped = False
+        self._error_logged_at: Dict[str, float] = {}
+
+    def _report_error(self, counter: str, message: str) -> None:
+        '''Вызывается из except: считает ошибку и пишет её с трассировкой, если этот вид давно не логировался.'''
+        now = time.monotonic()
+        with self.state.lock:
+            self.state.counters[counter] += 1
+            total = self.state.counters[counter]
+            last = self._error_logged_at.get(counter)
+            if last is not None and now - last < MARKET_STREAM_ERROR_LOG_INTERVAL:
+                return
+            self._error_logged_at[counter] = now
+        logger.warning('Market stream %s: %s (%s=%d)', self.category, message, counter, total, exc_info=True)
+
+    def topics(self) -> List[str]:
+        topics = []
+        for symbol in self.symbols:
+            topics.append(f'tickers.{symbol}')
+            topics.append(f'orderbook.{self.orderbook_depth}.{symbol}')
+            topics.extend(f'kline.{interval}.{symbol}' for interval in self.intervals)
+        return topics
+
+    async def _subscribe(self, ws, topics: List[str]) -> None:
+        # Bybit принимает не больше 10 топиков в одном запросе
+        for i in range(0, len(topics), 10):
+            await ws.send(json.dumps({'op': 'subscribe', 'req_id': f'sub-{i}', 'args': topics[i:i + 10]}))
+
+    async def _resubscribe(self, ws, topic: str) -> None:
+        await ws.send(json.dumps({'op': 'unsubscribe', 'args': [topic]}))
+        await ws.send(json.dumps({'op': 'subscribe', 'args': [topic]}))
+
+    async def _ping(self, ws) -> None:
+        while True:
+            await asyncio.sleep(PING_INTERVAL)
+            await ws.send(json.dumps({'op': 'ping'}))
+
+    async def _backfill(self, symbol: str, interval: str, force: bool = False) -> None:
+        # История для свечных серий подтягивается из candle_store (REST), дальше живёт поток
+        loop = asyncio.get_running_loop()
+
+        def load() -> List[Dict[str, Any]]:
+            store = get_store()
+            if force:
+                store.sync(self.category, symbol, interval, KLINE_HISTORY, force=True)
+            return store.get_candles(symbol, interval, KLINE_HISTORY, self.category)
+
+        try:
+            candles = await loop.run_in_executor(None, load)
+        except Exception:
+            self._report_error('backfillErrors', f'candle backfill {symbol} {interval} failed')
+            return
+        self.state.seed_klines(symbol, interval, candles)
+
+    def _persist_candle(self, symbol: str, interval: str, candle: Dict[str, Any]) -> None:
+        try:
+            get_store().save(self.category, symbol, interval, [[
+                candle['time'], candle['open'], candle['high'], candle['low'], candle['close'], candle['volume']
+            ]])
+        except Exception:
+            self._report_error('persistErrors', f'saving candle {symbol} {interval} {candle["time"]} failed')
+
+    async def handle_message(self, ws, raw: str) -> None:
+        message = json.loads(raw)
+        topic = message.get('topic')
+        if not topic:
+            return  # ответы на subscribe/ping
+
+        self.state.counters['messages'] += 1
+        if topic.startswith('tickers.'):
+            self.state.apply_ticker(message)
+
+        elif topic.startswith('kline.'):
+            _, interval, symbol = topic.split('.', 2)
+            for item in message.get('data', []):
+                candle = {
+                    'time': str(item['start']),
+                    'open': float(item['open']),
+                    'high': float(item['high']),
+                    'low': float(item['low']),
+                    'close': float(item['close']),
+                    'volume': float(item['volume']),
+                    'confirm': item.get('confirm', False)
+                }
+                if self.state.apply_kline(symbol, interval, candle):
+                    asyncio.ensure_future(self._backfill(symbol, interval, force=True))
+                if candle['confirm']:
+                    loop = asyncio.get_running_loop()
+                    loop.run_in_executor(None, self._persist_candle, symbol, interval, candle)
+
+        elif topic.startswith('orderbook.'):
+            if not self.state.apply_orderbook(message):
+                # Пропущен delta — просим новый снимок переподпиской на топик
+                await self._resubscribe(ws, topic)
+
+    async def run(self) -> None:
+        if websockets is None:
+            raise RuntimeError('websockets package is required for the market stream')
+
+        for symbol in self.symbols:
+            for interval in self.intervals:
+                await self._backfill(symbol, interval)
+
+        backoff = 1.0
+        record = open(self.record_path, 'a') if self.record_path else None
+        try:
+            while not self._stopped:
+                try:
+                    async with websockets.connect(self.url, ping_interval=None, max_size=2 ** 22) as ws:
+                        self._ws = ws
+                        await self._subscribe(ws, self.topics())
+                        self.state.connected = True
+                        backoff = 1.0
+                        pinger = asyncio.ensure_future(self._ping(ws))
+                        try:
+                            async for raw in ws:
+                                if record:
+                                    record.write(json.dumps({'t': time.time(), 'message': json.loads(raw)}) + '\n')
+                                await self.handle_message(ws, raw)
+                        finally:
+                            pinger.cancel()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    if not self._stopped:
+                        self._report_error('connectionErrors', f'connection to {self.url} lost')
+                finally:
+                    self.state.connected = False
+                    self._ws = None
+
+                if self._stopped:
+                    break
+                self.state.counters['reconnects'] += 1
+                await asyncio.sleep(backoff + random.uniform(0, backoff / 2))
+                backoff = min(backoff * 2, MAX_BACKOFF)
+        finally:
+            if record:
+                record.close()
+
+    async def stop(self) -> None:
+        self._stopped = True
+        if self._ws is not None:
+            await self._ws.close()
+
+
+_streams: Dict[str, MarketStream] = {}
+_tasks: List[asyncio.Task] = []
+
+
+def start_streams(categories: Optional[List[str]] = None) -> List[MarketStream]:
+    '''Запускает ingestor-ы в текущем event loop (вызывается из startup шлюза).'''
+    for category in categories or MARKET_STREAM_CATEGORIES:
+        if category in _streams:
+            continue
+        stream = MarketStream(category, MARKET_STREAM_SYMBOLS, MARKET_STREAM_INTERVALS)
+        _streams[category] = stream
+        _tasks.append(asyncio.ensure_future(stream.run()))
+    return list(_streams.values())
+
+
+async def stop_streams() -> None:
+    for stream in _streams.values():
+        await stream.stop()
+    for task in _tasks:
+        task.cancel()
+    _streams.clear()
+    _tasks.clear()
+
+
+def get_state(category: str) -> Optional[MarketState]:
+    stream = _streams.get(category)
+    return stream.state if stream else None
+
+
+def live_tickers(category: str, symbols: List[str]) -> Optional[List[Dict[str, Any]]]:
+    '''Тикеры из потока, если по всем запрошенным символам есть свежие данные.'''
+    state = get_state(category)
+    if state is None or not all(state.is_fresh(f'tickers.{s}') for s in symbols):
+        return None
+    with state.lock:
+        return [dict(state.tickers[s]) for s in symbols]
+
+
+def live_candles(symbol: str, interval: str, limit: int, category: str) -> Optional[List[Dict[str, Any]]]:
+    state = get_state(category)
+    return state.candles(symbol, normalize_interval(interval), limit) if state else None
+
+
+def live_orderbook(symbol: str, limit: int, category: str, cumulative: bool = False) -> Optional[Dict[str, Any]]:
+    stream = _streams.get(category)
+    # Глубже, чем подписка, поток отдать не может — такие запросы идут в REST
+    if stream is None or limit > stream.orderbook_depth:
+        return None
+    return stream.state.orderbook(symbol, limit, cumulative)
+
+
+def stream_stats() -> Dict[str, Any]:
+    return {category: stream.state.stats() for category, stream in _streams.items()}
+
+
+if __name__ == '__main__':
+    # Автономный запуск: python -m functions.market_stream
+    async def main() -> None:
+        start_streams()
+        while True:
+            await asyncio.sleep(10)
+            print(json.dumps(stream_stats()))
+
+    asyncio.run(main())
@@ -0,0 +1,622 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import fast_json
+from .backtest import DEFAULT_CONFIG, DEFAULT_PARAMS, STRATEGIES, evaluate, metrics, normalize_config, valid_params
+from .candle_store import get_candles
+from .rate_limiter import BACKGROUND, upstream_priority
+
+# Перебор параметров стратегий из backtest.py по сохранённой истории свечей.
+# Свечи всех символов кладутся один раз в shared memory, процессы-воркеры
+# подключаются к блоку по имени и читают цены без копирования и pickle на каждую задачу.
+# Задача — (символ, пачка сочетаний параметров); индикаторы внутри воркера
+# кэшируются по символу, так что EMA 9 считается один раз на все сочетания с fast=9.
+#   python -m functions.optimizer --symbols BTCUSDT,ETHUSDT --interval 60 --limit 5000 \
+#       --strategy ema-rsi --param fast=5:15:1 --param slow=18:40:2 --param rsiThreshold=40,45,50,55
+
+# Число процессов перебора; workers из запроса может его только уменьшить
+OPTIMIZER_WORKERS = int(os.environ.get('OPTIMIZER_WORKERS', str(os.cpu_count() or 1)))
+# Сколько переборов (optimizer и walk-forward) выполняется одновременно; остальные ждут
+# свободного места до OPTIMIZER_QUEUE_TIMEOUT секунд и получают 503
+OPTIMIZER_MAX_SWEEPS = int(os.environ.get('OPTIMIZER_MAX_SWEEPS', '1'))
+OPTIMIZER_QUEUE_TIMEOUT = float(os.environ.get('OPTIMIZER_QUEUE_TIMEOUT', '60'))
+# Потолок числа сочетаний на один перебор (для search=grid — ошибка, если сетка больше)
+OPTIMIZER_MAX_COMBINATIONS = int(os.environ.get('OPTIMIZER_MAX_COMBINATIONS', '20000'))
+# Сколько сочетаний отдаётся воркеру одной задачей
+OPTIMIZER_TASK_SIZE = int(os.environ.get('OPTIMIZER_TASK_SIZE', '32'))
+# Сколько индикаторов на символ держит кэш воркера
+OPTIMIZER_CACHE_ENTRIES = int(os.environ.get('OPTIMIZER_CACHE_ENTRIES', '256'))
+# spawn не наследует потоки и блокировки шлюза, в отличие от fork
+OPTIMIZER_START_METHOD = os.environ.get('OPTIMIZER_START_METHOD', 'spawn')
+
+# Метрика для ранжирования → направление (1 — больше лучше, -1 — меньше лучше)
+OBJECTIVES = {
+    'sharpeRatio': 1,
+    'totalPnLPercent': 1,
+    'profitFactor': 1,
+    'winRate': 1,
+    'maxDrawdownPercent': -1,
+}
+
+SEARCHES = ('grid', 'random', 'adaptive')
+
+MAX_SYMBOLS = 100
+LOAD_CONCURRENCY = 8
+
+Series = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+class SharedHistory:
+    '''
+    Свечи нескольких символов в одном блоке shared memory.
+    Раскладка: для каждого символа подряд time (int64), high, low, close (float64).
+    '''
+
+    def __init__(self, series: Dict[str, Series]):
+        total = sum(s[0].shape[0] for s in series.values())
+        self.shm = shared_memory.SharedMemory(create=True, size=max(total * 4 * 8, 8))
+        self.layout: List[Tuple[str, int, int]] = []
+        offset = 0
+        for symbol, arrays in series.items():
+            length = arrays[0].shape[0]
+            for view, values in zip(_views(self.shm.buf, offset, length), arrays):
+                view[:] = values
+            self.layout.append((symbol, offset, length))
+            offset += length * 4
+
+    def spec(self) -> Tuple[str, List[Tuple[str, int, int]]]:
+        return self.shm.name, self.layout
+
+    def close(self) -> None:
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _views(buf, offset: int, length: int) -> Series:
+    times = np.ndarray((length,), dtype=np.int64, buffer=buf, offset=offset * 8)
+    high, low, close = (
+        np.ndarray((length,), dtype=np.float64, buffer=buf, offset=(offset + length * k) * 8)
+        for k in (1, 2, 3)
+    )
+    return times, high, low, close
+
+
+def attach(spec: Tuple[str, List[Tuple[str, int, int]]]) -> Tuple[shared_memory.SharedMemory, Dict[str, Series]]:
+    '''Подключение к блоку из другого процесса; массивы — представления без копирования.'''
+    name, layout = spec
+    # Воркеры пула используют трекер ресурсов родителя, поэтому блок удаляется один раз —
+    # в SharedHistory.close(), и только после остановки пула
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, {symbol: _views(shm.buf, offset, length) for symbol, offset, length in layout}
+
+
+_worker_shm: Optional[shared_memory.SharedMemory] = None
+_worker_series: Dict[str, Series] = {}
+_worker_caches: Dict[str, Dict[tuple, Any]] = {}
+
+
+def _init_worker(spec) -> None:
+    global _worker_shm, _worker_series
+    _worker_shm, _worker_series = attach(spec)
+    _worker_caches.clear()
+
+
+def evaluate_batch(series: Series, cache: Dict[tuple, Any], config: Dict[str, Any],
+                   combos: List[Dict[str, float]]) -> List[Dict[str, Any]]:
+    '''Метрики одного символа для пачки сочетаний параметров.'''
+    times, high, low, close = series
+    results = []
+    for params in combos:
+        if len(cache) > OPTIMIZER_CACHE_ENTRIES:
+            cache.clear()
+        run_config = dict(config, params=params)
+        trades, equity_curve, final_equity = evaluate(times, high, low, close, run_config, cache)
+        results.append({
+            **metrics(trades, equity_curve, config['initialCapital'], final_equity),
+            'trades': len(trades)
+        })
+    return results
+
+
+def _run_task(task: Tuple[Callable, str, tuple]) -> Any:
+    '''Выполняется в воркере: fn(массивы символа, кэш индикаторов символа, *args).'''
+    fn, symbol, args = task
+    return fn(_worker_series[symbol], _worker_caches.setdefault(symbol, {}), *args)
+
+
+def _values(spec: Any) -> List[float]:
+    '''Значения параметра для сетки: список или {"min", "max", "step"} (границы включительно).'''
+    if isinstance(spec, dict):
+        low, high = spec['min'], spec['max']
+        step = spec.get('step', 1)
+        count = max(int(round((high - low) / step)) + 1, 0)
+        if all(isinstance(v, int) for v in (low, high, step)):
+            return [low + i * step for i in range(count)]
+        return [round(low + i * step, 10) for i in range(count)]
+    if isinstance(spec, (list, tuple)):
+        return list(spec)
+    return [spec]
+
+
+def _sample(spec: Any, rng: random.Random) -> float:
+    if isinstance(spec, dict):
+        low, high = spec['min'], spec['max']
+        if spec.get('step'):
+            return rng.choice(_values(spec))
+        if isinstance(low, int) and isinstance(high, int):
+            return rng.randint(low, high)
+        return rng.uniform(low, high)
+    if isinstance(spec, (list, tuple)):
+        return rng.choice(spec)
+    return spec
+
+
+def _key(params: Dict[str, float]) -> tuple:
+    return tuple(sorted(params.items()))
+
+
+def grid_combinations(strategy: str, space: Dict[str, Any]) -> List[Dict[str, float]]:
+    names = list(space)
+    grid = [_values(space[name]) for name in names]
+    total = 1
+    for values in grid:
+        total *= len(values)
+    if total > OPTIMIZER_MAX_COMBINATIONS:
+        raise ValueError(f'Grid has {total} combinations (limit {OPTIMIZER_MAX_COMBINATIONS}), use search=random')
+    combos = []
+    for values in itertools.product(*grid):
+        params = {**DEFAULT_PARAMS[strategy], **dict(zip(names, values))}
+        if valid_params(strategy, params):
+            combos.append(params)
+    return combos
+
+
+def random_combinations(strategy: str, space: Dict[str, Any], samples: int, rng: random.Random,
+                        seen: Optional[set] = None) -> List[Dict[str, float]]:
+    seen = set() if seen is None else seen
+    combos = []
+    attempts = 0
+    while len(combos) < samples and attempts < samples * 20:
+        attempts += 1
+        params = {**DEFAULT_PARAMS[strategy], **{name: _sample(spec, rng) for name, spec in space.items()}}
+        if valid_params(strategy, params) and _key(params) not in seen:
+            seen.add(_key(params))
+            combos.append(params)
+    return combos
+
+
+def _neighbourhood(space: Dict[str, Any], center: Dict[str, float], scale: float) -> Dict[str, Any]:
+    '''Сужает диапазоны вокруг найденного сочетания (списки значений не меняются).'''
+    narrowed = {}
+    for name, spec in space.items():
+        if isinstance(spec, dict):
+            width = (spec['max'] - spec['min']) * scale / 2
+            low, high = max(spec['min'], center[name] - width), min(spec['max'], center[name] + width)
+            if isinstance(spec['min'], int) and isinstance(spec['max'], int):
+                low, high = int(round(low)), int(round(high))
+            narrowed[name] = {**spec, 'min': low, 'max': high}
+        else:
+            narrowed[name] = spec
+    return narrowed
+
+
+_sweep_slots = threading.BoundedSemaphore(OPTIMIZER_MAX_SWEEPS)
+
+
+class OptimizerBusy(Exception):
+    pass
+
+
+def server_workers(workers: int) -> int:
+    '''Сколько процессов получит перебор: не больше OPTIMIZER_WORKERS и числа ядер.'''
+    return max(1, min(workers, OPTIMIZER_WORKERS, os.cpu_count() or 1))
+
+
+class Optimizer:
+    '''
+    Один перебор: история в shared memory, пул процессов, агрегирование метрик по символам.
+    Одновременно выполняется не больше OPTIMIZER_MAX_SWEEPS переборов на процесс шлюза.
+    '''
+
+    def __init__(self, series: Dict[str, Series], config: Dict[str, Any], objective: str = 'sharpeRatio',
+                 min_trades: int = 1, workers: int = OPTIMIZER_WORKERS):
+        if objective not in OBJECTIVES:
+            raise ValueError(f"objective must be one of: {', '.join(OBJECTIVES)}")
+        self.series = series
+        self.config = config
+        self.objective = objective
+        self.min_trades = min_trades
+        self.workers = server_workers(workers)
+        self.evaluated = 0
+        self._history: Optional[SharedHistory] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._local_caches: Dict[str, Dict[tuple, Any]] = {}
+
+    def __enter__(self) -> 'Optimizer':
+        if not _sweep_slots.acquire(timeout=OPTIMIZER_QUEUE_TIMEOUT):
+            raise OptimizerBusy(f'{OPTIMIZER_MAX_SWEEPS} optimization(s) already running, try again later')
+        try:
+            if self.workers > 1:
+                self._history = SharedHistory(self.series)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(OPTIMIZER_START_METHOD),
+                    initializer=_init_worker,
+                    initargs=(self._history.spec(),)
+                )
+        except BaseException:
+            self.__exit__()
+            raise
+        return self
+
+    def __exit__(self, *exc) -> None:
+        try:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            if self._history is not None:
+                self._history.close()
+        finally:
+            _sweep_slots.release()
+
+    def map(self, fn: Callable, tasks: List[Tuple[str, tuple]]) -> Iterator[Any]:
+        '''
+        fn(массивы символа, кэш индикаторов, *args) для каждой задачи (символ, args) — в пуле
+        процессов или, при одном воркере, в текущем процессе. Результаты — в порядке задач.
+        fn должна быть функцией уровня модуля, чтобы её можно было передать воркеру.
+        '''
+        if self._executor is not None:
+            # chunksize > 1 — меньше обменов с воркерами на коротких историях
+            return self._executor.map(_run_task, [(fn, symbol, args) for symbol, args in tasks],
+                                      chunksize=max(1, len(tasks) // (self.workers * 8)))
+        return (
+            fn(self.series[symbol], self._local_caches.setdefault(symbol, {}), *args)
+            for symbol, args in tasks
+        )
+
+    def run(self, combos: List[Dict[str, float]]) -> List[Dict[str, Any]]:
+        '''Оценивает сочетания на всех символах; результат — по сочетанию, в порядке combos.'''
+        per_symbol: List[Dict[str, Dict[str, Any]]] = [{} for _ in combos]
+        batches = [
+            (start, symbol, combos[start:start + OPTIMIZER_TASK_SIZE])
+            for start in range(0, len(combos), OPTIMIZER_TASK_SIZE)
+            for symbol in self.series
+        ]
+        done = self.map(evaluate_batch, [(symbol, (self.config, batch)) for _, symbol, batch in batches])
+        for (start, symbol, _), results in zip(batches, done):
+            for offset, result in enumerate(results):
+                per_symbol[start + offset][symbol] = result
+        self.evaluated += len(combos) * len(self.series)
+        return [self._aggregate(params, results) for params, results in zip(combos, per_symbol)]
+
+    def _aggregate(self, params: Dict[str, float], results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        def mean(name: str) -> float:
+            return float(np.mean([r[name] for r in results.values()]))
+
+        trades = sum(r['trades'] for r in results.values())
+        score = mean(self.objective)
+        return {
+            'params': params,
+            'score': score,
+            'eligible': trades / len(results) >= self.min_trades,
+            'metrics': {
+                'sharpeRatio': mean('sharpeRatio'),
+                'totalPnLPercent': mean('totalPnLPercent'),
+                'winRate': mean('winRate'),
+                'profitFactor': mean('profitFactor'),
+                'maxDrawdownPercent': mean('maxDrawdownPercent'),
+                'trades': trades
+            },
+            'perSymbol': {
+                symbol: {
+                    self.objective: r[self.objective],
+                    'totalPnLPercent': r['totalPnLPercent'],
+                    'trades': r['trades']
+                }
+                for symbol, r in results.items()
+            }
+        }
+
+    def rank(self, results: List[Dict[str, Any]], top: int) -> List[Dict[str, Any]]:
+        direction = OBJECTIVES[self.objective]
+        eligible = [r for r in results if r['eligible']]
+        eligible.sort(key=lambda r: r['score'] * direction, reverse=True)
+        return [{key: value for key, value in r.items() if key != 'eligible'} for r in eligible[:top]]
+
+
+def load_history(symbols: Sequence[str], interval: str, limit: int,
+                 category: str = 'linear') -> Tuple[Dict[str, Series], List[str]]:
+    '''Свечи из локального хранилища (с догрузкой новых из Bybit) → массивы по символам.'''
+    def load(symbol: str) -> Optional[Series]:
+        # Догрузка истории для перебора уступает Bybit-бюджет ботам и интерфейсу
+        with upstream_priority(BACKGROUND):
+            klines = get_candles(symbol, interval, limit, category)
+        if not klines:
+            return None
+        return (
+            np.fromiter((int(k['time']) for k in klines), dtype=np.int64, count=len(klines)),
+            np.fromiter((k['high'] for k in klines), dtype=np.float64, count=len(klines)),
+            np.fromiter((k['low'] for k in klines), dtype=np.float64, count=len(klines)),
+            np.fromiter((k['close'] for k in klines), dtype=np.float64, count=len(klines)),
+        )
+
+    series: Dict[str, Series] = {}
+    skipped: List[str] = []
+    with ThreadPoolExecutor(max_workers=LOAD_CONCURRENCY, thread_name_prefix='optimizer-load') as executor:
+        futures = {symbol: executor.submit(load, symbol) for symbol in symbols}
+        for symbol, future in futures.items():
+            try:
+                arrays = future.result()
+            except Exception:
+                arrays = None
+            if arrays is None:
+                skipped.append(symbol)
+            else:
+                series[symbol] = arrays
+    return series, skipped
+
+
+def optimize(series: Dict[str, Series], strategy: str, space: Dict[str, Any], search: str = 'grid',
+             samples: int = 500, config: Optional[Dict[str, Any]] = None, objective: str = 'sharpeRatio',
+             top: int = 20, min_trades: int = 1, workers: int = OPTIMIZER_WORKERS,
+             seed: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Перебор параметров strategy по space ({"fast": [5, 9, 12], "slow": {"min": 20, "max": 60, "step": 5}}).
+    search='grid' — полная сетка, 'random' — samples случайных сочетаний,
+    'adaptive' — половина бюджета случайно, остальное — раундами вокруг лучших найденных.
+    '''
+    if search not in SEARCHES:
+        raise ValueError(f"search must be one of: {', '.join(SEARCHES)}")
+    if not series:
+        raise ValueError('No candle history to optimize on')
+    base = normalize_config({**(config or {}), 'strategy': strategy})
+    unknown = set(space) - set(base['params'])
+    if unknown:
+        raise ValueError(f"Unknown parameters for {strategy}: {', '.join(sorted(unknown))}")
+    samples = min(samples, OPTIMIZER_MAX_COMBINATIONS)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    with Optimizer(series, base, objective, min_trades, workers) as optimizer:
+        if search == 'grid':
+            combos = grid_combinations(strategy, space)
+            results = optimizer.run(combos)
+        elif search == 'random':
+            combos = random_combinations(strategy, space, samples, rng)
+            results = optimizer.run(combos)
+        else:
+            seen: set = set()
+            combos = random_combinations(strategy, space, max(1, samples // 2), rng, seen)
+            results = optimizer.run(combos)
+            rounds, budget = 4, samples - len(combos)
+            for round_index in range(rounds):
+                best = optimizer.rank(results, 5)
+                per_round = budget // (rounds - round_index) if round_index < rounds - 1 else budget
+                if not best or per_round <= 0:
+                    break
+                scale = 0.5 / (round_index + 1)
+                extra = []
+                for candidate in best:
+                    local = _neighbourhood(space, candidate['params'], scale)
+                    extra += random_combinations(strategy, local, max(1, per_round // len(best)), rng, seen)
+                if not extra:
+                    break
+                budget -= len(extra)
+                combos += extra
+                results += optimizer.run(extra)
+        ranked = optimizer.rank(results, top)
+        evaluated = optimizer.evaluated
+
+    return {
+        'strategy': strategy,
+        'search': search,
+        'objective': objective,
+        'combinations': len(combos),
+        'evaluations': evaluated,
+        'symbols': list(series),
+        'candles': {symbol: int(arrays[0].shape[0]) for symbol, arrays in series.items()},
+        'config': {key: base[key] for key in DEFAULT_CONFIG if key != 'strategy'},
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 1),
+        'results': ranked
+    }
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Подбор параметров стратегий перебором по истории свечей
+    Args: event - POST с body {"symbols": [...], "interval": "60", "limit": 5000, "category": "linear",
+                  "strategy": "ema-rsi", "params": {"fast": {"min": 5, "max": 15}, "slow": [21, 34, 55]},
+                  "search": "grid|random|adaptive", "samples": 500, "objective": "sharpeRatio",
+                  "top": 20, "minTrades": 5, "config": {"leverage": 2, "stopLoss": 3}}
+          context - объект с request_id
+    Returns: Сочетания параметров, отсортированные по objective, с метриками по символам
+    '''
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method == 'GET':
+        # Справка: стратегии и их параметры по умолчанию
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({
+                'success': True,
+                'strategies': DEFAULT_PARAMS,
+                'searches': SEARCHES,
+                'objectives': list(OBJECTIVES),
+                'maxCombinations': OPTIMIZER_MAX_COMBINATIONS,
+                'workers': OPTIMIZER_WORKERS,
+                'maxSweeps': OPTIMIZER_MAX_SWEEPS
+            }),
+            'isBase64Encoded': False
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        request = fast_json.loads(event.get('body') or '{}')
+        symbols = request.get('symbols') or ['BTCUSDT']
+        if isinstance(symbols, str):
+            symbols = [s.strip() for s in symbols.split(',') if s.strip()]
+        strategy = request.get('strategy', 'ma-crossover')
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of: {', '.join(STRATEGIES)}")
+
+        series, skipped = load_history(symbols[:MAX_SYMBOLS], str(request.get('interval', '60')),
+                                       int(request.get('limit', 5000)), request.get('category', 'linear'))
+        result = optimize(
+            series,
+            strategy,
+            request.get('params') or {},
+            search=request.get('search', 'grid'),
+            samples=int(request.get('samples', 500)),
+            config=request.get('config'),
+            objective=request.get('objective', 'sharpeRatio'),
+            top=int(request.get('top', 20)),
+            min_trades=int(request.get('minTrades', 1)),
+            workers=int(request.get('workers', OPTIMIZER_WORKERS)),
+            seed=request.get('seed')
+        )
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': True, 'skippedSymbols': skipped, **result}),
+            'isBase64Encoded': False
+        }
+
+    except OptimizerBusy as e:
+        return {
+            'statusCode': 503,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Retry-After': '30'
+            },
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    except (ValueError, KeyError, TypeError) as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def parse_param(text: str) -> Tuple[str, Any]:
+    '''fast=5,9,12 — список; slow=20:60:5 — диапазон min:max[:step].'''
+    name, _, spec = text.partition('=')
+
+    def number(value: str) -> float:
+        return float(value) if '.' in value else int(value)
+
+    if ':' in spec:
+        parts = [number(p) for p in spec.split(':')]
+        return name, {'min': parts[0], 'max': parts[1], **({'step': parts[2]} if len(parts) > 2 else {})}
+    return name, [number(p) for p in spec.split(',')]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Strategy parameter sweep over stored candle history')
+    parser.add_argument('--symbols', default='BTCUSDT')
+    parser.add_argument('--interval', default='60')
+    parser.add_argument('--limit', type=int, default=5000)
+    parser.add_argument('--category', default='linear')
+    parser.add_argument('--strategy', default='ma-crossover', choices=STRATEGIES)
+    parser.add_argument('--param', action='append', default=[], help='name=5,9,12 or name=min:max[:step]')
+    parser.add_argument('--search', default='grid', choices=SEARCHES)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--objective', default='sharpeRatio', choices=list(OBJECTIVES))
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--min-trades', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=OPTIMIZER_WORKERS)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--leverage', type=float)
+    parser.add_argument('--stop-loss', type=float)
+    parser.add_argument('--take-profit', type=float)
+    parser.add_argument('--commission', type=float)
+    parser.add_argument('--position-size', type=float)
+    parser.add_argument('--json', action='store_true', help='print the full result as JSON')
+    args = parser.parse_args()
+
+    config = {
+        'leverage': args.leverage,
+        'stopLoss': args.stop_loss,
+        'takeProfit': args.take_profit,
+        'commission': args.commission,
+        'positionSize': args.position_size,
+    }
+    symbols = [s.strip() for s in args.symbols.split(',') if s.strip()]
+    series, skipped = load_history(symbols, args.interval, args.limit, args.category)
+    if skipped:
+        print(f"skipped (no candles): {', '.join(skipped)}")
+    result = optimize(series, args.strategy, dict(parse_param(p) for p in args.param), args.search,
+                      args.samples, config, args.objective, args.top, args.min_trades, args.workers, args.seed)
+
+    if args.json:
+        print(fast_json.dumps(result))
+        return
+    print(f"{result['combinations']} combinations × {len(result['symbols'])} symbols = "
+          f"{result['evaluations']} backtests in {result['elapsedMs'] / 1000:.1f} s")
+    for place, item in enumerate(result['results'], 1):
+        params = ' '.join(f'{k}={v}' for k, v in item['params'].items())
+        m = item['metrics']
+        print(f"{place:3}. {args.objective}={item['score']:8.3f}  pnl={m['totalPnLPercent']:8.2f}%  "
+              f"win={m['winRate']:5.1f}%  dd={m['maxDrawdownPercent']:6.2f}%  trades={m['trades']:5}  {params}")
+
+
+if __name__ == '__main__':
+    main()
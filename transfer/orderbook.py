@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, islice
+from typing import Dict, Any, List, Optional, Tuple
+
+from .bybit_client import get_json
+from .resilience import stale_since
+
+# Сколько секунд REST-снимок стакана переиспользуется между опросами, если нет WebSocket-потока
+ORDERBOOK_SNAPSHOT_TTL = float(os.environ.get('ORDERBOOK_SNAPSHOT_TTL', '1'))
+
+Level = Tuple[float, float]
+
+
+class BookSide:
+    '''
+    Одна сторона стакана: два параллельных массива double (ключ цены и объём),
+    отсортированных от лучшей цены к худшей. Для bid ключ — цена со знаком минус,
+    поэтому лучший уровень у обеих сторон всегда с индексом 0.
+    '''
+
+    __slots__ = ('sign', 'keys', 'sizes')
+
+    def __init__(self, descending: bool):
+        self.sign = -1.0 if descending else 1.0
+        self.keys = array('d')
+        self.sizes = array('d')
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def clear(self) -> None:
+        del self.keys[:]
+        del self.sizes[:]
+
+    def set(self, price: float, size: float) -> None:
+        key = price * self.sign
+        i = bisect_left(self.keys, key)
+        found = i < len(self.keys) and self.keys[i] == key
+        if size == 0:
+            if found:
+                del self.keys[i]
+                del self.sizes[i]
+        elif found:
+            self.sizes[i] = size
+        else:
+            self.keys.insert(i, key)
+            self.sizes.insert(i, size)
+
+    def load(self, levels: List[List[str]]) -> None:
+        self.clear()
+        for price, size in levels:
+            self.set(float(price), float(size))
+
+    def best(self) -> Optional[float]:
+        return self.keys[0] * self.sign if self.keys else None
+
+    def top(self, n: int) -> List[Level]:
+        sign = self.sign
+        return [(key * sign, size) for key, size in zip(islice(self.keys, n), self.sizes)]
+
+    def cumulative(self, n: int) -> List[float]:
+        return list(accumulate(islice(self.sizes, n)))
+
+
+class OrderBook:
+    '''L2-стакан одного символа: snapshot + delta с проверкой номера обновления u.'''
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.update_id: Optional[int] = None
+        self.seq: Optional[int] = None
+        self.ts: Optional[int] = None
+        self.valid = False
+
+    def apply_snapshot(self, data: Dict[str, Any], ts: Optional[int] = None) -> None:
+        self.bids.load(data.get('b', []))
+        self.asks.load(data.get('a', []))
+        self.update_id = data.get('u')
+        self.seq = data.get('seq')
+        self.ts = ts
+        self.valid = True
+
+    def apply_delta(self, data: Dict[str, Any], ts: Optional[int] = None) -> bool:
+        '''Возвращает False, если пропущено обновление: стакан помечается невалидным до нового снимка.'''
+        update_id = data.get('u')
+        if self.update_id is None or update_id != self.update_id + 1:
+            self.valid = False
+            return False
+        for price, size in data.get('b', []):
+            self.bids.set(float(price), float(size))
+        for price, size in data.get('a', []):
+            self.asks.set(float(price), float(size))
+        self.update_id = update_id
+        self.seq = data.get('seq')
+        self.ts = ts
+        return True
+
+    def spread(self) -> Optional[float]:
+        bid, ask = self.bids.best(), self.asks.best()
+        return ask - bid if bid is not None and ask is not None else None
+
+    def mid(self) -> Optional[float]:
+        bid, ask = self.bids.best(), self.asks.best()
+        return (ask + bid) / 2 if bid is not None and ask is not None else None
+
+    def view(self, limit: int, cumulative: bool = False) -> Dict[str, Any]:
+        result = {
+            'b': self.bids.top(limit),
+            'a': self.asks.top(limit),
+            'spread': self.spread(),
+            'mid': self.mid(),
+            'u': self.update_id,
+            'ts': self.ts
+        }
+        if cumulative:
+            result['bDepth'] = self.bids.cumulative(limit)
+            result['aDepth'] = self.asks.cumulative(limit)
+        return result
+
+
+class OrderBookEngine:
+    '''Стаканы по символам одной категории; пишет один поток, читают обработчики из других.'''
+
+    def __init__(self):
+        self.books: Dict[str, OrderBook] = {}
+        self.lock = threading.Lock()
+        self.counters = {'snapshots': 0, 'deltas': 0, 'gaps': 0, 'ignoredDeltas': 0}
+
+    def apply(self, message: Dict[str, Any]) -> bool:
+        '''Применяет сообщение Bybit orderbook.*; False означает разрыв и нужен новый снимок.'''
+        data = message.get('data', {})
+        symbol = data.get('s')
+        ts = message.get('ts')
+        with self.lock:
+            book = self.books.get(symbol)
+            # u == 1 означает, что Bybit сам перезапустил стакан и прислал снимок
+            if message.get('type') == 'snapshot' or data.get('u') == 1:
+                if book is None:
+                    book = self.books[symbol] = OrderBook(symbol)
+                book.apply_snapshot(data, ts)
+                self.counters['snapshots'] += 1
+                return True
+            if book is None or not book.valid:
+                # Ждём свежий снимок после переподписки, delta до него бесполезны
+                self.counters['ignoredDeltas'] += 1
+                return True
+            if not book.apply_delta(data, ts):
+                self.counters['gaps'] += 1
+                return False
+            self.counters['deltas'] += 1
+            return True
+
+    def load_snapshot(self, symbol: str, data: Dict[str, Any], ts: Optional[int] = None) -> None:
+        with self.lock:
+            book = self.books.get(symbol)
+            if book is None:
+                book = self.books[symbol] = OrderBook(symbol)
+            book.apply_snapshot(data, ts)
+            self.counters['snapshots'] += 1
+
+    def view(self, symbol: str, limit: int, cumulative: bool = False) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            book = self.books.get(symbol)
+            if book is None or not book.valid:
+                return None
+            return book.view(limit, cumulative)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'books': len(self.books), **self.counters}
+
+
+_rest_engines: Dict[str, OrderBookEngine] = {}
+_rest_fetched_at: Dict[Tuple[str, str], Tuple[float, int]] = {}
+_rest_lock = threading.Lock()
+
+
+def _rest_engine(category: str) -> OrderBookEngine:
+    with _rest_lock:
+        if category not in _rest_engines:
+            _rest_engines[category] = OrderBookEngine()
+        return _rest_engines[category]
+
+
+def rest_orderbook(symbol: str, limit: int, category: str = 'spot',
+                   cumulative: bool = False) -> Dict[str, Any]:
+    '''
+    Стакан по REST для случаев, когда WebSocket-поток не запущен или отстал.
+    Снимок кладётся в тот же движок и переиспользуется ORDERBOOK_SNAPSHOT_TTL секунд,
+    пока запрошенная глубина не больше загруженной.
+    '''
+    engine = _rest_engine(category)
+    key = (category, symbol)
+    fetched_at, fetched_limit = _rest_fetched_at.get(key, (0.0, 0))
+    if time.time() - fetched_at >= ORDERBOOK_SNAPSHOT_TTL or limit > fetched_limit:
+        data = get_json('/v5/market/orderbook', {
+            'category': category,
+            'symbol': symbol,
+            'limit': limit
+        })
+        if data.get('retCode') != 0:
+            raise RuntimeError(f"Bybit orderbook error: {data.get('retMsg', 'unknown')}")
+        result = data.get('result', {})
+        engine.load_snapshot(symbol, result, result.get('ts'))
+        # Ответ из резерва resilience не переиспользуется как свежий снимок
+        _rest_fetched_at[key] = (stale_since(data) or time.time(), limit)
+    return engine.view(symbol, limit, cumulative)
+
+
+def rest_stats() -> Dict[str, Any]:
+    return {category: engine.stats() for category, engine in _rest_engines.items()}
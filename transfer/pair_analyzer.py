@@ -1,17 +1,57 @@
-import json
+import asyncio
+import contextvars
+import logging
+import os
+import threading
 import time
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
-from typing import Dict, Any, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Optional, Tuple
 
-BYBIT_BASE_URL = "https://api.bybit.com"
+import numpy as np
+
+from . import fast_json
+from .ticker_cache import get_tickers
+from .candle_store import INTERVAL_MS, get_candles
+from .market_stream import live_candles
+from .indicators import atr, sma
+from .rate_limiter import BACKGROUND, upstream_priority
+from .single_flight import get_flight
+
+logger = logging.getLogger(__name__)
+
+# Сколько свечных запросов выполняется параллельно и сколько секунд даётся на весь скан
+# (скан идёт в фоне, поэтому запас большой: первый после простоя догружает свечи всех пар)
+SCAN_CONCURRENCY = int(os.environ.get('PAIR_ANALYZER_CONCURRENCY', '16'))
+SCAN_DEADLINE = float(os.environ.get('PAIR_ANALYZER_DEADLINE', '60'))
+# Оценивается весь рынок USDT-перпетуалов (около 400 пар); top запроса ограничивает пары по обороту
+SCAN_TOP_MAX = 500
+SCAN_TOP_DEFAULT = SCAN_TOP_MAX
+SCAN_INTERVAL = '15'
+SCAN_CANDLES = 100
+MIN_CANDLES = 50
+
+# Рейтинг считается в фоне после закрытия каждой свечи SCAN_INTERVAL, обработчик отдаёт
+# последний готовый снимок и сам скан не ждёт. Снимки хранятся в памяти и на диске.
+PAIR_RANKINGS_ENABLED = os.environ.get('PAIR_RANKINGS_ENABLED', '1') == '1'
+# Через сколько секунд после закрытия свечи запускать скан (биржа успевает закрыть свечу)
+PAIR_RANKINGS_DELAY = float(os.environ.get('PAIR_RANKINGS_DELAY', '5'))
+# Нижняя граница объёма для снимка: min_volume запроса фильтрует уже посчитанные пары
+PAIR_RANKINGS_MIN_VOLUME = float(os.environ.get('PAIR_RANKINGS_MIN_VOLUME', '0'))
+PAIR_RANKINGS_HISTORY = int(os.environ.get('PAIR_RANKINGS_HISTORY', '4'))
+PAIR_RANKINGS_PATH = os.environ.get(
+    'PAIR_RANKINGS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pair_rankings.json')
+)
+
+_executor = ThreadPoolExecutor(max_workers=SCAN_CONCURRENCY, thread_name_prefix='pair-analyzer')
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Анализирует криптовалютные пары по волатильности, ликвидности, тренду
-    Args: event - GET запрос (опционально: ?min_volume=1000000)
+    Args: event - GET запрос (опционально: ?min_volume=1000000&top=500&snapshot=0)
           context - объект с request_id
-    Returns: Список топ-пар с метриками для автоторговли
+    Returns: Список топ-пар с метриками для автоторговли из последнего снимка рейтинга
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -32,55 +72,40 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'error': 'Method not allowed'}),
+            'body': fast_json.dumps({'error': 'Method not allowed'}),
             'isBase64Encoded': False
         }
     
     params = event.get('queryStringParameters') or {}
     min_volume = float(params.get('min_volume', 5000000))
+    top = min(int(params.get('top', SCAN_TOP_DEFAULT)), SCAN_TOP_MAX)
+    index = int(params.get('snapshot', 0))
+    
+    rankings = get_rankings()
+    now = time.time()
+    snapshot = rankings.latest(index)
+    # Читатель скан не ждёт: устаревший или отсутствующий снимок обновляется в фоне
+    if index == 0 and rankings.is_stale(snapshot, now):
+        rankings.refresh_in_background()
+    
+    if snapshot is None:
+        computing = index == 0
+        return {
+            'statusCode': 503 if computing else 404,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                **({'Retry-After': '10'} if computing else {})
+            },
+            'body': fast_json.dumps({
+                'success': False,
+                'error': 'Pair rankings are being computed' if computing else 'Snapshot not found'
+            }),
+            'isBase64Encoded': False
+        }
     
-    tickers = get_all_tickers()
-    
-    filtered_tickers = [t for t in tickers if t['volume24h'] >= min_volume]
-    filtered_tickers.sort(key=lambda x: x['turnover24h'], reverse=True)
-    
-    top_tickers = filtered_tickers[:30]
-    
-    analyzed_pairs = []
-    for ticker in top_tickers:
-        symbol = ticker['symbol']
-        
-        klines = get_kline_data(symbol, interval='15', limit=100)
-        
-        if len(klines) < 50:
-            continue
-        
-        volatility = calculate_volatility(klines)
-        liquidity = calculate_liquidity(ticker)
-        trend_strength = calculate_trend_strength(klines)
-        market_reliability = calculate_market_reliability(klines, ticker)
-        
-        total_score = (
-            volatility['score'] * 0.30 +
-            liquidity['score'] * 0.25 +
-            trend_strength['score'] * 0.25 +
-            market_reliability['score'] * 0.20
-        )
-        
-        analyzed_pairs.append({
-            'symbol': symbol,
-            'price': ticker['lastPrice'],
-            'volume24h': ticker['volume24h'],
-            'priceChange24h': ticker['priceChangePercent'],
-            'volatility': volatility,
-            'liquidity': liquidity,
-            'trend': trend_strength,
-            'reliability': market_reliability,
-            'totalScore': round(total_score, 2),
-            'recommendation': get_recommendation(total_score, volatility, trend_strength)
-        })
-    
-    analyzed_pairs.sort(key=lambda x: x['totalScore'], reverse=True)
+    analyzed_pairs = filter_pairs(snapshot['pairs'], min_volume, top)
+    skipped_symbols = snapshot['skippedSymbols']
     
     return {
         'statusCode': 200,
@@ -88,13 +113,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps({
+        'body': fast_json.dumps({
             'success': True,
-            'timestamp': int(time.time()),
+            'timestamp': int(now),
+            'computedAt': snapshot['computedAt'],
+            'ageSeconds': round(now - snapshot['computedAt'], 1),
+            'stale': rankings.is_stale(snapshot, now),
+            'snapshots': rankings.count(),
             'totalPairs': len(analyzed_pairs),
             'topPairs': analyzed_pairs[:20],
+            'partial': bool(skipped_symbols),
+            'skippedSymbols': skipped_symbols,
             'criteria': {
-                'minVolume': min_volume,
+                'minVolume': max(min_volume, snapshot['minVolume']),
                 'weights': {
                     'volatility': 0.30,
                     'liquidity': 0.25,
@@ -106,92 +137,310 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'isBase64Encoded': False
     }
 
-def get_all_tickers() -> List[Dict[str, Any]]:
-    url = f"{BYBIT_BASE_URL}/v5/market/tickers"
-    params = {'category': 'linear'}
-    
-    full_url = f"{url}?{urlencode(params)}"
-    request = Request(full_url)
+def filter_pairs(pairs: List[Dict[str, Any]], min_volume: float, top: int) -> List[Dict[str, Any]]:
+    '''Пары снимка с объёмом не меньше min_volume из top по обороту; порядок по totalScore сохраняется.'''
+    filtered = [p for p in pairs if p['volume24h'] >= min_volume]
+    if len(filtered) > top:
+        by_turnover = sorted(filtered, key=lambda p: p['liquidity']['turnover24h'], reverse=True)
+        allowed = {p['symbol'] for p in by_turnover[:top]}
+        filtered = [p for p in filtered if p['symbol'] in allowed]
+    return filtered
+
+class PairRankings:
+    '''
+    Последние снимки рейтинга пар. Скан всего рынка идёт в фоне сразу после закрытия свечи
+    SCAN_INTERVAL (с классом приоритета background), одновременно выполняется не больше одного.
+    Снимки сохраняются в файл, чтобы после перезапуска рейтинг отдавался сразу.
+    '''
     
-    with urlopen(request, timeout=10) as response:
-        data = json.loads(response.read().decode('utf-8'))
-        
-        if data.get('retCode') == 0:
-            tickers = data.get('result', {}).get('list', [])
-            formatted = []
-            
-            for t in tickers:
-                if not t['symbol'].endswith('USDT'):
-                    continue
-                
+    def __init__(self, path: str = PAIR_RANKINGS_PATH, history: int = PAIR_RANKINGS_HISTORY,
+                 min_volume: float = PAIR_RANKINGS_MIN_VOLUME, deadline: float = SCAN_DEADLINE,
+                 delay: float = PAIR_RANKINGS_DELAY):
+        self.path = path
+        self.min_volume = min_volume
+        self.deadline = deadline
+        self.delay = delay
+        self.period = INTERVAL_MS[SCAN_INTERVAL] / 1000
+        self.snapshots: deque = deque(maxlen=history)
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._running = threading.Lock()
+        # Фоновый скан уже поставлен в очередь: повторные запросы его не дублируют
+        self._scheduled = False
+        # После stop() пул остановлен и новые сканы не ставятся
+        self._stopped = False
+        self._refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pair-rankings')
+        self._task: Optional[asyncio.Task] = None
+    
+    def latest(self, index: int = 0) -> Optional[Dict[str, Any]]:
+        '''Снимок: 0 — последний, 1 — предыдущий и т.д. (None — такого нет).'''
+        with self._lock:
+            if 0 <= index < len(self.snapshots):
+                return self.snapshots[-1 - index]
+        return None
+    
+    def count(self) -> int:
+        with self._lock:
+            return len(self.snapshots)
+    
+    def last_close(self, now: float) -> float:
+        '''Время последнего планового скана: закрытие свечи плюс задержка.'''
+        return self.next_run(now) - self.period
+    
+    def next_run(self, now: float) -> float:
+        return ((now - self.delay) // self.period + 1) * self.period + self.delay
+    
+    def is_stale(self, snapshot: Optional[Dict[str, Any]], now: float) -> bool:
+        '''Снимок посчитан до последнего закрытия свечи (или его нет).'''
+        return snapshot is None or snapshot['computedAt'] < self.last_close(now)
+    
+    def refresh(self) -> Optional[Dict[str, Any]]:
+        '''Скан рынка и новый снимок (блокирующий). None — скан уже идёт.'''
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            started = time.perf_counter()
+            with upstream_priority(BACKGROUND):
+                pairs, skipped_symbols = rank_pairs(self.min_volume, SCAN_TOP_MAX, self.deadline)
+            snapshot = {
+                'computedAt': time.time(),
+                'durationMs': round((time.perf_counter() - started) * 1000, 2),
+                'minVolume': self.min_volume,
+                'pairs': pairs,
+                'skippedSymbols': skipped_symbols,
+            }
+            with self._lock:
+                self.snapshots.append(snapshot)
+                self.last_error = None
+            self.save()
+            return snapshot
+        except Exception as e:
+            with self._lock:
+                self.last_error = str(e)
+            raise
+        finally:
+            self._running.release()
+    
+    def refresh_in_background(self) -> bool:
+        '''Ставит скан в фоновый поток; False — скан уже идёт или ждёт очереди, либо stop() уже вызван.'''
+        with self._lock:
+            if self._stopped or self._scheduled or self._running.locked():
+                return False
+            self._scheduled = True
+            # Под блокировкой: stop() не успеет остановить пул между проверкой и submit
+            self._refresher.submit(self._refresh_logged)
+        return True
+    
+    def _refresh_logged(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Pair rankings refresh failed')
+        finally:
+            with self._lock:
+                self._scheduled = False
+    
+    def save(self) -> None:
+        with self._lock:
+            data = {'snapshots': list(self.snapshots), 'saved_at': time.time()}
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(fast_json.dumps(data))
+        os.replace(tmp_path, self.path)
+    
+    def restore(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            data = fast_json.loads(f.read())
+        with self._lock:
+            self.snapshots.extend(data['snapshots'])
+        return True
+    
+    async def run_forever(self) -> None:
+        # После перезапуска снимок с диска отдаётся сразу, а пропущенное закрытие досчитывается
+        if self.is_stale(self.latest(), time.time()):
+            self.refresh_in_background()
+        while True:
+            await asyncio.sleep(max(0.0, self.next_run(time.time()) - time.time()))
+            # Через ту же защиту, что и запросы читателей: если прошлый скан ещё идёт,
+            # это закрытие пропускается, а не ставится за ним в очередь
+            self.refresh_in_background()
+    
+    def start(self) -> None:
+        '''Запускает расписание в текущем event loop (вызывается из startup шлюза).'''
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run_forever())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        with self._lock:
+            self._stopped = True
+            self._refresher.shutdown(wait=False)
+
+_rankings: Optional[PairRankings] = None
+_rankings_lock = threading.Lock()
+
+def get_rankings() -> PairRankings:
+    '''Общие снимки процесса; при первом обращении поднимаются с диска.'''
+    global _rankings
+    if _rankings is None:
+        with _rankings_lock:
+            if _rankings is None:
+                rankings = PairRankings()
                 try:
-                    formatted.append({
-                        'symbol': t['symbol'],
-                        'lastPrice': float(t['lastPrice']),
-                        'volume24h': float(t['volume24h']),
-                        'turnover24h': float(t['turnover24h']),
-                        'priceChangePercent': float(t['price24hPcnt']) * 100,
-                        'highPrice24h': float(t['highPrice24h']),
-                        'lowPrice24h': float(t['lowPrice24h'])
-                    })
-                except (ValueError, KeyError):
-                    continue
-            
-            return formatted
-        
-        return []
+                    rankings.restore()
+                except (OSError, ValueError, KeyError, TypeError):
+                    # Без снимков с диска первый скан просто посчитается заново
+                    logger.exception('Pair rankings restore from %s failed', rankings.path)
+                _rankings = rankings
+    return _rankings
 
-def get_kline_data(symbol: str, interval: str = '15', limit: int = 100) -> List[Dict[str, Any]]:
-    url = f"{BYBIT_BASE_URL}/v5/market/kline"
-    params = {
-        'category': 'linear',
-        'symbol': symbol,
-        'interval': interval,
-        'limit': limit
-    }
+def rank_pairs(min_volume: float, top: int, deadline: float) -> Tuple[List[Dict[str, Any]], List[str]]:
+    '''Пары (до top по обороту) с объёмом не меньше min_volume, отсортированные по totalScore.'''
+    tickers = get_all_tickers()
+    
+    filtered_tickers = [t for t in tickers if t['volume24h'] >= min_volume]
+    filtered_tickers.sort(key=lambda x: x['turnover24h'], reverse=True)
+    filtered_tickers = filtered_tickers[:top]
     
-    full_url = f"{url}?{urlencode(params)}"
-    request = Request(full_url)
-    
-    try:
-        with urlopen(request, timeout=5) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            
-            if data.get('retCode') == 0:
-                klines = data.get('result', {}).get('list', [])
-                formatted = []
-                for k in klines:
-                    formatted.append({
-                        'time': k[0],
-                        'open': float(k[1]),
-                        'high': float(k[2]),
-                        'low': float(k[3]),
-                        'close': float(k[4]),
-                        'volume': float(k[5])
-                    })
-                return formatted[::-1]
-    except Exception:
-        pass
-    
-    return []
+    klines, skipped_symbols = load_klines(filtered_tickers, deadline)
+    analyzed_pairs = score_pairs(filtered_tickers, klines)
+    
+    analyzed_pairs.sort(key=lambda x: x['totalScore'], reverse=True)
+    return analyzed_pairs, skipped_symbols
 
-def calculate_volatility(klines: List[Dict[str, Any]]) -> Dict[str, Any]:
-    if len(klines) < 20:
-        return {'value': 0, 'score': 0, 'level': 'unknown'}
+def pair_result(ticker: Dict[str, Any], volatility: Dict[str, Any], liquidity: Dict[str, Any],
+                trend_strength: Dict[str, Any], market_reliability: Dict[str, Any]) -> Dict[str, Any]:
+    total_score = (
+        volatility['score'] * 0.30 +
+        liquidity['score'] * 0.25 +
+        trend_strength['score'] * 0.25 +
+        market_reliability['score'] * 0.20
+    )
     
-    atr_values = []
-    for i in range(1, len(klines)):
-        high_low = klines[i]['high'] - klines[i]['low']
-        high_close = abs(klines[i]['high'] - klines[i-1]['close'])
-        low_close = abs(klines[i]['low'] - klines[i-1]['close'])
-        true_range = max(high_low, high_close, low_close)
-        atr_values.append(true_range)
+    return {
+        'symbol': ticker['symbol'],
+        'price': ticker['lastPrice'],
+        'volume24h': ticker['volume24h'],
+        'priceChange24h': ticker['priceChangePercent'],
+        'volatility': volatility,
+        'liquidity': liquidity,
+        'trend': trend_strength,
+        'reliability': market_reliability,
+        'totalScore': round(total_score, 2),
+        'recommendation': get_recommendation(total_score, volatility, trend_strength)
+    }
+
+def load_klines(tickers: List[Dict[str, Any]], deadline: float) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
+    '''
+    Параллельно загружает свечи пар (не больше SCAN_CONCURRENCY запросов одновременно).
+    Пары, не успевшие за deadline секунд или не загрузившиеся, возвращаются списком пропущенных.
+    '''
+    # Контекст копируется, чтобы загрузка шла с классом приоритета вызывающего (rate_limiter)
+    futures = {
+        _executor.submit(contextvars.copy_context().run, get_kline_data, t['symbol'], SCAN_INTERVAL, SCAN_CANDLES): t['symbol']
+        for t in tickers
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    
+    for future in not_done:
+        future.cancel()
+    
+    klines = {}
+    failed = []
+    for future in done:
+        if future.exception() is None:
+            klines[futures[future]] = future.result()
+        else:
+            failed.append(future)
+    if failed:
+        # Одна запись на скан: при недоступном Bybit падают сразу все пары
+        logger.warning('Pair scan: candles of %d of %d symbols failed to load (first: %s)',
+                       len(failed), len(futures), futures[failed[0]], exc_info=failed[0].exception())
+    
+    skipped_symbols = sorted(futures[f] for f in [*not_done, *failed])
+    return klines, skipped_symbols
+
+def score_pairs(tickers: List[Dict[str, Any]], klines: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    '''
+    Оценка всех пар за один векторный проход. Свечи пар одной длины (обычно это все пары)
+    складываются в матрицы символы × время, и ATR, SMA и стабильность цены считаются
+    сразу по всем строкам.
+    '''
+    groups: Dict[int, List[Dict[str, Any]]] = {}
+    for ticker in tickers:
+        length = len(klines.get(ticker['symbol']) or ())
+        if length >= MIN_CANDLES:
+            groups.setdefault(length, []).append(ticker)
     
-    avg_atr = sum(atr_values[-14:]) / 14
-    current_price = klines[-1]['close']
+    analyzed_pairs = []
+    for group in groups.values():
+        analyzed_pairs.extend(score_group(group, [klines[t['symbol']] for t in group]))
+    return analyzed_pairs
+
+def candle_matrix(klines: List[List[Dict[str, Any]]], field: str) -> np.ndarray:
+    return np.array([[k[field] for k in candles] for candles in klines], dtype=np.float64)
+
+def score_group(tickers: List[Dict[str, Any]], klines: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    high = candle_matrix(klines, 'high')
+    low = candle_matrix(klines, 'low')
+    close = candle_matrix(klines, 'close')
+    
+    volatility_percent = atr(high, low, close, 14)[:, -1] / close[:, -1] * 100
+    
+    closes = close[:, -30:]
+    sma_long = sma(closes, 30)[:, -1]
+    trend_diff = (sma(closes, 10)[:, -1] - sma_long) / sma_long * 100
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.abs((close[:, 1:] - close[:, :-1]) / close[:, :-1]) * 100
+    stable = np.count_nonzero((close[:, 1:] > 0) & (change < 5), axis=1)
+    consistency_percent = stable / (close.shape[1] - 1) * 100
+    
+    return [
+        pair_result(
+            ticker,
+            volatility_metrics(float(volatility_percent[i])),
+            calculate_liquidity(ticker),
+            trend_metrics(float(trend_diff[i])),
+            reliability_metrics(float(consistency_percent[i]), ticker)
+        )
+        for i, ticker in enumerate(tickers)
+    ]
+
+def get_all_tickers() -> List[Dict[str, Any]]:
+    tickers = get_tickers('linear')
+    formatted = []
     
-    volatility_percent = (avg_atr / current_price) * 100
+    for t in tickers:
+        if not t['symbol'].endswith('USDT'):
+            continue
+        
+        try:
+            formatted.append({
+                'symbol': t['symbol'],
+                'lastPrice': float(t['lastPrice']),
+                'volume24h': float(t['volume24h']),
+                'turnover24h': float(t['turnover24h']),
+                'priceChangePercent': float(t['price24hPcnt']) * 100,
+                'highPrice24h': float(t['highPrice24h']),
+                'lowPrice24h': float(t['lowPrice24h'])
+            })
+        except (ValueError, KeyError):
+            continue
     
+    return formatted
+
+def get_kline_data(symbol: str, interval: str = '15', limit: int = 100) -> List[Dict[str, Any]]:
+    # Та же группа схлопывания, что у action=kline в bybit_market: ключ (категория, символ, интервал, limit)
+    return live_candles(symbol, interval, limit, 'linear') or get_flight('kline').do(
+        ('linear', symbol, interval, limit), get_candles, symbol, interval, limit, 'linear'
+    )
+
+def volatility_metrics(volatility_percent: float) -> Dict[str, Any]:
     if volatility_percent < 0.5:
         score = volatility_percent * 40
     elif volatility_percent <= 3:
@@ -229,17 +478,7 @@ def calculate_liquidity(ticker: Dict[str, Any]) -> Dict[str, Any]:
         'level': level
     }
 
-def calculate_trend_strength(klines: List[Dict[str, Any]]) -> Dict[str, Any]:
-    if len(klines) < 30:
-        return {'direction': 'unknown', 'score': 0, 'strength': 0}
-    
-    closes = [k['close'] for k in klines[-30:]]
-    
-    sma_short = sum(closes[-10:]) / 10
-    sma_long = sum(closes[-30:]) / 30
-    
-    trend_diff = ((sma_short - sma_long) / sma_long) * 100
-    
+def trend_metrics(trend_diff: float) -> Dict[str, Any]:
     if abs(trend_diff) < 0.5:
         direction = 'sideways'
         strength = 0
@@ -260,19 +499,7 @@ def calculate_trend_strength(klines: List[Dict[str, Any]]) -> Dict[str, Any]:
         'trendValue': round(trend_diff, 3)
     }
 
-def calculate_market_reliability(klines: List[Dict[str, Any]], ticker: Dict[str, Any]) -> Dict[str, Any]:
-    if len(klines) < 20:
-        return {'score': 0, 'level': 'unknown'}
-    
-    price_consistency = 0
-    for i in range(1, len(klines)):
-        if klines[i]['close'] > 0:
-            change = abs((klines[i]['close'] - klines[i-1]['close']) / klines[i-1]['close']) * 100
-            if change < 5:
-                price_consistency += 1
-    
-    consistency_percent = (price_consistency / (len(klines) - 1)) * 100
-    
+def reliability_metrics(consistency_percent: float, ticker: Dict[str, Any]) -> Dict[str, Any]:
     turnover = ticker['turnover24h']
     turnover_score = min(100, (turnover / 10_000_000) * 50)
     
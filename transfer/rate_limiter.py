@@ -0,0 +1,300 @@
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Optional
+
+# Общий планировщик исходящих запросов к Bybit: корзины токенов на IP и на группу
+# эндпоинтов, классы приоритета и очередь, в которой более важный класс всегда идёт первым.
+# Торговые вызовы не ждут за обновлением графиков: менее важные классы не могут занять
+# последние токены корзины (HEADROOM), а в очереди обходят их только более важные.
+# Бюджеты подстраиваются под заголовки X-Bapi-Limit*, а 403/429 и retCode 10006
+# останавливают корзину на BYBIT_RATE_LIMIT_BACKOFF секунд.
+
+TRADE, BOT, UI, BACKGROUND = 0, 1, 2, 3
+PRIORITY_NAMES = {TRADE: 'trade', BOT: 'bot', UI: 'ui', BACKGROUND: 'background'}
+
+# Доля ёмкости корзины, которую класс оставляет более важным классам
+HEADROOM = {TRADE: 0.0, BOT: 0.1, UI: 0.25, BACKGROUND: 0.5}
+
+# Запросов в секунду по группам (ёмкость корзины равна секундному бюджету).
+# Bybit: 600 запросов за 5 секунд с одного IP, приватные эндпоинты — свои лимиты на UID.
+# Переопределяются через BYBIT_RATE_LIMITS="ip=100,market=50,order=10"
+RATE_LIMITS: Dict[str, float] = {
+    'ip': 100,
+    'market': 50,
+    'order': 10,
+    'position': 10,
+    'account': 5,
+    'other': 10,
+}
+
+for _item in filter(None, os.environ.get('BYBIT_RATE_LIMITS', '').split(',')):
+    _group, _, _value = _item.partition('=')
+    if _value:
+        RATE_LIMITS[_group.strip()] = float(_value)
+
+GROUP_PREFIXES = (
+    ('/v5/market/', 'market'),
+    ('/v5/order/', 'order'),
+    ('/v5/position/', 'position'),
+    ('/v5/account/', 'account'),
+)
+
+# На сколько секунд останавливать корзину после ответа «слишком часто»
+RATE_LIMIT_BACKOFF = float(os.environ.get('BYBIT_RATE_LIMIT_BACKOFF', '5'))
+# retCode Bybit «Too many visits»
+RATE_LIMIT_RET_CODE = 10006
+
+
+class RateLimitTimeout(TimeoutError):
+    '''Бюджет лимитов не освободится за таймаут запроса (сам Bybit при этом не вызывался).'''
+
+
+_priority: contextvars.ContextVar = contextvars.ContextVar('upstream_priority', default=UI)
+
+
+@contextmanager
+def upstream_priority(priority: int) -> Iterator[None]:
+    '''Класс приоритета для запросов к Bybit внутри блока with (в текущем потоке/задаче).'''
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def endpoint_group(path: str) -> str:
+    for prefix, group in GROUP_PREFIXES:
+        if path.startswith(prefix):
+            return group
+    return 'other'
+
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self.capacity = max(float(rate), 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        start = max(self.updated, self.blocked_until)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def wait_time(self, now: float, priority: int) -> float:
+        '''Сколько секунд классу priority ждать токена (0 — можно брать сейчас).'''
+        self._refill(now)
+        need = min(self.capacity, self.capacity * HEADROOM[priority] + 1)
+        blocked = max(0.0, self.blocked_until - now)
+        if not blocked and self.tokens >= need:
+            return 0.0
+        return blocked + max(0.0, need - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float, now: float) -> None:
+        self._refill(now)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def observe(self, limit: Optional[int], remaining: Optional[int], reset_in: Optional[float], now: float) -> None:
+        '''Подстройка по заголовкам Bybit: лимит эндпоинта и остаток в текущем окне.'''
+        self._refill(now)
+        if limit and limit != self.rate:
+            self.rate = self.capacity = float(limit)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+            if remaining <= 0 and reset_in:
+                self.block(min(max(reset_in, 0.0), RATE_LIMIT_BACKOFF), now)
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        self._refill(now)
+        return {
+            'rate': self.rate,
+            'tokens': round(self.tokens, 2),
+            'blockedForMs': round(max(0.0, self.blocked_until - now) * 1000, 1),
+        }
+
+
+def _int_header(headers: Dict[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class UpstreamLimiter:
+    '''
+    Очередь к корзинам токенов. Запрос берёт токен своей группы и общий токен IP.
+    Порядок: класс приоритета, внутри класса — порядок прихода. Запрос более важного класса
+    из другой группы задерживает менее важные, только пока его собственная группа не пуста
+    (то есть пока он действительно претендует на общий токен IP).
+    '''
+
+    # Пока впереди в очереди есть другой запрос, ожидание прерывается его уходом (notify)
+    # или, для async-вызовов, этим интервалом опроса
+    POLL_INTERVAL = 0.005
+
+    def __init__(self, limits: Optional[Dict[str, float]] = None):
+        self.buckets = {group: TokenBucket(rate) for group, rate in (limits or RATE_LIMITS).items()}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        # seq → (приоритет, группа)
+        self._waiting: Dict[int, tuple] = {}
+        self.counters = {
+            name: {'acquired': 0, 'waited': 0, 'timeouts': 0, 'totalWaitMs': 0.0, 'maxWaitMs': 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+        self.throttled = 0
+        self.header_updates = 0
+
+    def _bucket(self, group: str) -> TokenBucket:
+        bucket = self.buckets.get(group)
+        if bucket is None:
+            bucket = self.buckets[group] = TokenBucket(RATE_LIMITS.get(group, RATE_LIMITS['other']))
+        return bucket
+
+    def _wait_time(self, seq: int, priority: int, group: str, now: float) -> float:
+        for other, (other_priority, other_group) in self._waiting.items():
+            if (other_priority, other) >= (priority, seq):
+                continue
+            if other_group == group:
+                return max(self.POLL_INTERVAL, self._bucket(group).wait_time(now, other_priority))
+            if other_priority < priority and self._bucket(other_group).wait_time(now, other_priority) == 0:
+                return self.POLL_INTERVAL
+        return max(self._bucket(group).wait_time(now, priority), self._bucket('ip').wait_time(now, priority))
+
+    def _take(self, priority: int, group: str, waited: float) -> None:
+        self._bucket(group).take()
+        self._bucket('ip').take()
+        counters = self.counters[PRIORITY_NAMES[priority]]
+        counters['acquired'] += 1
+        if waited >= 0.001:
+            counters['waited'] += 1
+            counters['totalWaitMs'] += waited * 1000
+            counters['maxWaitMs'] = max(counters['maxWaitMs'], waited * 1000)
+
+    def _timeout(self, priority: int, path: str, timeout: float) -> RateLimitTimeout:
+        self.counters[PRIORITY_NAMES[priority]]['timeouts'] += 1
+        return RateLimitTimeout(f'Bybit rate limit: no budget for {path} within {timeout}s')
+
+    def _step(self, seq: int, priority: int, group: str, path: str, started: float,
+              timeout: Optional[float]) -> float:
+        '''Под блокировкой: 0 — токены взяты, иначе сколько ждать до следующей попытки.'''
+        now = time.monotonic()
+        wait = self._wait_time(seq, priority, group, now)
+        if wait <= 0:
+            self._take(priority, group, now - started)
+            return 0.0
+        if timeout is not None and now + wait - started > timeout:
+            raise self._timeout(priority, path, timeout)
+        return wait
+
+    def acquire(self, path: str, priority: Optional[int] = None, timeout: Optional[float] = None) -> None:
+        '''Ждёт токен для запроса к path; RateLimitTimeout, если бюджета не будет за timeout секунд.'''
+        priority = current_priority() if priority is None else priority
+        group = endpoint_group(path)
+        started = time.monotonic()
+        with self._cond:
+            seq = next(self._seq)
+            self._waiting[seq] = (priority, group)
+            try:
+                while True:
+                    wait = self._step(seq, priority, group, path, started, timeout)
+                    if not wait:
+                        return
+                    self._cond.wait(wait)
+            finally:
+                del self._waiting[seq]
+                self._cond.notify_all()
+
+    async def acquire_async(self, path: str, priority: Optional[int] = None,
+                            timeout: Optional[float] = None) -> None:
+        priority = current_priority() if priority is None else priority
+        group = endpoint_group(path)
+        started = time.monotonic()
+        with self._cond:
+            seq = next(self._seq)
+            self._waiting[seq] = (priority, group)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._step(seq, priority, group, path, started, timeout)
+                if not wait:
+                    return
+                await asyncio.sleep(min(wait, self.POLL_INTERVAL * 10))
+        finally:
+            with self._cond:
+                del self._waiting[seq]
+                self._cond.notify_all()
+
+    def observe(self, path: str, status: int, headers: Dict[str, str]) -> None:
+        '''Ответ Bybit: заголовки лимита подстраивают корзину группы, 403/429 — пауза по IP.'''
+        now = time.monotonic()
+        limit = _int_header(headers, 'x-bapi-limit')
+        remaining = _int_header(headers, 'x-bapi-limit-status')
+        reset_at = _int_header(headers, 'x-bapi-limit-reset-timestamp')
+        with self._cond:
+            if limit is not None or remaining is not None:
+                self.header_updates += 1
+                reset_in = reset_at / 1000 - time.time() if reset_at else None
+                self._bucket(endpoint_group(path)).observe(limit, remaining, reset_in, now)
+            if status in (403, 429):
+                self.throttled += 1
+                self._bucket('ip').block(RATE_LIMIT_BACKOFF, now)
+
+    def penalize(self, path: str) -> None:
+        '''retCode 10006: лимит группы исчерпан — пауза до следующего окна.'''
+        with self._cond:
+            self.throttled += 1
+            self._bucket(endpoint_group(path)).block(RATE_LIMIT_BACKOFF, time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._cond:
+            priorities = {}
+            for name, counters in self.counters.items():
+                waited = counters['waited']
+                priorities[name] = {
+                    'acquired': counters['acquired'],
+                    'waited': waited,
+                    'timeouts': counters['timeouts'],
+                    'avgWaitMs': round(counters['totalWaitMs'] / waited, 2) if waited else 0.0,
+                    'maxWaitMs': round(counters['maxWaitMs'], 2),
+                }
+            return {
+                'buckets': {group: bucket.stats(now) for group, bucket in self.buckets.items()},
+                'priorities': priorities,
+                'queued': len(self._waiting),
+                'throttled': self.throttled,
+                'headerUpdates': self.header_updates,
+            }
+
+
+_limiter: Optional[UpstreamLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> UpstreamLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = UpstreamLimiter()
+    return _limiter
+
+
+def limiter_stats() -> Dict[str, Any]:
+    return get_limiter().stats()
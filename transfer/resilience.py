@@ -0,0 +1,324 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Any, Optional, TypeVar
+
+T = TypeVar('T')
+
+# Защита от хвостовых задержек и сбоев Bybit для идемпотентных GET:
+# - hedged-запрос: если ответа нет дольше p95 задержки эндпоинта, уходит второй такой же
+#   запрос, и берётся первый успешный ответ (доля дублей ограничена BYBIT_HEDGE_MAX_RATIO);
+# - повторы с полным джиттером при сетевых ошибках и 5xx, в пределах таймаута эндпоинта;
+# - circuit breaker на эндпоинт: после серии сбоев запросы сразу отклоняются, а публичные
+#   рыночные данные отдаются из последнего успешного ответа, пока эндпоинт не восстановится.
+
+HEDGE_ENABLED = os.environ.get('BYBIT_HEDGE_ENABLED', '1') == '1'
+HEDGE_QUANTILE = float(os.environ.get('BYBIT_HEDGE_QUANTILE', '0.95'))
+# Пока замеров меньше, p95 не считается и второй запрос не отправляется
+HEDGE_MIN_SAMPLES = int(os.environ.get('BYBIT_HEDGE_MIN_SAMPLES', '20'))
+HEDGE_MIN_DELAY = float(os.environ.get('BYBIT_HEDGE_MIN_DELAY', '0.05'))
+HEDGE_MAX_RATIO = float(os.environ.get('BYBIT_HEDGE_MAX_RATIO', '0.1'))
+# Потоки для основных запросов, которые можно продублировать; когда все заняты, запрос
+# выполняется в потоке вызывающего без дубля
+HEDGE_PRIMARY_WORKERS = int(os.environ.get('BYBIT_HEDGE_PRIMARY_WORKERS', '32'))
+HEDGE_WORKERS = int(os.environ.get('BYBIT_HEDGE_WORKERS', '16'))
+RETRIES = int(os.environ.get('BYBIT_RETRIES', '2'))
+RETRY_BASE = float(os.environ.get('BYBIT_RETRY_BASE', '0.1'))
+RETRY_CAP = float(os.environ.get('BYBIT_RETRY_CAP', '1'))
+BREAKER_FAILURES = int(os.environ.get('BYBIT_BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN = float(os.environ.get('BYBIT_BREAKER_COOLDOWN', '15'))
+# Сколько секунд последний успешный ответ годится для выдачи при сбое
+FALLBACK_MAX_AGE = float(os.environ.get('BYBIT_FALLBACK_MAX_AGE', '300'))
+FALLBACK_ENTRIES = int(os.environ.get('BYBIT_FALLBACK_ENTRIES', '512'))
+# Ответы только публичных эндпоинтов можно отдавать из сохранённых
+FALLBACK_PREFIX = '/v5/market/'
+
+LATENCY_WINDOW = 200
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint: str, retry_after: float):
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+        super().__init__(f'Bybit {endpoint} is unavailable, retry in {retry_after:.0f}s')
+
+
+class StaleResult(dict):
+    '''
+    Ответ, отданный при сбое из последнего успешного; fetched_at — когда он был получен (time.time()).
+    Кэши не должны считать его свежим: снимок сохраняет своё время, свечи не записываются.
+    '''
+
+    def __init__(self, data: Dict[str, Any], fetched_at: float):
+        super().__init__(data)
+        self.fetched_at = fetched_at
+
+
+def stale_since(result: Any) -> Optional[float]:
+    '''Время получения ответа, если он отдан из сохранённых при сбое, иначе None.'''
+    return result.fetched_at if isinstance(result, StaleResult) else None
+
+
+class CircuitBreaker:
+    '''closed → (BREAKER_FAILURES сбоев подряд) → open → (cooldown) → half-open: один пробный запрос.'''
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+
+    def allow(self, now: float) -> bool:
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and now - self.opened_at >= self.cooldown:
+            self.state = 'half-open'
+        if self.state == 'half-open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def retry_after(self, now: float) -> float:
+        return max(0.0, self.opened_at + self.cooldown - now)
+
+    def record(self, ok: Optional[bool], now: float) -> None:
+        '''ok=None — исход не говорит о здоровье эндпоинта (например, не хватило бюджета лимитов).'''
+        self.probing = False
+        if ok is None:
+            return
+        if ok:
+            self.state = 'closed'
+            self.consecutive = 0
+            return
+        self.consecutive += 1
+        if self.state == 'half-open' or self.consecutive >= self.failures:
+            if self.state != 'open':
+                self.opens += 1
+            self.state = 'open'
+            self.opened_at = now
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._quantiles: Optional[Dict[float, float]] = None
+        self.breaker = CircuitBreaker()
+        self.counters = {
+            'requests': 0,
+            'failures': 0,
+            'retries': 0,
+            'hedges': 0,
+            'hedgeWins': 0,
+            # Дубль не отправлен: все потоки для дублей заняты
+            'hedgesDropped': 0,
+            # Основной запрос выполнен без возможности дубля: все потоки основных заняты
+            'unhedged': 0,
+            'fastFails': 0,
+            'servedCached': 0,
+        }
+
+    def record_latency(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+        self._quantiles = None
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        if self._quantiles is None:
+            self._quantiles = {}
+        value = self._quantiles.get(q)
+        if value is None:
+            ordered = sorted(self.latencies)
+            value = self._quantiles[q] = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return value
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        def ms(q: float) -> Optional[float]:
+            value = self.quantile(q)
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            **self.counters,
+            'p50Ms': ms(0.5),
+            'p95Ms': ms(0.95),
+            'p99Ms': ms(0.99),
+            'breaker': self.breaker.state,
+            'breakerOpens': self.breaker.opens,
+            'retryAfter': round(self.breaker.retry_after(now), 1) if self.breaker.state != 'closed' else 0,
+        }
+
+
+class Resilience:
+    def __init__(self, hedge_workers: int = HEDGE_WORKERS, primary_workers: int = HEDGE_PRIMARY_WORKERS):
+        self._endpoints: Dict[str, EndpointStats] = {}
+        self._fallback: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Основные запросы и дубли — в разных пулах, чтобы основной не ждал за дублями
+        self._primary = ThreadPoolExecutor(max_workers=primary_workers, thread_name_prefix='bybit-request')
+        self._primary_slots = threading.BoundedSemaphore(primary_workers)
+        self._executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix='bybit-hedge')
+        self._hedge_slots = threading.BoundedSemaphore(hedge_workers)
+
+    def _endpoint(self, endpoint: str) -> EndpointStats:
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            with self._lock:
+                stats = self._endpoints.setdefault(endpoint, EndpointStats())
+        return stats
+
+    def _count(self, stats: EndpointStats, name: str) -> None:
+        with self._lock:
+            stats.counters[name] += 1
+
+    def _timed(self, stats: EndpointStats, fn: Callable[[], T]) -> T:
+        started = time.monotonic()
+        result = fn()
+        with self._lock:
+            stats.record_latency(time.monotonic() - started)
+        return result
+
+    @staticmethod
+    def _submit(executor: ThreadPoolExecutor, slots: threading.BoundedSemaphore,
+                fn: Callable[..., T], *args) -> Optional[Future]:
+        '''Задача в пул, только если в нём есть свободный поток (в очередь запросы не встают).'''
+        if not slots.acquire(blocking=False):
+            return None
+        # Контекст копируется, чтобы в потоке сохранился класс приоритета (rate_limiter)
+        future = executor.submit(contextvars.copy_context().run, fn, *args)
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def _start(self, stats: EndpointStats, fn: Callable[[], T]) -> Optional[Future]:
+        '''Основной запрос — в свой пул; None — все его потоки заняты.'''
+        return self._submit(self._primary, self._primary_slots, self._timed, stats, fn)
+
+    def _submit_hedge(self, stats: EndpointStats, fn: Callable[[], T]) -> Optional[Future]:
+        return self._submit(self._executor, self._hedge_slots, self._timed, stats, fn)
+
+    def _hedged(self, stats: EndpointStats, fn: Callable[[], T]) -> T:
+        with self._lock:
+            delay = stats.quantile(HEDGE_QUANTILE) if HEDGE_ENABLED else None
+        if delay is None:
+            return self._timed(stats, fn)
+
+        first = self._start(stats, fn)
+        if first is None:
+            # Без свободного потока запрос не ждёт очереди, а выполняется здесь же
+            self._count(stats, 'unhedged')
+            return self._timed(stats, fn)
+        done, _ = wait([first], timeout=max(delay, HEDGE_MIN_DELAY))
+        if done:
+            return first.result()
+        with self._lock:
+            allowed = stats.counters['hedges'] < HEDGE_MAX_RATIO * stats.counters['requests']
+            if allowed:
+                stats.counters['hedges'] += 1
+        second = self._submit_hedge(stats, fn) if allowed else None
+        if second is None:
+            if allowed:
+                with self._lock:
+                    stats.counters['hedges'] -= 1
+                    stats.counters['hedgesDropped'] += 1
+            return first.result()
+
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self._count(stats, 'hedgeWins')
+                    # Проигравший запрос дорабатывает в фоне и возвращает соединение в пул
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _cached(self, key: Optional[tuple], stats: EndpointStats, error: BaseException) -> Any:
+        if key is not None:
+            with self._lock:
+                entry = self._fallback.get(key)
+            if entry is not None and time.monotonic() - entry[0] < FALLBACK_MAX_AGE:
+                self._count(stats, 'servedCached')
+                _, fetched_at, result = entry
+                return StaleResult(result, fetched_at) if isinstance(result, dict) else result
+        raise error
+
+    def call(self, endpoint: str, params: Optional[Dict[str, Any]], fn: Callable[[], T], timeout: float,
+             retryable: Callable[[BaseException], bool]) -> T:
+        '''
+        Идемпотентный запрос fn к endpoint с hedging, повторами и circuit breaker.
+        retryable(error) — сбой ли это Bybit (сеть, таймаут, 5xx), который имеет смысл повторить.
+        '''
+        stats = self._endpoint(endpoint)
+        key = (endpoint, tuple(sorted((params or {}).items()))) if endpoint.startswith(FALLBACK_PREFIX) else None
+        started = time.monotonic()
+
+        with self._lock:
+            stats.counters['requests'] += 1
+            allowed = stats.breaker.allow(started)
+            retry_after = stats.breaker.retry_after(started)
+            if not allowed:
+                stats.counters['fastFails'] += 1
+        if not allowed:
+            return self._cached(key, stats, CircuitOpenError(endpoint, retry_after))
+
+        attempt = 0
+        while True:
+            try:
+                result = self._hedged(stats, fn)
+            except Exception as e:
+                failed = retryable(e)
+                now = time.monotonic()
+                backoff = random.uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** attempt))
+                if failed and attempt < RETRIES and now + backoff - started < timeout:
+                    attempt += 1
+                    self._count(stats, 'retries')
+                    time.sleep(backoff)
+                    continue
+                with self._lock:
+                    if failed:
+                        stats.counters['failures'] += 1
+                    # Ошибка 4xx означает, что эндпоинт отвечает; нехватка бюджета лимитов — ни о чём
+                    stats.breaker.record(False if failed else (None if isinstance(e, TimeoutError) else True), now)
+                if failed:
+                    return self._cached(key, stats, e)
+                raise
+
+            with self._lock:
+                stats.breaker.record(True, time.monotonic())
+                if key is not None:
+                    self._fallback[key] = (time.monotonic(), time.time(), result)
+                    self._fallback.move_to_end(key)
+                    while len(self._fallback) > FALLBACK_ENTRIES:
+                        self._fallback.popitem(last=False)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {endpoint: stats.stats(now) for endpoint, stats in self._endpoints.items()}
+
+
+_resilience: Optional[Resilience] = None
+_resilience_lock = threading.Lock()
+
+
+def get_resilience() -> Resilience:
+    global _resilience
+    if _resilience is None:
+        with _resilience_lock:
+            if _resilience is None:
+                _resilience = Resilience()
+    return _resilience
+
+
+def resilience_stats() -> Dict[str, Any]:
+    return get_resilience().stats()
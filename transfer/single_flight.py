@@ -0,0 +1,92 @@
+import threading
+from typing import Callable, Dict, Any, Hashable, Optional, TypeVar
+
+T = TypeVar('T')
+
+# Схлопывание одинаковых запросов: пока по ключу идёт вызов, остальные потоки с тем же
+# ключом не запускают свой, а ждут его и получают тот же результат (или ту же ошибку).
+# На границе свечи десятки вкладок одновременно просят одни и те же свечи и сигналы —
+# к Bybit уходит один запрос. После завершения ключ освобождается: это не кэш.
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'calls': 0,
+            'executions': 0,
+            'collapsed': 0,
+            'errors': 0,
+            'maxWaiters': 0,
+        }
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args: Any) -> T:
+        '''fn(*args) для key; одновременные вызовы с тем же key разделяют один вызов fn.'''
+        with self._lock:
+            self.counters['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if not leader:
+                call.waiters += 1
+                self.counters['collapsed'] += 1
+                self.counters['maxWaiters'] = max(self.counters['maxWaiters'], call.waiters)
+            else:
+                call = self._calls[key] = _Call()
+                self.counters['executions'] += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.counters['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            counters['inFlight'] = len(self._calls)
+        calls = counters['calls']
+        counters['collapsedRatio'] = round(counters['collapsed'] / calls, 3) if calls else 0.0
+        return counters
+
+
+_flights: Dict[str, SingleFlight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_flight(name: str) -> SingleFlight:
+    '''Группа схлопывания по имени (kline, orderbook, signals, ...); создаётся при первом обращении.'''
+    flight = _flights.get(name)
+    if flight is None:
+        with _flights_lock:
+            flight = _flights.get(name)
+            if flight is None:
+                flight = _flights[name] = SingleFlight(name)
+    return flight
+
+
+def flight_stats() -> Dict[str, Any]:
+    return {name: flight.stats() for name, flight in list(_flights.items())}
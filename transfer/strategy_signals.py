@@ -1,39 +1,31 @@
-import json
-from typing import Dict, Any, List
-from urllib.request import Request, urlopen
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 
-BYBIT_BASE_URL = "https://api.bybit.com"
+from . import fast_json
+from .candle_store import get_candles
+from .market_stream import live_candles
+from .indicators import sma, rsi
+from .indicator_state import get_engine
+from .single_flight import get_flight
+
+MAX_BATCH_SYMBOLS = 50
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('STRATEGY_SIGNALS_CONCURRENCY', '8')),
+    thread_name_prefix='strategy-signals'
+)
 
 def calculate_ma(prices: List[float], period: int) -> float:
     if len(prices) < period:
         return prices[-1] if prices else 0
-    return sum(prices[-period:]) / period
+    return float(sma(prices[-period:], period)[-1])
 
 def calculate_rsi(prices: List[float], period: int = 14) -> float:
     if len(prices) < period + 1:
         return 50.0
     
-    gains = []
-    losses = []
-    
-    for i in range(1, len(prices)):
-        change = prices[i] - prices[i-1]
-        if change > 0:
-            gains.append(change)
-            losses.append(0)
-        else:
-            gains.append(0)
-            losses.append(abs(change))
-    
-    avg_gain = sum(gains[-period:]) / period
-    avg_loss = sum(losses[-period:]) / period
-    
-    if avg_loss == 0:
-        return 100.0
-    
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
+    return float(rsi(prices, period, method='simple')[-1])
 
 def analyze_ma_crossover(prices: List[float]) -> Dict[str, Any]:
     if len(prices) < 50:
@@ -41,11 +33,30 @@ def analyze_ma_crossover(prices: List[float]) -> Dict[str, Any]:
     
     ma20 = calculate_ma(prices, 20)
     ma50 = calculate_ma(prices, 50)
-    current_price = prices[-1]
     
     ma20_prev = calculate_ma(prices[:-1], 20)
     ma50_prev = calculate_ma(prices[:-1], 50)
     
+    return ma_crossover_signal(ma20, ma50, ma20_prev, ma50_prev)
+
+def analyze_ma_crossover_streaming(symbol: str, interval: str, klines: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    '''
+    То же, что analyze_ma_crossover, но SMA20/SMA50 берутся из потокового движка индикаторов:
+    закрытые свечи продвигают состояние пары один раз, формирующаяся только примеряется.
+    None — значений ещё нет (мало истории), тогда считается по всему ряду.
+    '''
+    if len(klines) < 50:
+        return None
+    engine = get_engine()
+    engine.register(symbol, interval, 'sma', 20)
+    engine.register(symbol, interval, 'sma', 50)
+    current, previous = engine.evaluate(symbol, interval, klines)
+    values = (current.get('sma20'), current.get('sma50'), previous.get('sma20'), previous.get('sma50'))
+    if None in values:
+        return None
+    return ma_crossover_signal(*values)
+
+def ma_crossover_signal(ma20: float, ma50: float, ma20_prev: float, ma50_prev: float) -> Dict[str, Any]:
     if ma20 > ma50 and ma20_prev <= ma50_prev:
         strength = min(100, int(((ma20 - ma50) / ma50) * 1000))
         return {'signal': 'buy', 'strength': strength, 'reason': f'MA20 пересекла MA50 вверх'}
@@ -84,12 +95,50 @@ def analyze_volume_spike(volumes: List[float]) -> Dict[str, Any]:
     else:
         return {'signal': 'neutral', 'strength': 30, 'reason': 'Объём в норме'}
 
+def get_symbol_signals(symbol: str, interval: str = '15') -> List[Dict[str, Any]]:
+    # Одновременные запросы сигналов по одной паре считаются один раз
+    return get_flight('signals').do((symbol, interval), compute_symbol_signals, symbol, interval)
+
+def compute_symbol_signals(symbol: str, interval: str = '15') -> List[Dict[str, Any]]:
+    klines = live_candles(symbol, interval, 200, 'spot') or get_candles(symbol, interval, 200, category='spot')
+    
+    if not klines:
+        raise RuntimeError('Failed to fetch data from Bybit')
+    
+    prices = [k['close'] for k in klines]
+    volumes = [k['volume'] for k in klines]
+    
+    ma_crossover = analyze_ma_crossover_streaming(symbol, interval, klines) or analyze_ma_crossover(prices)
+    
+    return [
+        {'strategy': 'MA Crossover', **ma_crossover},
+        {'strategy': 'RSI', **analyze_rsi(prices)},
+        {'strategy': 'Volume Spike', **analyze_volume_spike(volumes)}
+    ]
+
+def get_batch_signals(symbols: List[str], interval: str = '15') -> Dict[str, Dict[str, Any]]:
+    '''
+    Сигналы сразу по нескольким парам: свечи загружаются параллельно,
+    ошибка по одной паре не роняет весь ответ.
+    '''
+    futures = {symbol: _executor.submit(get_symbol_signals, symbol, interval) for symbol in symbols}
+    results = {}
+    
+    for symbol, future in futures.items():
+        try:
+            results[symbol] = {'success': True, 'data': future.result()}
+        except Exception as e:
+            results[symbol] = {'success': False, 'error': str(e)}
+    
+    return results
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Расчёт торговых сигналов (MA, RSI, Volume) для анализа крипто-пар
     Args: event - dict с httpMethod, queryStringParameters
+          (symbol=BTCUSDT или symbols=BTCUSDT,ETHUSDT,...; interval=15)
           context - объект с request_id
-    Returns: HTTP response с массивом сигналов
+    Returns: HTTP response с массивом сигналов (для symbols — сигналы по каждой паре)
     '''
     method = event.get('httpMethod', 'GET')
     
@@ -108,44 +157,43 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     if method == 'GET':
         params = event.get('queryStringParameters') or {}
+        interval = params.get('interval', '15')
+        
+        if params.get('symbols'):
+            symbols = [s.strip() for s in params['symbols'].split(',') if s.strip()][:MAX_BATCH_SYMBOLS]
+            results = get_batch_signals(symbols, interval)
+            
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': fast_json.dumps({
+                    'success': True,
+                    'interval': interval,
+                    'data': results,
+                    'signals': [
+                        {'symbol': symbol, **signal}
+                        for symbol, result in results.items() if result['success']
+                        for signal in result['data']
+                    ]
+                }),
+                'isBase64Encoded': False
+            }
+        
         symbol = params.get('symbol', 'BTCUSDT')
         
         try:
-            url = f"{BYBIT_BASE_URL}/v5/market/kline?category=spot&symbol={symbol}&interval=15&limit=200"
-            request = Request(url)
-            
-            with urlopen(request, timeout=10) as response:
-                data = json.loads(response.read().decode('utf-8'))
-            
-            if data.get('retCode') == 0:
-                klines = data.get('result', {}).get('list', [])
-                
-                prices = [float(k[4]) for k in reversed(klines)]
-                volumes = [float(k[5]) for k in reversed(klines)]
-                
-                signals = [
-                    {'strategy': 'MA Crossover', **analyze_ma_crossover(prices)},
-                    {'strategy': 'RSI', **analyze_rsi(prices)},
-                    {'strategy': 'Volume Spike', **analyze_volume_spike(volumes)}
-                ]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'success': True, 'data': signals}),
-                    'isBase64Encoded': False
-                }
+            signals = get_symbol_signals(symbol, interval)
             
             return {
-                'statusCode': 500,
+                'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'success': False, 'error': 'Failed to fetch data from Bybit'}),
+                'body': fast_json.dumps({'success': True, 'data': signals}),
                 'isBase64Encoded': False
             }
             
@@ -156,7 +204,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'success': False, 'error': str(e)}),
+                'body': fast_json.dumps({'success': False, 'error': str(e)}),
                 'isBase64Encoded': False
             }
     
@@ -166,6 +214,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*'
         },
-        'body': json.dumps({'success': False, 'error': 'Method not allowed'}),
+        'body': fast_json.dumps({'success': False, 'error': 'Method not allowed'}),
         'isBase64Encoded': False
     }
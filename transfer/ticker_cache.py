@@ -0,0 +1,161 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from .bybit_client import get_json
+from .resilience import stale_since
+
+logger = logging.getLogger(__name__)
+
+# Свежесть снимка тикеров (сек). В пределах TTL апстрим не вызывается вообще
+TICKER_CACHE_TTL = float(os.environ.get('TICKER_CACHE_TTL', '5'))
+# Сколько после TTL снимок ещё отдаётся сразу, пока в фоне идёт обновление
+TICKER_CACHE_STALE_TTL = float(os.environ.get('TICKER_CACHE_STALE_TTL', '30'))
+# Сколько максимум можно отдавать устаревший снимок, если Bybit отвечает ошибкой
+TICKER_CACHE_MAX_STALE = float(os.environ.get('TICKER_CACHE_MAX_STALE', '600'))
+# Ошибки обновления одной категории пишутся в лог не чаще раза в N секунд (все считаются в errors)
+TICKER_CACHE_ERROR_LOG_INTERVAL = float(os.environ.get('TICKER_CACHE_ERROR_LOG_INTERVAL', '60'))
+
+
+class TickerCache:
+    '''
+    Общий на процесс кэш полного списка тикеров Bybit по категориям (spot/linear).
+    Схема stale-while-revalidate: свежий снимок отдаётся из памяти, слегка
+    устаревший — тоже из памяти с фоновым обновлением, при ошибке апстрима
+    отдаётся последний удачный снимок.
+    '''
+
+    def __init__(self, ttl: float = TICKER_CACHE_TTL, stale_ttl: float = TICKER_CACHE_STALE_TTL,
+                 max_stale: float = TICKER_CACHE_MAX_STALE):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_stale = max_stale
+        self._snapshots: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._refreshing: set = set()
+        self._guard = threading.Lock()
+        self._error_logged_at: Dict[str, float] = {}
+        self.counters = {
+            'hits': 0,
+            'staleHits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'errors': 0,
+            'servedStaleOnError': 0,
+            'staleUpstream': 0,
+        }
+
+    def _count(self, name: str) -> None:
+        with self._guard:
+            self.counters[name] += 1
+
+    def _report_error(self, category: str, message: str) -> None:
+        '''Вызывается из except: считает ошибку и пишет её с трассировкой, если по категории давно не писали.'''
+        now = time.monotonic()
+        with self._guard:
+            self.counters['errors'] += 1
+            total = self.counters['errors']
+            last = self._error_logged_at.get(category)
+            if last is not None and now - last < TICKER_CACHE_ERROR_LOG_INTERVAL:
+                return
+            self._error_logged_at[category] = now
+        logger.warning('Ticker cache %s: %s (errors=%d)', category, message, total, exc_info=True)
+
+    def _lock_for(self, category: str) -> threading.Lock:
+        with self._guard:
+            if category not in self._locks:
+                self._locks[category] = threading.Lock()
+            return self._locks[category]
+
+    def _fetch(self, category: str) -> List[Dict[str, Any]]:
+        data = get_json('/v5/market/tickers', {'category': category})
+        if data.get('retCode') != 0:
+            raise RuntimeError(f"Bybit tickers error: {data.get('retMsg', 'unknown')}")
+        tickers = data.get('result', {}).get('list', [])
+        fetched_at = stale_since(data)
+        if fetched_at is not None:
+            # Ответ из резерва resilience: снимок получает время исходного ответа, а не текущее,
+            # и более свежий снимок не заменяет
+            self._count('staleUpstream')
+            snapshot = self._snapshots.get(category)
+            if snapshot and snapshot[0] >= fetched_at:
+                return snapshot[1]
+        self._snapshots[category] = (fetched_at or time.time(), tickers)
+        return tickers
+
+    def _refresh_in_background(self, category: str) -> None:
+        with self._guard:
+            if category in self._refreshing:
+                return
+            self._refreshing.add(category)
+
+        def run() -> None:
+            try:
+                with self._lock_for(category):
+                    self._fetch(category)
+                self._count('refreshes')
+            except Exception:
+                self._report_error(category, 'background refresh failed')
+            finally:
+                with self._guard:
+                    self._refreshing.discard(category)
+
+        threading.Thread(target=run, name=f'ticker-refresh-{category}', daemon=True).start()
+
+    def get(self, category: str = 'spot') -> List[Dict[str, Any]]:
+        snapshot = self._snapshots.get(category)
+        if snapshot:
+            age = time.time() - snapshot[0]
+            if age < self.ttl:
+                self._count('hits')
+                return snapshot[1]
+            if age < self.ttl + self.stale_ttl:
+                self._count('staleHits')
+                self._refresh_in_background(category)
+                return snapshot[1]
+
+        with self._lock_for(category):
+            # Пока ждали блокировку, снимок мог обновить другой поток
+            snapshot = self._snapshots.get(category)
+            if snapshot and time.time() - snapshot[0] < self.ttl:
+                self._count('hits')
+                return snapshot[1]
+
+            self._count('misses')
+            try:
+                return self._fetch(category)
+            except Exception:
+                if snapshot and time.time() - snapshot[0] < self.max_stale:
+                    # Ошибка не дойдёт до вызывающего — пишем её в лог здесь
+                    self._report_error(category, 'refresh failed, serving the previous snapshot')
+                    self._count('servedStaleOnError')
+                    return snapshot[1]
+                self._count('errors')
+                raise
+
+    def fetched_at(self, category: str = 'spot') -> Optional[float]:
+        snapshot = self._snapshots.get(category)
+        return snapshot[0] if snapshot else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._guard:
+            counters = dict(self.counters)
+        now = time.time()
+        counters['snapshotAge'] = {
+            category: round(now - fetched_at, 3)
+            for category, (fetched_at, _) in self._snapshots.items()
+        }
+        return counters
+
+
+_cache = TickerCache()
+
+
+def get_tickers(category: str = 'spot') -> List[Dict[str, Any]]:
+    return _cache.get(category)
+
+
+def cache_stats() -> Dict[str, Any]:
+    return _cache.stats()
@@ -0,0 +1,386 @@
+import argparse
+import random
+import time
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from . import fast_json
+from .backtest import DEFAULT_CONFIG, STRATEGIES, generate_signals, metrics, normalize_config, simulate
+from .optimizer import (
+    MAX_SYMBOLS, OBJECTIVES, OPTIMIZER_MAX_COMBINATIONS, OPTIMIZER_TASK_SIZE, OPTIMIZER_WORKERS,
+    Optimizer, OptimizerBusy, Series, grid_combinations, load_history, parse_param,
+    random_combinations, server_workers,
+)
+
+# Walk-forward: история режется на скользящие окна train/test. На каждом train-отрезке
+# выбираются лучшие параметры, и они же проверяются на следующем за ним test-отрезке,
+# которого подбор не видел. Сигналы для сочетания параметров считаются один раз по всей
+# истории (индикаторы — через кэш символа), а окна — это срезы готовых массивов,
+# поэтому перекрывающиеся train-окна не пересчитывают индикаторы заново.
+#   python -m functions.walk_forward --symbols BTCUSDT,ETHUSDT --limit 5000 --strategy ema-rsi \
+#       --train 1500 --test 500 --param fast=5:15 --param slow=18:40:2
+
+SEARCHES = ('grid', 'random')
+
+Window = Tuple[int, int, int]
+
+
+def window_bounds(n: int, train: int, test: int, step: Optional[int] = None,
+                  anchored: bool = False) -> List[Window]:
+    '''
+    Окна (начало train, конец train = начало test, конец test) по индексам свечей.
+    Последнее окно заканчивается на последней свече; anchored=True — train всегда с начала истории.
+    '''
+    step = step or test
+    if train <= 0 or test <= 0 or step <= 0:
+        raise ValueError('train, test and step must be positive')
+    if train + test > n:
+        raise ValueError(f'Not enough candles: {n} < train + test ({train + test})')
+    offset = (n - train - test) % step
+    windows = []
+    for start in range(offset, n - train - test + 1, step):
+        windows.append((0 if anchored else start, start + train, start + train + test))
+    return windows
+
+
+def _slice_metrics(times, close: np.ndarray, signals: np.ndarray, config: Dict[str, Any],
+                   start: int, end: int) -> Tuple[Dict[str, Any], int]:
+    trades, equity_curve, final_equity = simulate(times[start:end], close[start:end], signals[start:end], config)
+    return metrics(trades, equity_curve, config['initialCapital'], final_equity), len(trades)
+
+
+def evaluate_windows(series: Series, cache: Dict[tuple, Any], config: Dict[str, Any],
+                     combos: List[Dict[str, float]], windows: List[Window],
+                     objective: str) -> List[List[Tuple[float, int, Dict[str, Any]]]]:
+    '''
+    Для каждого сочетания и окна: (objective на train, сделок на train, метрики test).
+    Сигналы считаются один раз на сочетание, окна — срезы.
+    '''
+    times, high, low, close = series
+    results = []
+    for params in combos:
+        signals = generate_signals(config['strategy'], close, high, low, params, cache)
+        per_window = []
+        for train_start, train_end, test_end in windows:
+            train, train_trades = _slice_metrics(times, close, signals, config, train_start, train_end)
+            test, test_trades = _slice_metrics(times, close, signals, config, train_end, test_end)
+            per_window.append((train[objective], train_trades, {**test, 'trades': test_trades}))
+        results.append(per_window)
+    return results
+
+
+def window_groups(windows: int, batches: int, workers: int) -> List[Tuple[int, int]]:
+    '''Диапазоны окон [first, last) на задачу: задач примерно вдвое больше воркеров, если окон хватает.'''
+    count = max(1, min(windows, -(-workers * 2 // batches)))
+    bounds = [round(i * windows / count) for i in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _align(series: Dict[str, Series]) -> Dict[str, Series]:
+    '''Обрезает историю всех символов до общей длины (последние свечи), чтобы окна совпадали.'''
+    length = min(arrays[0].shape[0] for arrays in series.values())
+    return {symbol: tuple(a[-length:] for a in arrays) for symbol, arrays in series.items()}
+
+
+def walk_forward(series: Dict[str, Series], strategy: str, space: Dict[str, Any], train: int, test: int,
+                 step: Optional[int] = None, anchored: bool = False, search: str = 'grid', samples: int = 200,
+                 config: Optional[Dict[str, Any]] = None, objective: str = 'sharpeRatio', min_trades: int = 1,
+                 workers: int = OPTIMIZER_WORKERS, seed: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Walk-forward по стратегии. Пустой space — проверка текущих параметров по умолчанию
+    вне выборки без подбора.
+    '''
+    if search not in SEARCHES:
+        raise ValueError(f"search must be one of: {', '.join(SEARCHES)}")
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of: {', '.join(OBJECTIVES)}")
+    if not series:
+        raise ValueError('No candle history to evaluate')
+    base = normalize_config({**(config or {}), 'strategy': strategy})
+    unknown = set(space) - set(base['params'])
+    if unknown:
+        raise ValueError(f"Unknown parameters for {strategy}: {', '.join(sorted(unknown))}")
+
+    series = _align(series)
+    times = next(iter(series.values()))[0]
+    windows = window_bounds(times.shape[0], train, test, step, anchored)
+    if not space:
+        combos = [base['params']]
+    elif search == 'grid':
+        combos = grid_combinations(strategy, space)
+    else:
+        combos = random_combinations(strategy, space, min(samples, OPTIMIZER_MAX_COMBINATIONS), random.Random(seed))
+    if not combos:
+        raise ValueError('No valid parameter combinations')
+
+    started = time.perf_counter()
+    batches = [
+        (start, symbol, combos[start:start + OPTIMIZER_TASK_SIZE])
+        for start in range(0, len(combos), OPTIMIZER_TASK_SIZE)
+        for symbol in series
+    ]
+    # Окна тоже делятся между задачами, чтобы даже один символ с одним сочетанием занял все воркеры.
+    # Сигналы сочетания каждая задача считает заново, но индикаторы берёт из кэша символа воркера.
+    groups = window_groups(len(windows), len(batches), server_workers(workers))
+    tasks = [(start, symbol, batch, first, last) for start, symbol, batch in batches for first, last in groups]
+    # results[символ][сочетание][окно]
+    results: Dict[str, List[List[Any]]] = {symbol: [[None] * len(windows) for _ in combos] for symbol in series}
+    with Optimizer(series, base, objective, min_trades, workers) as optimizer:
+        done = optimizer.map(evaluate_windows, [
+            (symbol, (base, batch, windows[first:last], objective)) for _, symbol, batch, first, last in tasks
+        ])
+        for (start, symbol, batch, first, last), batch_results in zip(tasks, done):
+            for offset, per_window in enumerate(batch_results):
+                results[symbol][start + offset][first:last] = per_window
+
+    direction = OBJECTIVES[objective]
+    symbols = list(series)
+    report = []
+    for w, (train_start, train_end, test_end) in enumerate(windows):
+        bounds = {
+            'window': w,
+            'trainStart': int(times[train_start]),
+            'trainEnd': int(times[train_end - 1]),
+            'testStart': int(times[train_end]),
+            'testEnd': int(times[test_end - 1]),
+        }
+        # Сочетание выбирается по среднему objective на train по всем символам
+        train_scores = np.array([np.mean([results[s][c][w][0] for s in symbols]) for c in range(len(combos))])
+        train_trades = np.array([np.mean([results[s][c][w][1] for s in symbols]) for c in range(len(combos))])
+        eligible = train_trades >= min_trades
+        if not eligible.any():
+            # Ни одно сочетание не набрало min_trades на train: выбирать не из чего, окно не оценивается
+            report.append({**bounds, 'skipped': True, 'params': None,
+                           'maxTrainTrades': float(train_trades.max())})
+            continue
+        best = int(np.argmax(np.where(eligible, train_scores * direction, -np.inf)))
+        tests = {s: results[s][best][w][2] for s in symbols}
+
+        def mean(name: str) -> float:
+            return float(np.mean([m[name] for m in tests.values()]))
+
+        report.append({
+            **bounds,
+            'skipped': False,
+            'params': combos[best],
+            'trainScore': float(train_scores[best]),
+            'trainTrades': float(train_trades[best]),
+            'testScore': mean(objective),
+            'test': {
+                'sharpeRatio': mean('sharpeRatio'),
+                'totalPnLPercent': mean('totalPnLPercent'),
+                'winRate': mean('winRate'),
+                'profitFactor': mean('profitFactor'),
+                'maxDrawdownPercent': mean('maxDrawdownPercent'),
+                'trades': int(sum(m['trades'] for m in tests.values()))
+            },
+            'perSymbol': {
+                s: {objective: m[objective], 'totalPnLPercent': m['totalPnLPercent'], 'trades': m['trades']}
+                for s, m in tests.items()
+            }
+        })
+
+    evaluated = [r for r in report if not r['skipped']]
+    if not evaluated:
+        raise ValueError(f'No window has a parameter combination with at least {min_trades} trades on train')
+    train_mean = float(np.mean([r['trainScore'] for r in evaluated]))
+    test_mean = float(np.mean([r['testScore'] for r in evaluated]))
+    test_returns = [r['test']['totalPnLPercent'] for r in evaluated]
+    stability = Counter(tuple(sorted(r['params'].items())) for r in evaluated).most_common(1)[0]
+
+    return {
+        'strategy': strategy,
+        'objective': objective,
+        'combinations': len(combos),
+        'symbols': symbols,
+        'candles': int(times.shape[0]),
+        'train': train,
+        'test': test,
+        'step': step or test,
+        'anchored': anchored,
+        'config': {key: base[key] for key in DEFAULT_CONFIG if key != 'strategy'},
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 1),
+        'windows': report,
+        'aggregate': {
+            'trainScore': train_mean,
+            'testScore': test_mean,
+            # Какую долю результата на train стратегия сохраняет вне выборки
+            'efficiency': test_mean / train_mean if train_mean else 0,
+            'profitableWindows': sum(1 for r in test_returns if r > 0),
+            # Окна без сочетания с min_trades сделками на train в сводку не входят
+            'windows': len(evaluated),
+            'skippedWindows': len(report) - len(evaluated),
+            'compoundedTestPnLPercent': (float(np.prod([1 + r / 100 for r in test_returns])) - 1) * 100,
+            'testTrades': sum(r['test']['trades'] for r in evaluated),
+            'mostFrequentParams': dict(stability[0]),
+            'mostFrequentParamsWindows': stability[1]
+        }
+    }
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Walk-forward проверка стратегий вне выборки
+    Args: event - POST с body {"symbols": [...], "interval": "60", "limit": 5000, "category": "linear",
+                  "strategy": "ema-rsi", "train": 1500, "test": 500, "step": 500, "anchored": false,
+                  "params": {"fast": {"min": 5, "max": 15}}, "search": "grid|random", "samples": 200,
+                  "objective": "sharpeRatio", "minTrades": 3, "config": {"leverage": 2}}
+          context - объект с request_id
+    Returns: Параметры и метрики по каждому окну и сводка по всем окнам
+    '''
+    method = event.get('httpMethod', 'POST')
+
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+
+    try:
+        request = fast_json.loads(event.get('body') or '{}')
+        symbols = request.get('symbols') or ['BTCUSDT']
+        if isinstance(symbols, str):
+            symbols = [s.strip() for s in symbols.split(',') if s.strip()]
+        strategy = request.get('strategy', 'ma-crossover')
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of: {', '.join(STRATEGIES)}")
+
+        series, skipped = load_history(symbols[:MAX_SYMBOLS], str(request.get('interval', '60')),
+                                       int(request.get('limit', 5000)), request.get('category', 'linear'))
+        result = walk_forward(
+            series,
+            strategy,
+            request.get('params') or {},
+            train=int(request.get('train', 1500)),
+            test=int(request.get('test', 500)),
+            step=int(request['step']) if request.get('step') else None,
+            anchored=bool(request.get('anchored', False)),
+            search=request.get('search', 'grid'),
+            samples=int(request.get('samples', 200)),
+            config=request.get('config'),
+            objective=request.get('objective', 'sharpeRatio'),
+            min_trades=int(request.get('minTrades', 1)),
+            workers=int(request.get('workers', OPTIMIZER_WORKERS)),
+            seed=request.get('seed')
+        )
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': True, 'skippedSymbols': skipped, **result}),
+            'isBase64Encoded': False
+        }
+
+    except OptimizerBusy as e:
+        return {
+            'statusCode': 503,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Retry-After': '30'
+            },
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    except (ValueError, KeyError, TypeError) as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': fast_json.dumps({'success': False, 'error': str(e)}),
+            'isBase64Encoded': False
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Walk-forward out-of-sample evaluation of a strategy')
+    parser.add_argument('--symbols', default='BTCUSDT')
+    parser.add_argument('--interval', default='60')
+    parser.add_argument('--limit', type=int, default=5000)
+    parser.add_argument('--category', default='linear')
+    parser.add_argument('--strategy', default='ma-crossover', choices=STRATEGIES)
+    parser.add_argument('--train', type=int, default=1500, help='candles per train window')
+    parser.add_argument('--test', type=int, default=500, help='candles per test window')
+    parser.add_argument('--step', type=int, help='shift between windows (default: --test)')
+    parser.add_argument('--anchored', action='store_true', help='train windows always start at the first candle')
+    parser.add_argument('--param', action='append', default=[], help='name=5,9,12 or name=min:max[:step]')
+    parser.add_argument('--search', default='grid', choices=SEARCHES)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--objective', default='sharpeRatio', choices=list(OBJECTIVES))
+    parser.add_argument('--min-trades', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=OPTIMIZER_WORKERS)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--leverage', type=float)
+    parser.add_argument('--stop-loss', type=float)
+    parser.add_argument('--take-profit', type=float)
+    parser.add_argument('--json', action='store_true', help='print the full result as JSON')
+    args = parser.parse_args()
+
+    config = {'leverage': args.leverage, 'stopLoss': args.stop_loss, 'takeProfit': args.take_profit}
+    symbols = [s.strip() for s in args.symbols.split(',') if s.strip()]
+    series, skipped = load_history(symbols, args.interval, args.limit, args.category)
+    if skipped:
+        print(f"skipped (no candles): {', '.join(skipped)}")
+    result = walk_forward(series, args.strategy, dict(parse_param(p) for p in args.param), args.train,
+                          args.test, args.step, args.anchored, args.search, args.samples, config,
+                          args.objective, args.min_trades, args.workers, args.seed)
+
+    if args.json:
+        print(fast_json.dumps(result))
+        return
+    print(f"{len(result['windows'])} windows × {result['combinations']} combinations × "
+          f"{len(result['symbols'])} symbols in {result['elapsedMs'] / 1000:.1f} s")
+    for item in result['windows']:
+        if item['skipped']:
+            print(f"{item['window']:3}. skipped: no combination with {args.min_trades} trades on train "
+                  f"(max {item['maxTrainTrades']:.0f})")
+            continue
+        params = ' '.join(f'{k}={v}' for k, v in item['params'].items())
+        print(f"{item['window']:3}. train {item['trainScore']:8.3f}  test {item['testScore']:8.3f}  "
+              f"test pnl={item['test']['totalPnLPercent']:7.2f}%  trades={item['test']['trades']:4}  {params}")
+    aggregate = result['aggregate']
+    print(f"mean train {aggregate['trainScore']:.3f}, mean test {aggregate['testScore']:.3f}, "
+          f"efficiency {aggregate['efficiency']:.2f}, profitable windows "
+          f"{aggregate['profitableWindows']}/{aggregate['windows']} (skipped {aggregate['skippedWindows']}), "
+          f"compounded test pnl {aggregate['compoundedTestPnLPercent']:.2f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import json
+import os
+from typing import Dict, Any, List, Set
+
+import websockets
+
+# Локальная замена публичного WebSocket Bybit: проигрывает записанные сообщения
+# (формат MARKET_STREAM_RECORD_PATH: по строке {"t": время, "message": {...}}).
+# Нужна, чтобы гонять market_stream без сети:
+#   python -m functions.ws_replay_server --port 8765
+#   BYBIT_WS_SPOT_URL=ws://127.0.0.1:8765 MARKET_STREAM_ENABLED=1 uvicorn main:app
+
+DEFAULT_RECORDING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ws_replay', 'bybit_spot_sample.jsonl')
+
+
+def load_recording(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplaySession:
+    '''Одно клиентское подключение: свои подписки и своё состояние стаканов.'''
+
+    def __init__(self, ws, recording: List[Dict[str, Any]], speed: float, disconnect_after: int):
+        self.ws = ws
+        self.recording = recording
+        self.speed = speed
+        self.disconnect_after = disconnect_after
+        self.topics: Set[str] = set()
+        self.books: Dict[str, Dict[str, Any]] = {}
+
+    def _track_book(self, message: Dict[str, Any]) -> None:
+        topic = message['topic']
+        data = message['data']
+        if message.get('type') == 'snapshot':
+            self.books[topic] = {
+                'b': {p: s for p, s in data.get('b', [])},
+                'a': {p: s for p, s in data.get('a', [])},
+                'u': data.get('u'),
+                'seq': data.get('seq'),
+                's': data.get('s')
+            }
+            return
+        book = self.books.get(topic)
+        if book is None:
+            return
+        for key in ('b', 'a'):
+            for price, size in data.get(key, []):
+                if float(size) == 0:
+                    book[key].pop(price, None)
+                else:
+                    book[key][price] = size
+        book['u'] = data.get('u')
+        book['seq'] = data.get('seq')
+
+    async def _send_book_snapshot(self, topic: str) -> None:
+        # Как и Bybit, на (пере)подписку стакана отвечаем полным снимком текущего состояния
+        book = self.books.get(topic)
+        if book is None:
+            return
+        await self.ws.send(json.dumps({
+            'topic': topic,
+            'type': 'snapshot',
+            'data': {
+                's': book['s'],
+                'b': sorted(([p, s] for p, s in book['b'].items()), key=lambda x: -float(x[0])),
+                'a': sorted(([p, s] for p, s in book['a'].items()), key=lambda x: float(x[0])),
+                'u': book['u'],
+                'seq': book['seq']
+            }
+        }))
+
+    async def handle_requests(self) -> None:
+        async for raw in self.ws:
+            request = json.loads(raw)
+            op = request.get('op')
+            if op == 'ping':
+                await self.ws.send(json.dumps({'success': True, 'ret_msg': 'pong', 'op': 'ping'}))
+            elif op == 'subscribe':
+                self.topics.update(request.get('args', []))
+                await self.ws.send(json.dumps({
+                    'success': True, 'ret_msg': '', 'op': 'subscribe', 'req_id': request.get('req_id')
+                }))
+                for topic in request.get('args', []):
+                    if topic.startswith('orderbook.'):
+                        await self._send_book_snapshot(topic)
+            elif op == 'unsubscribe':
+                self.topics.difference_update(request.get('args', []))
+
+    async def replay(self) -> None:
+        # Даём клиенту время подписаться
+        await asyncio.sleep(0.05)
+        previous_t = None
+        sent = 0
+        for record in self.recording:
+            message = record['message']
+            if previous_t is not None and self.speed > 0:
+                await asyncio.sleep(max(0.0, (record['t'] - previous_t) / self.speed))
+            previous_t = record['t']
+
+            topic = message.get('topic', '')
+            if topic.startswith('orderbook.'):
+                self._track_book(message)
+            if topic not in self.topics:
+                continue
+
+            await self.ws.send(json.dumps(message))
+            sent += 1
+            if self.disconnect_after and sent >= self.disconnect_after:
+                await self.ws.close()
+                return
+
+
+def make_handler(recording: List[Dict[str, Any]], speed: float, disconnect_after: int):
+    async def handle(ws, path=None) -> None:
+        session = ReplaySession(ws, recording, speed, disconnect_after)
+        requests_task = asyncio.ensure_future(session.handle_requests())
+        try:
+            await session.replay()
+            await requests_task
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            requests_task.cancel()
+    return handle
+
+
+async def serve(host: str, port: int, recording_path: str = DEFAULT_RECORDING, speed: float = 1.0,
+                disconnect_after: int = 0):
+    recording = load_recording(recording_path)
+    return await websockets.serve(make_handler(recording, speed, disconnect_after), host, port)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay recorded Bybit public WebSocket messages')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--recording', default=DEFAULT_RECORDING)
+    parser.add_argument('--speed', type=float, default=1.0, help='0 — без пауз между сообщениями')
+    parser.add_argument('--disconnect-after', type=int, default=0,
+                        help='разорвать соединение после N сообщений (проверка переподключения)')
+    args = parser.parse_args()
+
+    async def run() -> None:
+        server = await serve(args.host, args.port, args.recording, args.speed, args.disconnect_after)
+        await server.wait_closed()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()